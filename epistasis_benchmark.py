@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+"""
+Benchmarks the node computation on synthetic data
+
+generate_dataset() writes a dataset that looks like the server's input:
+<dataset>.FULL and <dataset>.FILTERED beds (the same SNPs, as the server
+makes them), <dataset>.pheno.txt and optionally <dataset>.covar.txt. SNPs are
+spread evenly over n_chroms chromosomes. Genotypes are either outbred
+(Hardy-Weinberg with a uniform MAF) or, with strains, inbred: every strain is
+a homozygous mosaic of n_founders founder haplotypes that switches founder
+at random recombination points along each chromosome, and individuals are
+replicates of the strains, as in panels of recombinant inbred mice. The
+phenotypes are polygenic with heritability h2.
+
+run_benchmark() precomputes the G0 decomposition once and then runs
+epistasis_node.run_fastlmmc on the first tile of a plan for every group size
+and engine, each in a fresh process like a cluster job. Pairs per second and
+peak memory are taken from the job's timing record (epistasis_timing). The
+report is JSON, so runs on different machines or commits can be compared
+with --baseline.
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import socket
+import platform
+import tempfile
+import multiprocessing
+import numpy as np
+
+from epistasis_tped import BED_MAGIC, HOM_A1, HET, HOM_A2, pack_bed
+from epistasis_planner import make_plan, write_plan, block_pairs, estimate_pair_seconds
+from epistasis_timing import read_timings
+
+# SNPs generated at a time
+CHUNK_SNPS = 4096
+
+# bp per chromosome and expected recombinations per bp in a strain
+CHROM_BP = 100000000
+RECOMBINATION_RATE = 1e-8
+
+
+def founder_labels(n_strains, n_founders, positions, rng, state=None):
+	'''
+	Founder of every strain at every position (strains x SNPs), switching
+	founder with the probability of a recombination since the last SNP.
+	state is the founder of each strain at the SNP before positions
+	'''
+	spacing = np.diff(np.r_[positions[0], positions])
+	switch = rng.random_sample((n_strains, len(positions))) < 1 - np.exp(-spacing * RECOMBINATION_RATE)
+	if state is None:
+		switch[:, 0] = True
+	new = rng.randint(n_founders, size=(n_strains, len(positions)))
+	# index of the last switch at or before every SNP
+	last = np.maximum.accumulate(np.where(switch, np.arange(len(positions)), -1), axis=1)
+	labels = np.take_along_axis(new, np.maximum(last, 0), axis=1)
+	if state is not None:
+		labels = np.where(last >= 0, labels, state[:, None])
+	return labels
+
+
+def generate_dataset(dataloc, dataset, n_indivs=500, n_snps=2000, n_chroms=19, strains=None, n_founders=8,
+					 n_phenotypes=1, n_covariates=0, h2=0.5, n_causal=100, seed=0):
+	'''
+	Writes dataloc/dataset.FULL/.FILTERED.bed/.bim/.fam, .pheno.txt and,
+	with n_covariates, .covar.txt. Returns the dataset prefix
+	'''
+	rng = np.random.RandomState(seed)
+	prefix = os.path.join(dataloc, dataset)
+	full = prefix + '.FULL'
+	per_chrom = int(np.ceil(n_snps / float(n_chroms)))
+	chrom = np.arange(n_snps) // per_chrom + 1
+	bp = (np.arange(n_snps) % per_chrom + 1) * (CHROM_BP // (per_chrom + 1))
+	strain = None
+	if strains:
+		strain = np.arange(n_indivs) % strains
+
+	f = open(full + '.fam', 'w')
+	for i in range(n_indivs):
+		f.write('f%s i%s 0 0 0 0\n' % (i, i))
+	f.close()
+	f = open(full + '.bim', 'w')
+	for j in range(n_snps):
+		f.write('%s\trs%s\t0\t%s\tA\tG\n' % (chrom[j], j, bp[j]))
+	f.close()
+
+	causal = np.sort(rng.choice(n_snps, min(n_causal, n_snps), replace=False))
+	G_causal = np.empty((n_indivs, len(causal)))
+	bed = open(full + '.bed', 'wb')
+	bed.write(BED_MAGIC)
+	state = None
+	for start in range(0, n_snps, CHUNK_SNPS):
+		end = min(start + CHUNK_SNPS, n_snps)
+		maf = rng.uniform(0.05, 0.5, size=end - start)
+		if strain is None:
+			dose = rng.binomial(2, maf, size=(n_indivs, end - start))
+		else:
+			# founders only change within a chromosome
+			founders = (rng.random_sample((n_founders, end - start)) < maf).astype(np.int64)
+			labels = np.empty((strains, end - start), dtype=np.int64)
+			for c in np.unique(chrom[start:end]):
+				at = np.flatnonzero(chrom[start:end] == c)
+				first = state if start + at[0] > 0 and chrom[start + at[0] - 1] == c else None
+				labels[:, at] = founder_labels(strains, n_founders, bp[start + at], rng, first)
+				state = labels[:, at[-1]]
+			dose = 2 * founders[labels, np.arange(end - start)][strain]
+		bed.write(pack_bed(np.choose(dose.T, [HOM_A2, HET, HOM_A1]).astype(np.uint8)).tobytes())
+		in_chunk = (causal >= start) & (causal < end)
+		G_causal[:, in_chunk] = dose[:, causal[in_chunk] - start]
+	bed.close()
+	for suffix in ['.bed', '.bim', '.fam']:
+		shutil.copyfile(full + suffix, prefix + '.FILTERED' + suffix)
+
+	# standardized causal genotypes, monomorphic ones contribute nothing
+	sd = G_causal.std(axis=0)
+	G_causal = (G_causal - G_causal.mean(axis=0)) / np.where(sd > 0, sd, 1)
+	genetic = G_causal.dot(rng.normal(size=(len(causal), n_phenotypes)))
+	genetic = genetic / np.where(genetic.std(axis=0) > 0, genetic.std(axis=0), 1)
+	pheno = np.sqrt(h2) * genetic + np.sqrt(1 - h2) * rng.normal(size=(n_indivs, n_phenotypes))
+	write_table(prefix + '.pheno.txt', ['t%s' % (k + 1) for k in range(n_phenotypes)], pheno)
+	if n_covariates:
+		write_table(prefix + '.covar.txt', ['c%s' % (k + 1) for k in range(n_covariates)], rng.normal(size=(n_indivs, n_covariates)))
+	return prefix
+
+
+def write_table(filename, headers, values):
+	f = open(filename, 'w')
+	f.write('\t'.join(['FID', 'IID'] + headers) + '\n')
+	for i, row in enumerate(values):
+		f.write('\t'.join(['f%s' % i, 'i%s' % i] + ['%.4f' % value for value in row]) + '\n')
+	f.close()
+
+
+def run_case(datadir, dataset, plan_file, output_dir, options):
+	'''
+	Runs tile 0 of plan_file in this process, as a job would
+	'''
+	os.chdir(datadir)
+	from epistasis_node import run_fastlmmc
+	run_fastlmmc(dataset, output_dir, [0], plan_file, **options)
+
+
+def benchmark_case(datadir, dataset, n_snps, n_indivs, group_size, engine, options, repeat=1):
+	'''
+	Times the first tile of a plan with group_size, an off-diagonal block of
+	group_size x group_size pairs, repeat times in fresh processes. Returns
+	the case's dict for the report with the median over the repeats
+	'''
+	plan_file = os.path.join(datadir, '%s.g%s.plan.txt' % (dataset, group_size))
+	tiles = make_plan(n_snps, group_size)
+	write_plan(plan_file, tiles, n_snps, group_size)
+	pairs = sum(block_pairs(block) for block in tiles[0])
+
+	context = multiprocessing.get_context('spawn')
+	runs = []
+	for r in range(repeat):
+		output_dir = tempfile.mkdtemp(prefix='benchmark', dir=datadir)
+		process = context.Process(target=run_case, args=(datadir, dataset, plan_file, output_dir, dict(options, engine=engine)))
+		process.start()
+		process.join()
+		records = read_timings(output_dir, dataset)
+		shutil.rmtree(output_dir)
+		if process.exitcode != 0 or not records:
+			raise Exception('%s engine with group size %s failed (exit code %s)' % (engine, group_size, process.exitcode))
+		runs.append(records[0])
+
+	seconds = [run['tiles'][0]['epistasis'] for run in runs]
+	phenotypes = runs[0]['tiles'][0]['phenotypes']
+	return {'engine': engine,
+			'group_size': group_size,
+			'pairs': pairs * phenotypes,
+			'seconds': float(np.median(seconds)),
+			'seconds_all': seconds,
+			'pairs_per_second': pairs * phenotypes / float(np.median(seconds)),
+			'job_seconds': float(np.median([run['wall'] for run in runs])),
+			'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+			'epistasis_peak_rss_mb': max(run['phases']['epistasis']['peak_rss_mb'] for run in runs),
+			'planner_pairs_per_second': 1.0 / estimate_pair_seconds(n_indivs, engine, options.get('screen'))}
+
+
+def run_benchmark(datadir, dataset, group_sizes, engines, generate_args, repeat=1, covariates=False, **options):
+	'''
+	Generates the dataset, precomputes G0 and benchmarks every engine and
+	group size. Returns the report dict
+	'''
+	from epistasis_kinship import KINSHIP_FILE, precompute_kinship
+
+	n_snps, n_indivs = generate_args['n_snps'], generate_args['n_indivs']
+	if max(group_sizes) * 2 > n_snps:
+		raise Exception('%s SNPs are too few for a %s x %s block, use more SNPs or smaller groups' % (n_snps, max(group_sizes), max(group_sizes)))
+
+	start = time.time()
+	prefix = generate_dataset(datadir, dataset, **generate_args)
+	generate_seconds = time.time() - start
+
+	covFile = None
+	if covariates:
+		covFile = os.path.abspath(prefix + '.covar.txt')
+	start = time.time()
+	precompute_kinship(prefix, covFile, prefix + KINSHIP_FILE, all_phenotypes=options.get('all_phenotypes', False))
+	kinship_seconds = time.time() - start
+
+	report = {'host': socket.gethostname(),
+			  'platform': platform.platform(),
+			  'python': platform.python_version(),
+			  'numpy': np.__version__,
+			  'cpu_count': multiprocessing.cpu_count(),
+			  'blas_threads': os.environ.get('OMP_NUM_THREADS'),
+			  'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+			  'dataset': generate_args,
+			  'options': options,
+			  'generate_seconds': generate_seconds,
+			  'kinship_seconds': kinship_seconds,
+			  'cases': []}
+	for engine in engines:
+		for group_size in group_sizes:
+			case = benchmark_case(os.path.abspath(datadir), dataset, n_snps, n_indivs, group_size, engine, dict(options, covFile=covFile), repeat)
+			sys.stderr.write('%(engine)s, group size %(group_size)s: %(pairs)s pairs in %(seconds).2f s, %(pairs_per_second).0f pairs/s, peak %(peak_rss_mb).0f MB\n' % case)
+			report['cases'].append(case)
+	return report
+
+
+def compare(report, baseline, tolerance=0.2):
+	'''
+	Lines comparing the throughput of the cases found in both reports, and
+	whether any case got slower than baseline by more than tolerance
+	'''
+	lines = []
+	slower = False
+	if baseline['dataset'] != report['dataset']:
+		lines.append('note: the baseline used a different synthetic dataset')
+	previous = dict(((case['engine'], case['group_size']), case) for case in baseline['cases'])
+	for case in report['cases']:
+		key = (case['engine'], case['group_size'])
+		if key not in previous:
+			continue
+		ratio = case['pairs_per_second'] / previous[key]['pairs_per_second']
+		regression = ratio < 1 - tolerance
+		slower = slower or regression
+		lines.append('%s, group size %s: %.0f pairs/s, baseline %.0f (%+.0f%%)%s' % (case['engine'], case['group_size'], case['pairs_per_second'],
+					 previous[key]['pairs_per_second'], 100 * (ratio - 1), ['', ' REGRESSION'][regression]))
+	return lines, slower
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	from epistasis_local import set_blas_threads
+	parser = ArgumentParser(description='benchmarks epistasis_node on synthetic data and writes a JSON report')
+	parser.add_argument('-n', '--individuals', dest='n_indivs', help='number of individuals',
+						default=500, type=int, action='store')
+	parser.add_argument('-m', '--snps', dest='n_snps', help='number of SNPs',
+						default=2000, type=int, action='store')
+	parser.add_argument('--chromosomes', dest='n_chroms', help='number of chromosomes the SNPs are spread over',
+						default=19, type=int, action='store')
+	parser.add_argument('--strains', dest='strains', help='inbred structure: individuals are replicates of this many strains',
+						default=None, type=int, action='store')
+	parser.add_argument('--founders', dest='n_founders', help='founder haplotypes the inbred strains are mosaics of',
+						default=8, type=int, action='store')
+	parser.add_argument('--phenotypes', dest='n_phenotypes', help='number of phenotype columns (tested together with -a)',
+						default=1, type=int, action='store')
+	parser.add_argument('--covariates', dest='n_covariates', help='number of covariates',
+						default=0, type=int, action='store')
+	parser.add_argument('--seed', dest='seed', help='random seed',
+						default=0, type=int, action='store')
+	parser.add_argument('-g', '--group-sizes', dest='group_sizes', metavar='SIZE', nargs='+', help='group sizes of the benchmarked tiles',
+						default=[25, 50, 100], type=int, action='store')
+	parser.add_argument('--engine', dest='engines', nargs='+', help='engines to benchmark',
+						default=['fastlmm', 'numpy'], choices=['fastlmm', 'numpy'], action='store')
+	parser.add_argument('--screen', dest='screen', help='benchmark screened runs at this P',
+						default=None, type=float, action='store')
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='test all phenotype columns in one pass',
+						default=False, action='store_true')
+	parser.add_argument('--dtype', dest='dtype', help='precision of the numpy engine in the benchmarked jobs',
+						default='float64', choices=['float64', 'float32'], action='store')
+	parser.add_argument('--threads', dest='threads', help='BLAS threads of the benchmarked jobs',
+						default=1, type=int, action='store')
+	parser.add_argument('-r', '--repeat', dest='repeat', help='runs per case, the report has the median',
+						default=1, type=int, action='store')
+	parser.add_argument('-d', '--datadir', dest='datadir', help='keep the synthetic dataset in this folder (default: a temporary one)',
+						default=None, action='store')
+	parser.add_argument('-o', '--output', dest='output', help='write the JSON report here (default: stdout)',
+						default=None, action='store')
+	parser.add_argument('-b', '--baseline', dest='baseline', help='JSON report to compare with; exits with 1 if a case got slower',
+						default=None, action='store')
+	parser.add_argument('--tolerance', dest='tolerance', help='relative slowdown against the baseline that counts as a regression',
+						default=0.2, type=float, action='store')
+
+	args = parser.parse_args()
+
+	# the job processes are spawned and load their BLAS with this setting
+	set_blas_threads(args.threads)
+
+	datadir = args.datadir or tempfile.mkdtemp(prefix='epistasis_benchmark')
+	if not os.path.exists(datadir):
+		os.makedirs(datadir)
+	generate_args = {'n_indivs': args.n_indivs, 'n_snps': args.n_snps, 'n_chroms': args.n_chroms, 'strains': args.strains, 'n_founders': args.n_founders,
+					 'n_phenotypes': args.n_phenotypes, 'n_covariates': args.n_covariates, 'seed': args.seed}
+	try:
+		report = run_benchmark(datadir, 'benchmark', args.group_sizes, args.engines, generate_args, args.repeat, covariates=args.n_covariates > 0,
+							   screen=args.screen, all_phenotypes=args.all_phenotypes, dtype=args.dtype)
+	finally:
+		if args.datadir is None:
+			shutil.rmtree(datadir)
+
+	if args.output:
+		f = open(args.output, 'w')
+		json.dump(report, f, indent=1, sort_keys=True)
+		f.close()
+	else:
+		print(json.dumps(report, indent=1, sort_keys=True))
+
+	if args.baseline:
+		f = open(args.baseline)
+		lines, slower = compare(report, json.load(f), args.tolerance)
+		f.close()
+		for line in lines:
+			sys.stderr.write(line + '\n')
+		if slower:
+			sys.exit(1)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+DAGMan workflow for a dataset: prep, compute and merge
+
+write_dag() writes epistasis_<dataset>.dag with three nodes:
+	prep     local universe: cleans the phenotype/covariate files with
+	         epistasis_stage.py, then runs epistasis_server.py with the original
+	         arguments and --no-submit, which converts the tped, plans the
+	         tiles, precomputes G0 (and the K0 windows), writes the shards and
+	         the compute submit file, its job script and job list
+	compute  the cluster of epistasis_<dataset>.sub written by prep; every
+	         job is retried up to max_retries times by HTCondor itself, so a
+	         failed tile doesn't rerun the tiles that succeeded
+	merge    local universe, after compute: checks that every tile has valid
+	         results (epistasis_manifest.py fails otherwise), merges them
+	         with merge_epistasis_output.py and writes lambda and the QQ table
+	         with epistasis_summary.py
+The compute submit file doesn't exist before prep has run, which DAGMan
+allows because it reads a node's submit file only when it submits the node.
+
+validate_dag() checks a DAG file without HTCondor: node names, parent/child
+and RETRY references, cycles, and that submit files and their executables
+exist (or are written by an earlier node).
+"""
+import sys
+import os
+import re
+import stat
+import textwrap
+
+DAG_FILE = 'epistasis_%s.dag'
+
+local_template = textwrap.dedent(
+'''# Epistasis %(node)s node
+
+universe = local
+getenv = true
+executable = %(executable)s
+log = %(condor_output)s/epistasis_%(node)s.log
+output = %(condor_output)s/epistasis_%(node)s.out
+error = %(condor_output)s/epistasis_%(node)s.err
+
+queue
+''')
+
+prep_template = textwrap.dedent(
+'''#!/bin/bash
+
+# missing values, names and individuals of the phenotype and covariate files
+%(python)s %(root)s/epistasis_stage.py %(dataset)s -d %(dataLoc)s || exit 1
+
+# beds, plan, G0, shards and the compute submit file, without submitting
+cd %(cwd)s && %(python)s %(root)s/epistasis_server.py %(arguments)s --no-submit
+''')
+
+merge_template = textwrap.dedent(
+'''#!/bin/bash
+
+cd %(root)s
+
+# every tile needs valid results before anything is merged
+%(python)s epistasis_manifest.py %(dataset)s %(plan_file)s -o %(job_output)s %(exclude_distance)s || exit 1
+
+for name in %(names)s; do
+	%(python)s merge_epistasis_output.py $name -i %(job_output)s %(bim)s || exit 1
+	%(python)s epistasis_summary.py $name -i %(job_output)s -q %(job_output)s/$name.qq.txt || exit 1
+done
+''')
+
+dag_template = textwrap.dedent(
+'''# Epistasis DAG for %(dataset)s, written %(timestamp)s
+# submit with: condor_submit_dag %(dag_file)s
+
+JOB prep %(prep_sub)s
+JOB compute %(compute_sub)s
+JOB merge %(merge_sub)s
+
+PARENT prep CHILD compute
+PARENT compute CHILD merge
+
+RETRY prep 1
+RETRY merge 1
+''')
+
+
+def write_executable(filename, text):
+	f = open(filename, 'w')
+	f.write(text)
+	f.close()
+	os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def write_dag(params):
+	'''
+	Writes the DAG, the prep and merge submit files and their scripts to
+	params['root'] and returns the DAG file name. params needs root, cwd,
+	python, dataset, dataLoc, condor_output, job_output, plan_file, the
+	server arguments for prep, names (result names to merge), bim
+	(merge option for binary results), exclude_distance and timestamp
+	'''
+	root = params['root']
+	params = dict(params, dag_file=os.path.join(root, DAG_FILE % params['dataset']),
+				  prep_sub=os.path.join(root, 'epistasis_%s.prep.sub' % params['dataset']),
+				  compute_sub=os.path.join(root, 'epistasis_%s.sub' % params['dataset']),
+				  merge_sub=os.path.join(root, 'epistasis_%s.merge.sub' % params['dataset']))
+	for node, template in [('prep', prep_template), ('merge', merge_template)]:
+		executable = os.path.join(root, 'epistasis_%s.%s.sh' % (params['dataset'], node))
+		write_executable(executable, template % params)
+		f = open(params['%s_sub' % node], 'w')
+		f.write(local_template % dict(params, node='%s_%s' % (params['dataset'], node), executable=executable))
+		f.close()
+
+	f = open(params['dag_file'], 'w')
+	f.write(dag_template % params)
+	f.close()
+	return params['dag_file']
+
+
+def read_dag(filename):
+	'''
+	Nodes ({name: submit file}), edges [(parent, child)] and retries of a DAG
+	file. Submit files are relative to the DAG's folder or the node's DIR
+	'''
+	folder = os.path.dirname(os.path.abspath(filename))
+	nodes, edges, retries = {}, [], {}
+	problems = []
+	f = open(filename)
+	for number, line in enumerate(f, 1):
+		words = line.split()
+		if not words or words[0].startswith('#'):
+			continue
+		keyword = words[0].upper()
+		if keyword == 'JOB':
+			if len(words) < 3:
+				problems.append('line %s: JOB needs a name and a submit file' % number)
+				continue
+			if words[1] in nodes:
+				problems.append('line %s: node %s is defined twice' % (number, words[1]))
+			directory = words[words.index('DIR') + 1] if 'DIR' in words[3:] else ''
+			nodes[words[1]] = os.path.join(folder, directory, words[2])
+		elif keyword == 'PARENT':
+			if 'CHILD' not in words:
+				problems.append('line %s: PARENT without CHILD' % number)
+				continue
+			split = words.index('CHILD')
+			edges.extend((parent, child) for parent in words[1:split] for child in words[split + 1:])
+		elif keyword == 'RETRY':
+			retries[words[1]] = int(words[2])
+	f.close()
+	return nodes, edges, retries, problems
+
+
+def submit_executable(filename):
+	'''
+	Executable of a submit file and whether it has a queue statement
+	'''
+	executable = None
+	queue = False
+	f = open(filename)
+	for line in f:
+		match = re.match(r'^\s*executable\s*=\s*(\S+)', line, re.IGNORECASE)
+		if match:
+			executable = match.group(1)
+		if re.match(r'^\s*queue\b', line, re.IGNORECASE):
+			queue = True
+	f.close()
+	return executable, queue
+
+
+def validate_dag(filename, generated=()):
+	'''
+	List of problems with a DAG file, empty if it looks runnable. Submit
+	files in generated are written by an earlier node and may be missing
+	'''
+	nodes, edges, retries, problems = read_dag(filename)
+	if not nodes:
+		problems.append('no JOB nodes')
+	for parent, child in edges:
+		for node in (parent, child):
+			if node not in nodes:
+				problems.append('PARENT/CHILD refers to unknown node %s' % node)
+	for node in retries:
+		if node not in nodes:
+			problems.append('RETRY refers to unknown node %s' % node)
+
+	# topological order, what is left over is on a cycle
+	parents = dict((node, set()) for node in nodes)
+	for parent, child in edges:
+		if parent in nodes and child in nodes:
+			parents[child].add(parent)
+	done = set()
+	while True:
+		ready = [node for node in parents if node not in done and parents[node] <= done]
+		if not ready:
+			break
+		done.update(ready)
+	if len(done) < len(nodes):
+		problems.append('cycle between nodes %s' % ', '.join(sorted(set(nodes).difference(done))))
+
+	generated = set(os.path.abspath(name) for name in generated)
+	for node, submit_file in sorted(nodes.items()):
+		if not os.path.exists(submit_file):
+			if os.path.abspath(submit_file) not in generated:
+				problems.append('node %s: submit file %s does not exist' % (node, submit_file))
+			continue
+		executable, queue = submit_executable(submit_file)
+		if not queue:
+			problems.append('node %s: %s has no queue statement' % (node, submit_file))
+		if executable is None:
+			problems.append('node %s: %s has no executable' % (node, submit_file))
+		elif not os.path.exists(executable):
+			problems.append('node %s: executable %s does not exist' % (node, executable))
+		elif not os.access(executable, os.X_OK):
+			problems.append('node %s: %s is not executable' % (node, executable))
+	return problems
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='checks a DAG file (e.g. epistasis_PREFIX.dag) without HTCondor')
+	parser.add_argument('dag', help='DAG file', action='store')
+	parser.add_argument('-g', '--generated', dest='generated', metavar='SUBMIT_FILE', nargs='+', help='submit files written by an earlier node, allowed to be missing',
+						default=(), action='store')
+
+	args = parser.parse_args()
+
+	problems = validate_dag(args.dag, args.generated)
+	for problem in problems:
+		print(problem)
+	if problems:
+		sys.exit(1)
+	nodes, edges, retries, ignored = read_dag(args.dag)
+	print('%s is valid: %s nodes, %s dependencies' % (args.dag, len(nodes), len(edges)))
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+"""
+Vectorized block-vs-block epistasis test (same model as fastlmm.association.epistasis)
+
+The phenotype, covariates, both genotype blocks and all of their product
+columns are rotated into the eigenbasis of K0 once. With delta fixed from
+the null model, the ML likelihood ratio for the interaction term of a pair
+only depends on the residual sums of squares of the additive and the
+interaction model, which are computed for every pair of the two blocks at
+once from batched Gram matrices. Several phenotypes can share the
+projection of the product columns, which is the bulk of the work.
+
+Permuted phenotypes (permuted_phenotypes) share even more: they all use the
+null model's delta, so the whitened and residualized product columns and
+their Gram matrices are the same for all of them, and each permutation only
+adds a matrix product with its residualized phenotype (block_min_pvalues).
+
+The dtype of the genotype blocks (epistasis_numpy_multi's dtype) sets the
+precision of the rotation: with float32 the decomposition, the blocks, the
+product columns and their Gram matrices are float32, which halves their
+memory and nearly doubles BLAS throughput. The small Gram matrices are solved,
+and the likelihood ratio and p-values computed, in float64 either way.
+
+On reference tiles of 1000 individuals (200 x 200 SNP blocks), float32 ran
+1.85x faster with a peak of 1001 MB instead of 1804 MB. The largest
+|delta log10 P| against float64 was 1e-5 (median 2e-7) for outbred and 6e-4
+for inbred samples. A planted hit at P=1.5e-50 moved by 7e-5 in log10 P,
+and every pair stayed on its side of P=1e-3. The largest deviations are at P
+near 1, for products nearly collinear with their SNPs.
+"""
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# number of product columns rotated at once (bounds memory per tile)
+max_product_columns = 20000
+
+# eigenvalues below this are dropped when solving, as fastlmm's LMM.nLLeval does
+eig_tol = 1e-10
+
+# permuted phenotypes x product columns evaluated at once by block_min_pvalues
+max_permutation_values = 4000000
+
+# with float32 Gram matrices, eigenvalues below this fraction of the largest
+# are rounding noise (e.g. the product of two SNPs in perfect LD) and dropped
+float32_rtol = 1e-5
+
+
+def solve_rtol(dtype):
+	'''
+	Relative eigenvalue tolerance of the pseudo-inverse for Gram matrices computed in dtype
+	'''
+	return [0.0, float32_rtol][np.dtype(dtype) == np.float32]
+
+
+def project(U, X):
+	'''
+	U'X and, if K0 is low rank, the part of X orthogonal to U. This is the
+	expensive part of a rotation and doesn't depend on delta
+	'''
+	UX = U.T.dot(X)
+	if U.shape[1] < U.shape[0]:
+		return UX, X - U.dot(UX)
+	return UX, None
+
+
+def whiten(S, delta, projected):
+	'''
+	Scales a projection by 1/sqrt(S+delta); the orthogonal part of a low
+	rank K0 is appended scaled by 1/sqrt(delta), so that inner products of
+	the result are X'(K0+delta*I)^-1 X
+	'''
+	UX, orthogonal = projected
+	scale = (1.0 / np.sqrt(S + delta)).astype(UX.dtype)
+	if UX.ndim == 1:
+		rotated = UX * scale
+	else:
+		rotated = UX * scale[:, None]
+	if orthogonal is not None:
+		rotated = np.concatenate((rotated, orthogonal * UX.dtype.type(1.0 / np.sqrt(delta))))
+	return rotated
+
+
+def rotate(U, S, delta, X):
+	'''
+	Rotates X into the eigenbasis of K0 and whitens it for delta
+	'''
+	return whiten(S, delta, project(U, X))
+
+
+def _residual_sums(gram, rhs, yy, rtol=0.0):
+	'''
+	yy - rhs'gram^+ rhs for stacks of small Gram matrices (pseudo-inverse as in LMM.nLLeval)
+	'''
+	return _explained_sums(np.linalg.eigh(gram), rhs, yy, rtol)
+
+
+def _explained_sums(decomposition, rhs, yy, rtol=0.0):
+	'''
+	_residual_sums with the Gram matrices already decomposed, rhs may have
+	leading dimensions (phenotypes) that the Gram matrices are shared by.
+	Eigenvalues up to rtol times the largest of their matrix are dropped too
+	'''
+	s, u = decomposition
+	projected = np.einsum('...ji,...j->...i', u, rhs)
+	keep = s > np.maximum(eig_tol, rtol * s[..., -1:])
+	explained = np.where(keep, projected ** 2 / np.where(keep, s, 1.0), 0.0).sum(-1)
+	return yy - explained
+
+
+def _columns(projected, columns):
+	UX, orthogonal = projected
+	if orthogonal is None:
+		return UX[:, columns], None
+	return UX[:, columns], orthogonal[:, columns]
+
+
+def block_pair_pvalues(y, covar, A, B, U, S, delta):
+	'''
+	Interaction p-values for every pair (column of A, column of B).
+	y: phenotype (N), covar: covariates including bias (N x c),
+	A, B: standardized genotype blocks (N x p, N x q, their dtype is the
+	precision of the rotation), U, S: eigendecomposition of K0, delta:
+	internal (not log) delta. Returns a p x q array of p-values
+	'''
+	return block_pair_pvalues_multi(y[:, None], covar, A, B, U, S, [delta])[0]
+
+
+def block_pair_pvalues_multi(Y, covar, A, B, U, S, deltas):
+	'''
+	block_pair_pvalues for several phenotypes (columns of Y, one delta each).
+	Product columns are formed and projected onto U once for all of them;
+	only the whitening, which depends on delta, is repeated per phenotype.
+	Returns a k x p x q array of p-values
+	'''
+	N = A.shape[0]
+	p = A.shape[1]
+	q = B.shape[1]
+	rtol = solve_rtol(A.dtype)
+
+	U = U.astype(A.dtype, copy=False)
+	pc, pY, pA, pB = [project(U, X.astype(A.dtype, copy=False)) for X in (covar, Y, A, B)]
+
+	# additive (null) model per phenotype: covariates + both snps, residualized on the rotated covariates
+	models = []
+	for j, delta in enumerate(deltas):
+		Q = np.linalg.qr(whiten(S, delta, pc))[0]
+		model = {'delta': delta, 'Q': Q}
+		residualize = lambda X: X - Q.dot(Q.T.dot(X))
+
+		ry = residualize(whiten(S, delta, _columns(pY, j)))
+		rA = residualize(whiten(S, delta, pA))
+		rB = residualize(whiten(S, delta, pB))
+		model.update({'ry': ry, 'yy': ry.dot(ry), 'aa': (rA * rA).sum(0), 'bb': (rB * rB).sum(0),
+					  'ab': rA.T.dot(rB), 'ay': rA.T.dot(ry), 'by': rB.T.dot(ry)})
+
+		gram = np.empty((p, q, 2, 2))
+		gram[:, :, 0, 0] = model['aa'][:, None]
+		gram[:, :, 1, 1] = model['bb'][None, :]
+		gram[:, :, 0, 1] = gram[:, :, 1, 0] = model['ab']
+		rhs = np.empty((p, q, 2))
+		rhs[:, :, 0] = model['ay'][:, None]
+		rhs[:, :, 1] = model['by'][None, :]
+		model['rss_null'] = _residual_sums(gram, rhs, model['yy'], rtol)
+		models.append(model)
+
+	# interaction (alt) model, product columns projected in chunks of rows of A
+	rss_alt = np.empty((len(models), p, q))
+	rows = max(1, max_product_columns // max(q, 1))
+	for start in range(0, p, rows):
+		end = min(start + rows, p)
+		products = project(U, (A[:, start:end, None] * B[:, None, :]).reshape(N, -1))
+
+		for j, model in enumerate(models):
+			delta, Q = model['delta'], model['Q']
+			residualize = lambda X: X - Q.dot(Q.T.dot(X))
+			# the whitened blocks are cheap to redo and would cost N x (p + q) per phenotype to keep
+			rA = residualize(whiten(S, delta, _columns(pA, slice(start, end))))
+			rB = residualize(whiten(S, delta, pB))
+			rP = residualize(whiten(S, delta, products)).reshape(-1, end - start, q)
+
+			gram = np.empty((end - start, q, 3, 3))
+			gram[:, :, 0, 0] = model['aa'][start:end, None]
+			gram[:, :, 1, 1] = model['bb'][None, :]
+			gram[:, :, 0, 1] = gram[:, :, 1, 0] = model['ab'][start:end]
+			gram[:, :, 2, 2] = (rP * rP).sum(0)
+			gram[:, :, 0, 2] = gram[:, :, 2, 0] = np.einsum('mpq,mp->pq', rP, rA)
+			gram[:, :, 1, 2] = gram[:, :, 2, 1] = np.einsum('mpq,mq->pq', rP, rB)
+
+			rhs = np.empty((end - start, q, 3))
+			rhs[:, :, 0] = model['ay'][start:end, None]
+			rhs[:, :, 1] = model['by'][None, :]
+			rhs[:, :, 2] = np.einsum('mpq,m->pq', rP, model['ry'])
+			rss_alt[j, start:end] = _residual_sums(gram, rhs, model['yy'], rtol)
+
+	# 2*(ll_alt - ll_null) for ML with fixed delta
+	rss_null = np.array([model['rss_null'] for model in models])
+	with np.errstate(divide='ignore', invalid='ignore'):
+		statistic = N * np.log(rss_null / rss_alt)
+	statistic = np.where(np.isfinite(statistic), np.maximum(statistic, 0.0), 0.0)
+	return stats.chi2.sf(statistic, 1)
+
+
+def covariance_power(U, S, delta, X, exponent):
+	'''
+	(K0 + delta*I)^exponent X, with the part of X orthogonal to a low rank
+	K0 scaled by delta^exponent
+	'''
+	UX, orthogonal = project(U, X)
+	result = U.dot(UX * ((S + delta) ** exponent)[:, None])
+	if orthogonal is not None:
+		result += delta ** exponent * orthogonal
+	return result
+
+
+def permutation_indices(n, permutations, seed=0):
+	'''
+	permutations x n index arrays, the same for every job with the same seed
+	'''
+	random = np.random.RandomState(seed)
+	return np.array([random.permutation(n) for i in range(permutations)])
+
+
+def permuted_phenotypes(y, covar, U, S, delta, indices):
+	'''
+	Phenotypes for a permutation test under the null model: the residuals
+	of y after the GLS fit of the covariates are whitened with
+	V = K0 + delta*I, where they are exchangeable, permuted and mapped back,
+	y_perm = covar b + V^1/2 P V^-1/2 (y - covar b), so permuted phenotypes
+	have the covariate fit and the covariance of y under the null model.
+	indices: permutations x N (permutation_indices). Returns N x permutations
+	'''
+	wX = covariance_power(U, S, delta, covar, -0.5)
+	wy = covariance_power(U, S, delta, y[:, None], -0.5)[:, 0]
+	b = np.linalg.lstsq(wX, wy, rcond=None)[0]
+	residuals = wy - wX.dot(b)
+	return covar.dot(b)[:, None] + covariance_power(U, S, delta, residuals[indices].T, 0.5)
+
+
+def block_min_pvalues(Y, covar, A, B, U, S, delta, keep=None, same=False):
+	'''
+	Smallest interaction p-value over the pairs of a block for every column
+	of Y, all tested with the same delta (permuted phenotypes of one null
+	model). keep (p x q) limits the tested pairs, same only tests i < j of
+	a diagonal block. Returns k minima, 1 if the block has no pair left
+	'''
+	N = A.shape[0]
+	p = A.shape[1]
+	q = B.shape[1]
+	k = Y.shape[1]
+	rtol = solve_rtol(A.dtype)
+
+	U = U.astype(A.dtype, copy=False)
+	pc, pY, pA, pB = [project(U, X.astype(A.dtype, copy=False)) for X in (covar, Y, A, B)]
+	Q = np.linalg.qr(whiten(S, delta, pc))[0]
+	residualize = lambda X: X - Q.dot(Q.T.dot(X))
+	ry = residualize(whiten(S, delta, pY))
+	rA = residualize(whiten(S, delta, pA))
+	rB = residualize(whiten(S, delta, pB))
+	yy = (ry * ry).sum(0)
+	aa, bb, ab = (rA * rA).sum(0), (rB * rB).sum(0), rA.T.dot(rB)
+	ay, by = rA.T.dot(ry), rB.T.dot(ry)
+
+	tested = np.ones((p, q), dtype=bool) if keep is None else keep.astype(bool)
+	if same:
+		tested = tested & np.triu(np.ones((p, q), dtype=bool), 1)
+
+	best = np.zeros(k)
+	rows = max(1, max_product_columns // max(q, 1))
+	for start in range(0, p, rows):
+		end = min(start + rows, p)
+		mask = tested[start:end]
+		if not mask.any():
+			continue
+		rP = residualize(whiten(S, delta, project(U, (A[:, start:end, None] * B[:, None, :]).reshape(N, -1))))
+
+		# Gram matrices don't depend on the phenotype
+		null_gram = np.empty((end - start, q, 2, 2))
+		null_gram[:, :, 0, 0] = aa[start:end, None]
+		null_gram[:, :, 1, 1] = bb[None, :]
+		null_gram[:, :, 0, 1] = null_gram[:, :, 1, 0] = ab[start:end]
+		gram = np.empty((end - start, q, 3, 3))
+		gram[:, :, :2, :2] = null_gram
+		gram[:, :, 2, 2] = (rP * rP).sum(0).reshape(end - start, q)
+		gram[:, :, 0, 2] = gram[:, :, 2, 0] = np.einsum('mpq,mp->pq', rP.reshape(-1, end - start, q), rA[:, start:end])
+		gram[:, :, 1, 2] = gram[:, :, 2, 1] = np.einsum('mpq,mq->pq', rP.reshape(-1, end - start, q), rB)
+		null_gram, gram = np.linalg.eigh(null_gram), np.linalg.eigh(gram)
+
+		# phenotypes in batches, each only costs rP'ry and the small solves
+		batch = max(1, max_permutation_values // rP.shape[1])
+		for first in range(0, k, batch):
+			last = min(first + batch, k)
+			rhs = np.empty((last - first, end - start, q, 3))
+			rhs[..., 0] = ay[start:end, first:last].T[:, :, None]
+			rhs[..., 1] = by[:, first:last].T[:, None, :]
+			rhs[..., 2] = rP.T.dot(ry[:, first:last]).T.reshape(last - first, end - start, q)
+			batch_yy = yy[first:last, None, None]
+			rss_null = _explained_sums(null_gram, rhs[..., :2], batch_yy, rtol)
+			rss_alt = _explained_sums(gram, rhs, batch_yy, rtol)
+			with np.errstate(divide='ignore', invalid='ignore'):
+				statistic = N * np.log(rss_null / rss_alt)
+			statistic = np.where(np.isfinite(statistic), np.maximum(statistic, 0.0), 0.0)
+			best[first:last] = np.maximum(best[first:last], np.where(mask, statistic, 0.0).reshape(last - first, -1).max(1))
+	return stats.chi2.sf(best, 1)
+
+
+def epistasis_permutations(test_snps, Y, covar, kinship, log_delta, sid_list_0, sid_list_1, keep=None, dtype=np.float64):
+	'''
+	block_min_pvalues for the permuted phenotypes Y (N x permutations) of
+	one null model, on the blocks given by the two sid lists and read as
+	dtype as in epistasis_numpy_multi
+	'''
+	if not np.array_equal(kinship['iid'], test_snps.iid):
+		raise Exception('individuals in the G0 decomposition do not match the genotype file')
+
+	same = list(sid_list_0) == list(sid_list_1)
+	A = test_snps[:, test_snps.sid_to_index(sid_list_0)].read(dtype=dtype).standardize().val
+	B = A if same else test_snps[:, test_snps.sid_to_index(sid_list_1)].read(dtype=dtype).standardize().val
+	return block_min_pvalues(Y, covar, A, B, kinship['U'], kinship['S'], np.exp(log_delta) * kinship['sid_count'], keep, same)
+
+
+def epistasis_numpy(test_snps, pheno, covar, kinship, sid_list_0, sid_list_1):
+	'''
+	Drop-in for fastlmm.association.epistasis on one tile. test_snps, pheno
+	and covar come from epistasis_kinship.load_inputs, kinship from
+	load_kinship/compute_kinship. If both sid lists are the same block,
+	only pairs within it (i < j) are tested.
+	Returns a dataframe with the SNP0/Chr0/ChrPos0/SNP1/Chr1/ChrPos1/PValue
+	columns of epistasis, sorted by PValue
+	'''
+	return epistasis_numpy_multi(test_snps, pheno['vals'][:, None], covar, kinship, [kinship['log_delta']], sid_list_0, sid_list_1)[0]
+
+
+def epistasis_numpy_multi(test_snps, Y, covar, kinship, log_deltas, sid_list_0, sid_list_1, dtype=np.float64):
+	'''
+	epistasis_numpy for every column of the phenotype matrix Y (N x k), each
+	with its own null model log delta. The genotype blocks are read and
+	projected once, as dtype (float32 or float64). Returns a list of k
+	dataframes
+	'''
+	if not np.array_equal(kinship['iid'], test_snps.iid):
+		raise Exception('individuals in the G0 decomposition do not match the genotype file')
+
+	deltas = [np.exp(log_delta) * kinship['sid_count'] for log_delta in log_deltas]
+	same = list(sid_list_0) == list(sid_list_1)
+
+	idx_0 = test_snps.sid_to_index(sid_list_0)
+	idx_1 = test_snps.sid_to_index(sid_list_1)
+	A = test_snps[:, idx_0].read(dtype=dtype).standardize().val
+	B = A if same else test_snps[:, idx_1].read(dtype=dtype).standardize().val
+
+	pvalues = block_pair_pvalues_multi(Y, covar, A, B, kinship['U'], kinship['S'], deltas)
+
+	if same:
+		i0, i1 = np.triu_indices(len(idx_0), 1)
+	else:
+		i0, i1 = np.indices(pvalues.shape[1:]).reshape(2, -1)
+
+	pos = test_snps.pos
+	frames = []
+	for j in range(len(deltas)):
+		frame = pd.DataFrame({'SNP0': test_snps.sid[idx_0][i0],
+							  'Chr0': pos[idx_0, 0][i0],
+							  'ChrPos0': pos[idx_0, 2][i0],
+							  'SNP1': test_snps.sid[idx_1][i1],
+							  'Chr1': pos[idx_1, 0][i1],
+							  'ChrPos1': pos[idx_1, 2][i1],
+							  'PValue': pvalues[j, i0, i1]})
+		frame.sort_values(by='PValue', inplace=True)
+		frame.index = np.arange(len(frame))
+		frames.append(frame)
+	return frames
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""
+Precomputes the G0 kinship eigendecomposition and null model once per dataset
+
+With all_phenotypes, every column of <dataset>.pheno.txt gets its own null
+model delta (log_deltas in the G0 file) on the individuals that have a value
+for all of them, and pheno.key.txt maps the zero-padded phenotype index used
+in output names to the phenotype name.
+
+The G0 file also records what its null model was fitted on (model_inputs):
+the pheno and covar files by path and md5, whether covariates and all
+phenotypes were used, and the size and modification time of the .FULL
+files. inputs_current() tells the server and the local runner when a file
+is stale and has to be rebuilt.
+"""
+import os
+import json
+from math import ceil, log10
+import numpy as np
+from fastlmm.inference.lmm import LMM
+import pysnptools.util as pstutil
+from pysnptools.util import pheno as pstpheno
+from pysnptools.snpreader import Bed
+from epistasis_shards import open_bed
+from epistasis_meta import scan_file
+
+# filename formats
+FULL_DATASET = '.FULL'
+FILTERED_DATASET = '.FILTERED'
+KINSHIP_FILE = '.G0.npz'
+PHENO_KEY_FILE = 'pheno.key.txt'
+
+# values converted at a time by read_converted
+CONVERT_VALUES = 1 << 22
+
+
+def pheno_keys(headers):
+	'''
+	Zero-padded phenotype indices, as in pheno.key.txt
+	'''
+	fmt = '%%0%sd' % max(1, int(ceil(log10(len(headers)))))
+	return [fmt % i for i in range(len(headers))]
+
+
+def write_pheno_key(filename, headers):
+	f = open(filename, 'w')
+	f.write('\n'.join(['%s\t%s' % (key, phen) for key, phen in zip(pheno_keys(headers), headers)]))
+	f.close()
+
+
+def read_pheno_key(filename):
+	'''
+	Returns the phenotype indices and names of a pheno.key.txt
+	'''
+	f = open(filename)
+	rows = [line.rstrip('\n').split('\t') for line in f if line.strip()]
+	f.close()
+	return [row[0] for row in rows], [row[1] for row in rows]
+
+
+def load_inputs(dataset, covFile=None, all_phenotypes=False, group_size=None):
+	'''
+	Opens the genotype readers and loads phenotype/covariates the same way
+	fastlmm.association.epistasis does, so that individuals end up in the
+	same order as in its cache file.
+	With all_phenotypes, pheno['vals'] has one column per phenotype and only
+	individuals without missing values in any of them are kept.
+	With group_size, a job that only got the per-group shards of the
+	filtered SNPs reads them through epistasis_shards.ShardedBed
+	'''
+	test_snps = open_bed('%s%s' % (dataset, FILTERED_DATASET), group_size, count_A1=False)
+	G0 = open_bed('%s%s' % (dataset, FULL_DATASET), group_size, count_A1=False)
+	if all_phenotypes:
+		pheno = pstpheno.loadPhen('%s.pheno.txt' % dataset, missing=np.nan)
+	else:
+		pheno = pstpheno.loadOnePhen('%s.pheno.txt' % dataset, vectorize=True, missing=np.nan)
+	covar = None
+	if covFile:
+		covar = pstpheno.loadPhen(covFile, missing=np.nan)
+
+	test_snps, pheno, covar, G0 = pstutil.intersect_apply([test_snps, pheno, covar, G0])
+
+	if all_phenotypes:
+		complete = np.flatnonzero(~np.isnan(pheno['vals']).any(axis=1))
+		if len(complete) < len(pheno['vals']):
+			test_snps, G0 = test_snps[complete, :], G0[complete, :]
+			pheno = {'header': pheno['header'], 'vals': pheno['vals'][complete], 'iid': pheno['iid'][complete]}
+			if covar is not None:
+				covar = {'header': covar['header'], 'vals': covar['vals'][complete], 'iid': covar['iid'][complete]}
+
+	# epistasis always appends a bias column to the covariates
+	if covar is None:
+		covar = np.ones((test_snps.iid_count, 1))
+	else:
+		covar = np.hstack((covar['vals'], np.ones((test_snps.iid_count, 1))))
+
+	return test_snps, pheno, covar, G0
+
+
+def compute_kinship(pheno, covar, G0, min_log_delta=-5, max_log_delta=10, dtype=np.float64):
+	'''
+	Factors K0 built from the standardized G0 reader and fits the null model,
+	returning the same dict as load_kinship. A phenotype matrix gets one
+	null model per column (log_deltas), log_delta is the first one's.
+	With dtype float32, G0 is read and multiplied out in float32; K0 is
+	still factored in float64
+	'''
+	lmm = LMM()
+	G = G0.read(dtype=dtype).standardize().val
+	if G.dtype == np.float32 and G.shape[1] >= G.shape[0]:
+		lmm.setG(G, K0=G.dot(G.T).astype(np.float64))
+	else:
+		# a low rank K0 is factored by the SVD of G0 itself
+		lmm.setG(G.astype(np.float64, copy=False))
+
+	# delta is optimized with REML, as epistasis does internally
+	lmm.setX(covar)
+	vals = pheno['vals'].reshape(len(pheno['vals']), -1)
+	log_deltas = []
+	for j in range(vals.shape[1]):
+		lmm.sety(vals[:, j])
+		result = lmm.find_log_delta(REML=True, sid_count=G0.sid_count, min_log_delta=min_log_delta, max_log_delta=max_log_delta)
+		log_deltas.append(float(result['log_delta']))
+
+	kinship = {'U': lmm.U,
+			   'S': lmm.S,
+			   'log_delta': log_deltas[0],
+			   'sid_count': G0.sid_count,
+			   'iid': G0.iid}
+	if pheno['vals'].ndim > 1:
+		kinship['log_deltas'] = np.array(log_deltas)
+		kinship['phenotypes'] = np.array(pheno['header'])
+	return kinship
+
+
+def model_inputs(dataset, covFile=None, all_phenotypes=False):
+	'''
+	What a null model fitted for these arguments depends on, as a dict
+	that is stored with the model and compared by inputs_current
+	'''
+	files = {'pheno': dataset + '.pheno.txt', 'covar': covFile}
+	inputs = {'covariates': bool(covFile), 'all_phenotypes': bool(all_phenotypes)}
+	for role, filename in sorted(files.items()):
+		if filename:
+			inputs[role] = {'path': os.path.abspath(filename), 'md5': scan_file(filename)[0]['md5']}
+	for suffix in ['.bed', '.bim', '.fam']:
+		filename = dataset + FULL_DATASET + suffix
+		inputs['full' + suffix] = {'path': os.path.abspath(filename), 'bytes': os.path.getsize(filename), 'mtime': os.path.getmtime(filename)}
+	return inputs
+
+
+def inputs_current(filename, inputs):
+	'''
+	True if the npz file exists and was written for the same inputs
+	(model_inputs plus anything else the writer stored with them)
+	'''
+	if not os.path.exists(filename):
+		return False
+	with np.load(filename) as data:
+		if 'inputs' not in data:
+			return False
+		return json.loads(str(data['inputs'])) == inputs
+
+
+def precompute_kinship(dataset, covFile=None, output_file=None, min_log_delta=-5, max_log_delta=10, all_phenotypes=False, dtype=np.float64):
+	'''
+	Builds K0 from the .FULL dataset, factors it and fits the null model(s).
+	Writes U and S as arr_0/arr_1 so the file doubles as an epistasis cache_file,
+	and the model_inputs it was fitted on
+	'''
+	if output_file is None:
+		output_file = dataset + KINSHIP_FILE
+
+	inputs = model_inputs(dataset, covFile, all_phenotypes)
+	test_snps, pheno, covar, G0 = load_inputs(dataset, covFile, all_phenotypes)
+	kinship = compute_kinship(pheno, covar, G0, min_log_delta, max_log_delta, dtype)
+
+	extra = {}
+	if all_phenotypes:
+		extra = {'log_deltas': kinship['log_deltas'], 'phenotypes': kinship['phenotypes']}
+	np.savez(output_file, kinship['U'], kinship['S'], log_delta=kinship['log_delta'], sid_count=kinship['sid_count'], iid=kinship['iid'],
+			 inputs=json.dumps(inputs, sort_keys=True), **extra)
+	return output_file
+
+
+def read_converted(data, name, dtype):
+	'''
+	Array name of an open npz file as dtype, converted a chunk at a time so
+	that the stored (float64) array is never in memory as a whole
+	'''
+	f = data.zip.open(name + '.npy')
+	version = np.lib.format.read_magic(f)
+	if version[0] not in (1, 2):
+		f.close()
+		return data[name].astype(dtype)
+	shape, fortran_order, stored = [np.lib.format.read_array_header_1_0, np.lib.format.read_array_header_2_0][version[0] - 1](f)
+	converted = np.empty(shape, dtype=dtype, order=['C', 'F'][fortran_order])
+	flat = converted.reshape(-1, order=['C', 'F'][fortran_order])
+	for start in range(0, flat.size, CONVERT_VALUES):
+		count = min(CONVERT_VALUES, flat.size - start)
+		flat[start:start + count] = np.frombuffer(f.read(count * stored.itemsize), dtype=stored, count=count)
+	f.close()
+	return converted
+
+
+def load_kinship(filename, dtype=None):
+	'''
+	Returns the decomposition written by precompute_kinship as a dict, with
+	dtype U converted to it while it is read
+	'''
+	with np.load(filename) as data:
+		kinship = {'U': data['arr_0'] if dtype is None else read_converted(data, 'arr_0', dtype),
+				   'S': data['arr_1'],
+				   'log_delta': float(data['log_delta']),
+				   'sid_count': int(data['sid_count']),
+				   'iid': data['iid']}
+		if 'log_deltas' in data:
+			kinship['log_deltas'] = data['log_deltas']
+			kinship['phenotypes'] = data['phenotypes']
+		return kinship
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser()
+	parser.add_argument('dataset', help='dataset prefix (expects .FULL and .FILTERED beds)', action='store')
+	parser.add_argument('-c', '--covariate_file', dest='covFile', help='use covariate file',
+						default=None, action='store')
+	parser.add_argument('-o', '--output', dest='output', help='output file (default: dataset%s)' % KINSHIP_FILE,
+						default=None, action='store')
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='fit a null model for every phenotype column',
+						default=False, action='store_true')
+	parser.add_argument('--dtype', dest='dtype', help='precision of G0 and of K0 = G0 G0\' (K0 is factored in float64 either way)',
+						default='float64', choices=['float64', 'float32'], action='store')
+
+	args = parser.parse_args()
+
+	print('wrote %s' % precompute_kinship(args.dataset, args.covFile, args.output, all_phenotypes=args.all_phenotypes, dtype=args.dtype))
@@ -1,126 +1,200 @@
-'''
-Goals of script:
-1) call fix_pheno?
-2) Filter snps, make beds
-3) check fids/iids
-4) make tarball containing all files and directories
-
-
-'''
-
-
-
-make_bed_cmd = '%(plink_location)s --tfile sub%(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --make-bed --out %(dataset)s %(plink_species)s'
-# make_bed_cmd = '%(plink_location)s --tfile %(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --snps %(snp_range)s --make-bed --out %(dataset)s %(plink_species)s'
-make_bed_all_cmd = '%(plink_location)s --tfile %(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --make-bed --out all_%(dataset)s %(plink_species)s'
-
-
-# function to run plink (used to be in epistasis_wrapper.py)
-def populate_available(dataset, species, snp_index):
-
-	tped, tfam, pheno, covar = ['%s%s' % (dataset, suffix) for suffix in ['.tped', '.tfam', '.pheno.txt', '.covar.txt']]
-	plink_species = ['', '--%s' % species][species != 'human']
-
-	# run plink commands
-	plink_location = plink
-	snp_range = open('snp_combos_%s.txt' % dataset).readlines()[snp_index].strip().split(';')
-	snp_range1 = snp_range[0]
-	snp_range2 = snp_range[1]
-	for cmd_template in (subset_tped_file, subset_tped_file2, subset_tped_file3, make_bed_cmd, make_bed_all_cmd):
-		cmd = cmd_template % locals()
-		print (cmd)
-		subprocess.check_call(cmd, shell=True, stderr=subprocess.STDOUT)
-
-	chroms = map(str, range(1, species_chroms[species] + 1))
-	n_snps = int( subprocess.Popen(['wc', '-l', '%s.bim' % dataset], stdout=subprocess.PIPE).communicate()[0].split()[0] )
-	sys.stdout.flush()
-
-	if dataset in pheno:
-		f = open('%s.pheno.txt' % dataset)
-		# skip FID and IID columns
-		headers = f.readline().strip().split('\t')[2:]
-		pheno_data = f.readlines()
-		f.close()
-
-		# if FID/IID pairs match between .tfam and .pheno.txt, proceed
-		# if not, go to next file
-		if check_fids_iids(dataset):
-			# do nothing
-			print ('')
-		else:
-			# check that phenotype names don't have spaces
-			problematic = [x for x in headers if ' ' in x]
-
-			# check that phenotypes exist and have unique names
-			if not problematic and headers and len(set(headers)) == len(headers):
-				# create phenotype key file for later reference
-				f = open('pheno.key.txt', 'w')
-				fmt = '%%0%sd' % int(ceil(log10(len(headers))))
-				f.write( '\n'.join(['%s\t%s' % (fmt % i, phen) for i, phen in enumerate(headers)]) )
-				f.close()
-
-				params = {'n_pheno': len(headers),
-						  'n_indivs': len(pheno_data),
-						  'n_snps': n_snps}
-
-				if dataset in covar:
-					params['covar'] = '%s.covar.txt' % dataset
-				else:
-					params['covar'] = None
-
-			elif len(set(headers)) < len(headers):
-				duplicates = sorted([x for x in set(headers) if headers.count(x) > 1])
-				print ('Duplicated phenotype names found in %s.pheno.txt:' % dataset)
-				print ('\n'.join(map(str, duplicates)))
-			elif problematic:
-				print ('Spaces exist in the following phenotype names:')
-				print ('\n'.join(sorted(problematic)))
-				print ("cat <(head -1 /%(dataset)s.pheno.txt | sed 's/ //g') <(tail -n+2 /%(dataset)s.pheno.txt) > tmp.txt && mv -f tmp.txt %(dataset)s.pheno.txt" % locals())
-			else:
-				print ('No phenotypes found in %s.pheno.txt!' % dataset)
-
-
-# function to make sure that fids and iids match across files (used to be in epistasis_pipeline.py)
-def check_fids_iids(prefix):
-	def get_fids_iids(fn, skip=0):
-		f = open(fn)
-		for i in range(skip):
-			f.readline()
-		#fid_iid = [tuple(x.strip().split('\t')[:2]) for x in f.readlines()]
-		fid_iid = [tuple(x.strip().split()[:2]) for x in f.readlines()]
-		f.close()
-		return fid_iid
-
-	fid_iid_tfam, fid_iid_pheno = map(get_fids_iids, ['%s.tfam' % prefix, '%s.pheno.txt' % prefix], [0, 1])
-	if fid_iid_tfam == fid_iid_pheno:
-		return True
-	elif set(fid_iid_tfam) == set(fid_iid_pheno):
-		# FID/IID pairs can be in different order, but warn in case this is not intended
-		print ('FID/IID pairs in %s.pheno.txt are not in the same order as in %s.tfam' % (prefix, prefix))
-		return True
-	else:
-		missing = set(fid_iid_tfam).difference(fid_iid_pheno)
-		extra = set(fid_iid_pheno).difference(fid_iid_tfam)
-
-		if missing:
-			# OK to have more individuals in .tfam file than .pheno.txt file
-			print ('FID/IID pairs in %s.tfam but not in %s.pheno.txt:' % (prefix, prefix))
-			print ('\n'.join(['%s\t%s' % x for x in sorted(missing)]))
-			return True
-
-		if extra:
-			print ('FID/IID pairs in %s.pheno.txt but not in %s.tfam:' % (prefix, prefix))
-			print ('\n'.join(['%s\t%s' % x for x in sorted(extra)]))
-
-	return False
-
-
-
-
-
-'''
-dataset is file prefix
-species is 'mouse' or 'human'
-snp_index was a CHTC process number
-'''
-# populate_available(dataset, species, snp_index)
+#!/usr/bin/env python
+
+"""
+Runs the epistasis tiles of a dataset on the local machine instead of HTCondor
+
+Uses the same plan, G0 decomposition and per-tile code (epistasis_node.run_fastlmmc)
+as the cluster jobs, spread over a process pool with one BLAS thread per
+worker by default.
+"""
+import sys
+import os
+import time
+import multiprocessing
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+root = os.path.split(os.path.realpath(sys.argv[0]))[0]
+
+# BLAS libraries read these when they are first loaded
+blas_thread_vars = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def set_blas_threads(threads):
+	for var in blas_thread_vars:
+		os.environ[var] = str(threads)
+
+
+def init_worker(datadir, threads):
+	set_blas_threads(threads)
+	os.chdir(datadir)
+
+
+def run_tiles(dataset, output_dir, tile_ids, plan_file, options):
+	from epistasis_node import run_fastlmmc
+	run_fastlmmc(dataset, output_dir, tile_ids, plan_file, **options)
+	return tile_ids
+
+
+def run_local(dataset, datadir, output_dir, workers=None, threads=1, tiles_per_task=None, tasks=None, **options):
+	'''
+	Runs every tile of the plan (or only the tile ids in tasks) and returns
+	the list of tile ids that failed. options are passed to run_fastlmmc;
+	with exclude_distance, tiles that have no pair left are not run
+	'''
+	from epistasis_planner import PLAN_FILE, read_plan
+
+	if workers is None:
+		workers = max(1, multiprocessing.cpu_count() // threads)
+	datadir = os.path.realpath(datadir)
+	output_dir = os.path.realpath(output_dir)
+	if not os.path.exists(output_dir):
+		os.makedirs(output_dir)
+
+	plan_file = os.path.join(datadir, dataset + PLAN_FILE)
+	tiles, info = read_plan(plan_file)
+	if tasks is None:
+		tasks = list(range(len(tiles)))
+	if options.get('exclude_distance') is not None:
+		from epistasis_pairs import load_positions, excluded_tiles
+		chrom, bp = load_positions(os.path.join(datadir, dataset + '.FILTERED'))
+		skip = set(excluded_tiles(tiles, chrom, bp, options['exclude_distance']))
+		tasks = [tile_id for tile_id in tasks if tile_id not in skip]
+	if not tasks:
+		return []
+
+	# a few chunks per worker keeps the pool busy without re-opening readers for every tile
+	if tiles_per_task is None:
+		tiles_per_task = max(1, int(ceil(len(tasks) / (4.0 * workers))))
+	chunks = [tasks[i:i + tiles_per_task] for i in range(0, len(tasks), tiles_per_task)]
+
+	sys.stderr.write('Running %s tiles of %s in %s chunks on %s workers (%s BLAS threads each)\n' % (len(tasks), dataset, len(chunks), workers, threads))
+
+	failed = []
+	done = 0
+	start = time.time()
+	pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(datadir, threads))
+	futures = dict((pool.submit(run_tiles, dataset, output_dir, chunk, plan_file, options), chunk) for chunk in chunks)
+	for future in as_completed(futures):
+		chunk = futures[future]
+		try:
+			future.result()
+		except BaseException as e:
+			sys.stderr.write('tiles %s failed: %r\n' % (chunk, e))
+			failed.extend(chunk)
+		done += len(chunk)
+		elapsed = time.time() - start
+		sys.stderr.write('%s/%s tiles done, %.0fs elapsed, ~%.0fs left\n' % (done, len(tasks), elapsed, elapsed / done * (len(tasks) - done)))
+	pool.shutdown()
+
+	return sorted(failed)
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='runs the epistasis tiles of a dataset on this machine')
+	parser.add_argument('dataset', help='dataset to run', action='store')
+	parser.add_argument('-d', '--datadir', dest='datadir', help='folder with the *.FILTERED/*.FULL files, pheno, plan and G0 file',
+						default=os.path.join(root, 'data'), action='store')
+	parser.add_argument('-o', '--outputdir', dest='outputdir', help='folder for the per-tile results (default: results/dataset)',
+						default=None, action='store')
+	parser.add_argument('-c', '--covariate_file', dest='covFile', help='use covariate file (relative to datadir)',
+						default=None, action='store')
+	parser.add_argument('-s', '--species', dest='species', help='mouse or human',
+						default='mouse', action='store')
+	parser.add_argument('-j', '--workers', dest='workers', help='number of worker processes (default: cores / threads)',
+						default=None, type=int, action='store')
+	parser.add_argument('--threads', dest='threads', help='BLAS threads per worker',
+						default=1, type=int, action='store')
+	parser.add_argument('--tiles-per-task', dest='tiles_per_task', help='tiles run by a worker before it reports back',
+						default=None, type=int, action='store')
+	parser.add_argument('--tasks', dest='tasks', metavar='TASK', nargs='+', help='run only these tile ids', type=int)
+	parser.add_argument('-t', '--target-minutes', dest='target_minutes', help='target duration of a tile if a plan has to be made',
+						default=10, type=float, action='store')
+	parser.add_argument('--engine', dest='engine', help='fastlmm (pair by pair) or numpy (vectorized block pairs)',
+						default='fastlmm', choices=['fastlmm', 'numpy'], action='store')
+	parser.add_argument('--output-format', dest='output_format', help='per-tile results as text .gwas or compact binary .epi.npy',
+						default='text', choices=['text', 'binary'], action='store')
+	parser.add_argument('-p', '--threshold', dest='threshold', help='only write pairs with P at or below this (per-tile summaries still cover all pairs)',
+						default=1.0, type=float, action='store')
+	parser.add_argument('--screen', dest='screen', help='screen all pairs with the numpy engine, run fastlmm only on pairs with a screening P at or below this',
+						default=None, type=float, action='store')
+	parser.add_argument('-e', '--excludeByPosition', dest='exclude', help='leave the chromosomes of the tested SNPs out of K0 (with --exclude-window, only the windows within 2Mb of them)',
+						default=False, action='store_true')
+	parser.add_argument('--exclude-window', dest='exclude_window', help='with -e, precompute K0 per window of this many bp instead of per chromosome',
+						default=None, type=int, action='store')
+	parser.add_argument('--exclude-distance', dest='exclude_distance', help='skip pairs on the same chromosome at most this many bp apart',
+						default=None, type=float, action='store')
+	parser.add_argument('--exclude-r2', dest='exclude_r2', help='skip pairs whose genotypes have an r^2 above this',
+						default=None, type=float, action='store')
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='test every phenotype in one pass; results are named <dataset>.<index>_<tile> after pheno.key.txt',
+						default=False, action='store_true')
+	parser.add_argument('--permutations', dest='permutations', help='test this many permuted phenotypes instead and report genome-wide thresholds (numpy engine)',
+						default=0, type=int, action='store')
+	parser.add_argument('--seed', dest='seed', help='random seed of the permutations',
+						default=0, type=int, action='store')
+	parser.add_argument('--dtype', dest='dtype', help='precision of the genotype blocks and rotations of the numpy engine, screening and permutations',
+						default='float64', choices=['float64', 'float32'], action='store')
+
+	args = parser.parse_args()
+
+	# must happen before numpy is imported, workers inherit it
+	set_blas_threads(args.threads)
+
+	from epistasis_planner import PLAN_FILE, plan_dataset
+	from epistasis_kinship import KINSHIP_FILE, PHENO_KEY_FILE, precompute_kinship, model_inputs, inputs_current, read_pheno_key
+	from epistasis_windows import WINDOWS_FILE, precompute_windows, windows_inputs, windows_current
+
+	dataset = args.dataset
+	datadir = args.datadir
+	output_dir = args.outputdir or os.path.join(root, 'results', dataset)
+	covFile = args.covFile
+
+	# same preparation as the server: plan and G0 decomposition, once per set of inputs
+	if not os.path.exists(os.path.join(datadir, dataset + PLAN_FILE)):
+		plan_dataset(datadir, dataset, args.target_minutes * 60, args.engine, screen=args.screen)
+	kinship_file = os.path.join(datadir, dataset + KINSHIP_FILE)
+	covar_path = covFile and os.path.join(datadir, covFile)
+	if not inputs_current(kinship_file, model_inputs(os.path.join(datadir, dataset), covar_path, args.all_phenotypes)):
+		sys.stderr.write('Precomputing G0 decomposition for %s\n' % dataset)
+		precompute_kinship(os.path.join(datadir, dataset), covar_path, kinship_file, all_phenotypes=args.all_phenotypes)
+	windows_file = os.path.join(datadir, dataset + WINDOWS_FILE)
+	if args.exclude and not windows_current(windows_file, windows_inputs(os.path.join(datadir, dataset), covar_path, args.exclude_window, args.all_phenotypes)):
+		sys.stderr.write('Precomputing K0 windows for %s\n' % dataset)
+		precompute_windows(os.path.join(datadir, dataset), covar_path, windows_file, args.exclude_window, args.all_phenotypes)
+
+	failed = run_local(dataset, datadir, output_dir, args.workers, args.threads, args.tiles_per_task, args.tasks,
+					   covFile=covFile, species=args.species, engine=args.engine, output_format=args.output_format, threshold=args.threshold, screen=args.screen, all_phenotypes=args.all_phenotypes,
+					   exclude=args.exclude, exclude_distance=args.exclude_distance, exclude_r2=args.exclude_r2,
+					   permutations=args.permutations, seed=args.seed, dtype=args.dtype)
+
+	if failed:
+		sys.stderr.write('%s tiles failed: %s\n' % (len(failed), ' '.join(map(str, failed))))
+		sys.exit(1)
+	sys.stderr.write('all tiles finished, results in %s\n' % output_dir)
+
+	from epistasis_summary import summary_files, read_summary, combine, inflation
+	names = [dataset]
+	if args.all_phenotypes:
+		names = ['%s.%s' % (dataset, key) for key in read_pheno_key(os.path.join(output_dir, PHENO_KEY_FILE))[0]]
+	if args.permutations:
+		# every tile of the plan, as the server's --thresholds
+		from epistasis_planner import read_plan
+		from epistasis_pairs import load_positions, excluded_tiles
+		from epistasis_permutations import read_minima, genome_wide_minima, thresholds_report
+		tiles = read_plan(os.path.join(datadir, dataset + PLAN_FILE))[0]
+		skip = set()
+		if args.exclude_distance is not None:
+			chrom, bp = load_positions(os.path.join(datadir, dataset + '.FILTERED'))
+			skip = set(excluded_tiles(tiles, chrom, bp, args.exclude_distance))
+		for name in names:
+			try:
+				genome_minima = genome_wide_minima(read_minima(output_dir, name), len(tiles), skip)
+			except Exception as e:
+				sys.exit('%s: %s' % (name, e))
+			for line in thresholds_report(name, genome_minima, n_tiles=len(tiles)):
+				sys.stderr.write('%s\n' % line)
+		sys.exit(0)
+	for name in names:
+		total = combine(read_summary(filename) for filename in summary_files(output_dir, name))
+		sys.stderr.write('%s: %s pairs tested, %s with the full test, %s excluded, %s written, smallest P %s, lambda %.4f\n' % (name, total['pairs'], total['full_tests'], total['excluded'], total['written'], total['min_p'], inflation(total)))
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""
+Tracks which tiles of a dataset have valid results
+
+The manifest (results/<dataset>/manifest.txt) has one tab-separated line per
+tile with its status, output size, modification time and md5 checksum.
+Status is one of:
+	done     output exists, is complete and has the expected number of rows
+	         (all pairs of the tile, or the count in its summary when the node
+	         only kept pairs below a threshold)
+	missing  no output (and no failure marker)
+	excluded no output because all pairs of the tile are excluded by distance,
+	         the tile is never run
+	failed   no valid output and the job that ran it left a failure marker
+	empty    output file has no content
+	corrupt  truncated output, bad header/rows or wrong number of rows
+"""
+import sys
+import os
+import hashlib
+
+from epistasis_planner import read_plan, parse_tiles, block_pairs
+from epistasis_results import GWAS_HEADER, BINARY_SUFFIX, read_results
+from epistasis_summary import summary_file, read_summary
+
+MANIFEST_FILE = 'manifest.txt'
+FAILED_SUFFIX = '.failed'
+
+
+def output_file(output_dir, dataset, tile_id):
+	'''
+	Result file of a tile: the binary one if it exists, else the text one
+	'''
+	binary = os.path.join(output_dir, '%s_%s%s' % (dataset, tile_id, BINARY_SUFFIX))
+	if os.path.exists(binary):
+		return binary
+	return os.path.join(output_dir, '%s_%s.gwas' % (dataset, tile_id))
+
+
+def check_binary_output(filename, expected_rows=None):
+	md5 = hashlib.md5()
+	f = open(filename, 'rb')
+	for chunk in iter(lambda: f.read(1 << 20), b''):
+		md5.update(chunk)
+	f.close()
+
+	# a truncated .npy can't be mapped
+	try:
+		records = read_results(filename)
+	except ValueError:
+		return 'corrupt', md5.hexdigest()
+	if expected_rows is not None and len(records) != expected_rows:
+		return 'corrupt', md5.hexdigest()
+	return 'done', md5.hexdigest()
+
+
+def check_output(filename, expected_rows=None):
+	'''
+	Validates one .gwas or .epi.npy file while computing its checksum.
+	Returns (status, md5)
+	'''
+	if not os.path.exists(filename):
+		return 'missing', ''
+	if os.path.getsize(filename) == 0:
+		return 'empty', ''
+	if filename.endswith(BINARY_SUFFIX):
+		return check_binary_output(filename, expected_rows)
+
+	md5 = hashlib.md5()
+	status = 'done'
+	rows = 0
+	f = open(filename, 'rb')
+	header = f.readline()
+	md5.update(header)
+	if header.decode().rstrip('\r\n') != GWAS_HEADER:
+		status = 'corrupt'
+	last = header
+	for line in f:
+		md5.update(line)
+		last = line
+		fields = line.split(b'\t')
+		if status == 'done':
+			try:
+				float(fields[6])
+			except (IndexError, ValueError):
+				status = 'corrupt'
+		rows += 1
+	f.close()
+
+	# a job killed while writing leaves the last row without its newline
+	if not last.endswith(b'\n'):
+		status = 'corrupt'
+	if expected_rows is not None and rows != expected_rows:
+		status = 'corrupt'
+	return status, md5.hexdigest()
+
+
+def tile_rows(output_dir, dataset, tile_id, tile):
+	'''
+	Rows a tile's output should have. A thresholded tile's summary gives
+	the number of rows written; None if that summary is unusable. The
+	summary's pairs plus excluded pairs must add up to the tile's pairs
+	'''
+	pairs = sum(block_pairs(block) for block in tile)
+	filename = summary_file(output_dir, dataset, tile_id)
+	if not os.path.exists(filename):
+		return pairs
+	try:
+		summary = read_summary(filename)
+	except (ValueError, IndexError):
+		return None
+	if summary['pairs'] + summary.get('excluded', 0) != pairs:
+		return None
+	return summary['written']
+
+
+def failed_tiles(output_dir, dataset):
+	'''
+	Tiles of jobs that left a <dataset>_<tiles>.failed marker
+	'''
+	tiles = set()
+	prefix = dataset + '_'
+	for name in os.listdir(output_dir):
+		if name.startswith(prefix) and name.endswith(FAILED_SUFFIX):
+			try:
+				tiles.update(parse_tiles(name[len(prefix):-len(FAILED_SUFFIX)]))
+			except ValueError:
+				pass
+	return tiles
+
+
+def read_manifest(output_dir):
+	manifest = {}
+	filename = os.path.join(output_dir, MANIFEST_FILE)
+	if os.path.exists(filename):
+		f = open(filename)
+		f.readline()
+		for line in f:
+			line = line.rstrip('\n').split('\t')
+			if len(line) == 5:
+				manifest[int(line[0])] = {'status': line[1], 'bytes': int(line[2]), 'mtime': float(line[3]), 'md5': line[4]}
+		f.close()
+	return manifest
+
+
+def write_manifest(output_dir, manifest):
+	filename = os.path.join(output_dir, MANIFEST_FILE)
+	f = open(filename + '.tmp', 'w')
+	f.write('tile\tstatus\tbytes\tmtime\tmd5\n')
+	for tile_id in sorted(manifest):
+		entry = manifest[tile_id]
+		f.write('%s\t%s\t%s\t%s\t%s\n' % (tile_id, entry['status'], entry['bytes'], entry['mtime'], entry['md5']))
+	f.close()
+	os.rename(filename + '.tmp', filename)
+
+
+def check_tile(output_dir, name, tile_id, tile):
+	'''
+	Returns (status, bytes, mtime, md5) of the output of one tile
+	'''
+	filename = output_file(output_dir, name, tile_id)
+	size, mtime = 0, 0.0
+	if os.path.exists(filename):
+		size, mtime = os.path.getsize(filename), os.path.getmtime(filename)
+	rows = tile_rows(output_dir, name, tile_id, tile)
+	status, md5 = check_output(filename, rows)
+	if rows is None and status == 'done':
+		status = 'corrupt'
+	return status, size, mtime, md5
+
+
+def update_manifest(output_dir, dataset, plan_file, names=None, excluded=()):
+	'''
+	Rescans the outputs of every tile in the plan and rewrites the manifest.
+	Outputs already recorded as done with the same size and mtime are not
+	read again. Returns the manifest as a dict tile -> entry.
+	names are the output prefixes of a multi-phenotype run (<dataset>.<index>);
+	a tile is then done only if it is done for every phenotype, and bytes,
+	mtime and md5 cover all of its outputs. Tiles in excluded are not run
+	and recorded as excluded while they have no output
+	'''
+	tiles, info = read_plan(plan_file)
+	old = read_manifest(output_dir)
+	failed = failed_tiles(output_dir, dataset)
+	if names is None:
+		names = [dataset]
+
+	manifest = {}
+	for tile_id, tile in enumerate(tiles):
+		filenames = [output_file(output_dir, name, tile_id) for name in names]
+		size = sum(os.path.getsize(filename) for filename in filenames if os.path.exists(filename))
+		mtime = max([os.path.getmtime(filename) for filename in filenames if os.path.exists(filename)] + [0.0])
+
+		entry = old.get(tile_id)
+		if entry and entry['status'] == 'done' and entry['bytes'] == size and entry['mtime'] == mtime:
+			manifest[tile_id] = entry
+			continue
+
+		checks = [check_tile(output_dir, name, tile_id, tile) for name in names]
+		statuses = [check[0] for check in checks if check[0] != 'done']
+		status = statuses[0] if statuses else 'done'
+		if len(checks) == 1:
+			md5 = checks[0][3]
+		else:
+			md5 = hashlib.md5(''.join(check[3] for check in checks).encode()).hexdigest()
+		if status == 'missing' and tile_id in failed:
+			status = 'failed'
+		if status == 'missing' and tile_id in excluded:
+			status = 'excluded'
+		manifest[tile_id] = {'status': status, 'bytes': size, 'mtime': mtime, 'md5': md5}
+
+	write_manifest(output_dir, manifest)
+	return manifest
+
+
+def pending_tiles(manifest):
+	return sorted(tile_id for tile_id, entry in manifest.items() if entry['status'] not in ('done', 'excluded'))
+
+
+def summarize(manifest):
+	counts = {}
+	for entry in manifest.values():
+		counts[entry['status']] = counts.get(entry['status'], 0) + 1
+	return ', '.join('%s %s' % (counts[status], status) for status in sorted(counts))
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='updates and prints the result manifest of a dataset')
+	parser.add_argument('dataset', help='dataset prefix', action='store')
+	parser.add_argument('plan', help='plan file of the dataset', action='store')
+	parser.add_argument('-o', '--outputdir', dest='outputdir', help='folder with the per-tile results',
+						default='.', action='store')
+	parser.add_argument('--exclude-distance', dest='exclude_distance', help='the run excluded pairs at most this many bp apart (tiles without other pairs count as excluded)',
+						default=None, type=float, action='store')
+
+	args = parser.parse_args()
+
+	# a multi-phenotype run leaves its phenotype key next to the results
+	from epistasis_kinship import PHENO_KEY_FILE, read_pheno_key
+	names = None
+	key_file = os.path.join(args.outputdir, PHENO_KEY_FILE)
+	if os.path.exists(key_file):
+		names = ['%s.%s' % (args.dataset, key) for key in read_pheno_key(key_file)[0]]
+
+	# tiles excluded by distance, from the .bim next to the plan
+	excluded = ()
+	if args.exclude_distance is not None:
+		from epistasis_pairs import load_positions, excluded_tiles
+		chrom, bp = load_positions(os.path.join(os.path.dirname(args.plan), args.dataset + '.FILTERED'))
+		excluded = set(excluded_tiles(read_plan(args.plan)[0], chrom, bp, args.exclude_distance))
+
+	manifest = update_manifest(args.outputdir, args.dataset, args.plan, names, excluded)
+	print(summarize(manifest))
+	sys.exit([0, 1][len(pending_tiles(manifest)) > 0])
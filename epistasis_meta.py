@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+Dataset metadata, computed once per set of beds
+
+write_meta() scans the *.FULL and *.FILTERED .bed/.bim/.fam files once and
+writes <dataset>.meta.json next to them:
+	n_indivs, n_snps (FILTERED) and n_full_snps
+	chromosomes: [chromosome, first SNP index, SNP count] of every run of
+	    one chromosome in the FILTERED .bim, in file order
+	files: size, modification time and md5 of each of the six files
+read_meta() returns it and only rescans when a file changed size or
+modification time, so the planner, the resource estimate and the submit
+generator use the same counts without reading the .bim/.fam again.
+
+The server sends the file with the jobs. check_meta() compares it with
+the job's own readers, plan and .bim/.fam checksums, so a job whose files
+don't match what its tiles were planned on fails instead of testing other
+SNPs than the server meant.
+"""
+import os
+import json
+import hashlib
+
+# filename formats
+META_FILE = '.meta.json'
+FULL_DATASET = '.FULL'
+FILTERED_DATASET = '.FILTERED'
+
+SUFFIXES = ['.bed', '.bim', '.fam']
+
+
+def scan_file(filename, rows=False):
+	'''
+	Size, modification time and md5 of a file, with rows also the first
+	field of each line (one read for all of it)
+	'''
+	md5 = hashlib.md5()
+	fields = []
+	f = open(filename, 'rb')
+	if rows:
+		for line in f:
+			md5.update(line)
+			if line.strip():
+				fields.append(line.split(None, 1)[0])
+	else:
+		for chunk in iter(lambda: f.read(1 << 20), b''):
+			md5.update(chunk)
+	f.close()
+	info = {'bytes': os.path.getsize(filename), 'mtime': os.path.getmtime(filename), 'md5': md5.hexdigest()}
+	return info, fields
+
+
+def chromosome_runs(chromosomes):
+	'''
+	[chromosome, first index, count] of every run of SNPs on one chromosome
+	'''
+	runs = []
+	for index, chrom in enumerate(chromosomes):
+		chrom = chrom.decode()
+		if runs and runs[-1][0] == chrom:
+			runs[-1][2] += 1
+		else:
+			runs.append([chrom, index, 1])
+	return runs
+
+
+def meta_file(dataloc, dataset):
+	return os.path.join(dataloc, dataset + META_FILE)
+
+
+def compute_meta(dataloc, dataset):
+	meta = {'dataset': dataset, 'files': {}}
+	for name in [FULL_DATASET, FILTERED_DATASET]:
+		for suffix in SUFFIXES:
+			info, rows = scan_file(os.path.join(dataloc, dataset + name + suffix), suffix != '.bed')
+			meta['files'][dataset + name + suffix] = info
+			if name == FILTERED_DATASET and suffix == '.bim':
+				meta['n_snps'] = len(rows)
+				meta['chromosomes'] = chromosome_runs(rows)
+			elif name == FILTERED_DATASET and suffix == '.fam':
+				meta['n_indivs'] = len(rows)
+			elif name == FULL_DATASET and suffix == '.bim':
+				meta['n_full_snps'] = len(rows)
+	return meta
+
+
+def write_meta(dataloc, dataset):
+	'''
+	Scans the beds and writes <dataset>.meta.json (under a temporary name,
+	then renamed); returns the metadata
+	'''
+	meta = compute_meta(dataloc, dataset)
+	filename = meta_file(dataloc, dataset)
+	f = open(filename + '.tmp', 'w')
+	json.dump(meta, f, indent=1, sort_keys=True)
+	f.close()
+	os.rename(filename + '.tmp', filename)
+	return meta
+
+
+def load_meta(filename):
+	f = open(filename)
+	meta = json.load(f)
+	f.close()
+	return meta
+
+
+def meta_current(meta, dataloc):
+	'''
+	True if every file still has the size and modification time it was scanned with
+	'''
+	for name, info in meta['files'].items():
+		filename = os.path.join(dataloc, name)
+		if not os.path.exists(filename) or os.path.getsize(filename) != info['bytes'] or os.path.getmtime(filename) != info['mtime']:
+			return False
+	return True
+
+
+def read_meta(dataloc, dataset):
+	'''
+	The metadata of the dataset's beds, rescanned and rewritten only if
+	missing or out of date
+	'''
+	filename = meta_file(dataloc, dataset)
+	if os.path.exists(filename):
+		meta = load_meta(filename)
+		if meta_current(meta, dataloc):
+			return meta
+	return write_meta(dataloc, dataset)
+
+
+def check_meta(meta, dataset, filtered_snp_reader=None, full_snp_reader=None, plan_info=None):
+	'''
+	Problems with a job's inputs against the server's metadata: counts of
+	the genotype readers and of the plan, and the md5 of the .bim/.fam files
+	present in the working folder (a job only gets shards of the beds)
+	'''
+	problems = []
+	counts = []
+	if filtered_snp_reader is not None:
+		counts += [('FILTERED SNPs', filtered_snp_reader.sid_count, meta['n_snps']), ('individuals', filtered_snp_reader.iid_count, meta['n_indivs'])]
+	if full_snp_reader is not None:
+		counts.append(('FULL SNPs', full_snp_reader.sid_count, meta['n_full_snps']))
+	if plan_info is not None:
+		counts.append(('planned SNPs', plan_info['n_snps'], meta['n_snps']))
+	for what, found, expected in counts:
+		if found != expected:
+			problems.append('%s: %s, the dataset metadata has %s' % (what, found, expected))
+
+	for name in [FULL_DATASET, FILTERED_DATASET]:
+		for suffix in ['.bim', '.fam']:
+			filename = dataset + name + suffix
+			if os.path.exists(filename) and filename in meta['files']:
+				if scan_file(filename)[0]['md5'] != meta['files'][filename]['md5']:
+					problems.append('%s differs from the file the metadata was computed from' % filename)
+	return problems
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='writes (if out of date) and prints the metadata of a dataset\'s beds')
+	parser.add_argument('dataset', help='dataset prefix (expects .FULL and .FILTERED beds)', action='store')
+	parser.add_argument('-d', '--datadir', dest='datadir', help='folder with the beds',
+						default='.', action='store')
+
+	args = parser.parse_args()
+
+	meta = read_meta(args.datadir, args.dataset)
+	print('%s: %s individuals, %s SNPs (%s in FULL) on %s chromosomes' % (args.dataset, meta['n_indivs'], meta['n_snps'], meta['n_full_snps'],
+																		   len(set(chrom for chrom, first, count in meta['chromosomes']))))
+	for chrom, first, count in meta['chromosomes']:
+		print('%s\t%s\t%s' % (chrom, first, count))
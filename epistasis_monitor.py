@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+"""
+Follows the jobs of a dataset through their HTCondor user logs
+
+Every cluster submitted by the server writes condor_out/<dataset>/
+epistasis_<cluster>.log. update_monitor() reads the events appended to these
+logs since the last call, from the byte offset it stopped at, and keeps the
+state of every job (cluster.process) in condor_out/<dataset>/monitor.json:
+its status (idle, running, completed, evicted, held or removed), exit code
+or signal, host, evictions, hold reason and submit/start/end times. An event
+that is still being written is left for the next call. condor_q is never
+called, so polling costs one read of the new part of each log.
+
+Jobs are reported by their tiles: the compute submit file puts them in the
+submit event (submit_event_notes), which also covers clusters that DAGMan
+submitted under an id nobody recorded. For older logs without the note,
+the copies of the job list the server keeps as epistasis_<cluster>.jobs.txt
+are used. With the plan, progress is also reported in pairs.
+"""
+import sys
+import os
+import re
+import json
+import time
+from datetime import datetime
+
+MONITOR_FILE = 'monitor.json'
+LOG_PATTERN = re.compile(r'^epistasis_(\d+)\.log$')
+
+STATUSES = ['idle', 'running', 'completed', 'evicted', 'held', 'removed']
+
+# event header: code (cluster.process.subprocess) date time text
+EVENT_HEADER = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.\d+\) (\S+?)[ T](\d\d:\d\d:\d\d)\S* ?(.*)$')
+RETURN_VALUE = re.compile(r'Normal termination \(return value (-?\d+)\)')
+SIGNAL = re.compile(r'Abnormal termination \(signal (\d+)\)')
+HOST = re.compile(r'host:?\s*<?([^>\s]+)>?')
+# submit_event_notes of the compute submit file
+TILES_NOTE = re.compile(r'^\s*tiles (\S+)\s*$', re.M)
+
+SUBMIT, EXECUTE, EVICTED, TERMINATED, SHADOW_EXCEPTION, ABORTED, HELD, RELEASED = '000', '001', '004', '005', '007', '009', '012', '013'
+
+
+def event_time(date, clock):
+	'''
+	Seconds since the epoch of an event, dates being 2024-01-31 or, in
+	older logs, 01/31 without a year
+	'''
+	if '-' in date:
+		return time.mktime(datetime.strptime('%s %s' % (date, clock), '%Y-%m-%d %H:%M:%S').timetuple())
+	parts = date.split('/')
+	if len(parts) == 3:
+		return time.mktime(datetime.strptime('%s %s' % (date, clock), '%m/%d/%y %H:%M:%S').timetuple())
+	return time.mktime(datetime.strptime('%s/%s %s' % (date, datetime.now().year, clock), '%m/%d/%Y %H:%M:%S').timetuple())
+
+
+def read_events(filename, offset=0):
+	'''
+	Complete events of a user log after byte offset, as (code, cluster,
+	process, time, lines), and the offset after the last complete event.
+	A log shorter than offset was replaced and is read from the start
+	'''
+	f = open(filename, 'rb')
+	f.seek(0, 2)
+	if f.tell() < offset:
+		offset = 0
+	f.seek(offset)
+	events = []
+	lines = []
+	position = offset
+	for line in f:
+		position += len(line)
+		line = line.decode('utf-8', 'replace').rstrip('\r\n')
+		if line.strip() != '...':
+			lines.append(line)
+			continue
+		offset = position
+		header = EVENT_HEADER.match(lines[0]) if lines else None
+		lines, body = [], lines[1:]
+		if header is None:
+			continue
+		code, cluster, process, date, clock, text = header.groups()
+		events.append((code, int(cluster), int(process), event_time(date, clock), [text] + body))
+	f.close()
+	return events, offset
+
+
+def apply_event(jobs, event):
+	code, cluster, process, when, lines = event
+	text = '\n'.join(lines)
+	job = jobs.setdefault('%s.%s' % (cluster, process), {'status': 'idle', 'submitted': None, 'started': None, 'ended': None,
+														  'host': None, 'exit_code': None, 'signal': None, 'evictions': 0, 'hold_reason': None})
+	if code == SUBMIT:
+		job['submitted'] = when
+		note = TILES_NOTE.search(text)
+		if note:
+			job['tiles'] = note.group(1)
+	elif code == EXECUTE:
+		job['status'] = 'running'
+		job['started'] = when
+		host = HOST.search(lines[0])
+		job['host'] = host.group(1) if host else None
+	elif code == EVICTED:
+		job['status'] = 'evicted'
+		job['evictions'] += 1
+	elif code == SHADOW_EXCEPTION or code == RELEASED:
+		job['status'] = 'idle'
+	elif code == HELD:
+		job['status'] = 'held'
+		job['hold_reason'] = ' '.join(line.strip() for line in lines[1:] if line.strip()) or None
+	elif code == ABORTED:
+		job['status'] = 'removed'
+		job['ended'] = when
+	elif code == TERMINATED:
+		job['status'] = 'completed'
+		job['ended'] = when
+		value, signal = RETURN_VALUE.search(text), SIGNAL.search(text)
+		job['exit_code'] = int(value.group(1)) if value else None
+		job['signal'] = int(signal.group(1)) if signal else None
+
+
+def read_state(condor_output):
+	filename = os.path.join(condor_output, MONITOR_FILE)
+	if not os.path.exists(filename):
+		return {'offsets': {}, 'jobs': {}, 'updated': None}
+	f = open(filename)
+	state = json.load(f)
+	f.close()
+	return state
+
+
+def write_state(condor_output, state):
+	'''
+	Written under a temporary name and renamed, so an interrupted monitor
+	never leaves offsets ahead of the job states
+	'''
+	filename = os.path.join(condor_output, MONITOR_FILE)
+	f = open(filename + '.tmp', 'w')
+	json.dump(state, f, indent=1, sort_keys=True)
+	f.close()
+	os.rename(filename + '.tmp', filename)
+
+
+def update_monitor(condor_output):
+	'''
+	Applies the new events of every epistasis_<cluster>.log in condor_output
+	to the saved job states and saves them; returns the state
+	'''
+	state = read_state(condor_output)
+	for name in sorted(os.listdir(condor_output)):
+		if not LOG_PATTERN.match(name):
+			continue
+		events, offset = read_events(os.path.join(condor_output, name), state['offsets'].get(name, 0))
+		if offset < state['offsets'].get(name, 0):
+			sys.stderr.write('%s was rewritten, reading it again\n' % name)
+		for event in events:
+			apply_event(state['jobs'], event)
+		state['offsets'][name] = offset
+	state['updated'] = time.time()
+	write_state(condor_output, state)
+	return state
+
+
+def job_tiles(condor_output, state=None):
+	'''
+	Tile spec of every job (cluster.process), from the submit events in
+	state or else the job lists kept by the server
+	'''
+	tiles = {}
+	for name in os.listdir(condor_output):
+		match = re.match(r'^epistasis_(\d+)\.jobs\.txt$', name)
+		if not match:
+			continue
+		f = open(os.path.join(condor_output, name))
+		for process, line in enumerate(line for line in f if line.strip()):
+			tiles['%s.%s' % (match.group(1), process)] = line.split()[0]
+		f.close()
+	if state is not None:
+		tiles.update((job_id, job['tiles']) for job_id, job in state['jobs'].items() if job.get('tiles'))
+	return tiles
+
+
+def failed(job):
+	return job['status'] == 'completed' and (job['exit_code'] != 0 or job['signal'] is not None)
+
+
+def finished(state):
+	'''
+	True once no job is idle, running, evicted or held any more
+	'''
+	return all(job['status'] in ('completed', 'removed') for job in state['jobs'].values())
+
+
+def monitor_report(state, tiles=None, plan_file=None):
+	'''
+	Lines of a progress report: jobs per status, throughput since the first
+	job started, an estimate of the time left and the jobs that need
+	attention (held, failed, evicted several times)
+	'''
+	jobs = state['jobs']
+	tiles = tiles or {}
+	counts = dict((status, 0) for status in STATUSES)
+	for job in jobs.values():
+		counts[job['status']] += 1
+	lines = ['%s jobs: %s' % (len(jobs), ', '.join('%s %s' % (counts[status], status) for status in STATUSES if counts[status]))]
+
+	done = [job for job in jobs.values() if job['status'] == 'completed']
+	started = [job['started'] for job in jobs.values() if job['started'] is not None]
+	elapsed = 0
+	if done and started:
+		elapsed = max(job['ended'] for job in done) - min(started)
+		runtimes = sorted(job['ended'] - job['started'] for job in done if job['started'] is not None)
+		if elapsed > 0:
+			rate = len(done) / elapsed
+			left = len(jobs) - len(done) - counts['removed']
+			lines.append('%.1f jobs/hour, median run time %.0f s, about %.1f hours left' % (3600 * rate, runtimes[len(runtimes) // 2] if runtimes else 0, left / rate / 3600))
+
+	if plan_file and tiles and os.path.exists(plan_file):
+		from epistasis_planner import read_plan, parse_tiles, block_pairs
+		plan = read_plan(plan_file)[0]
+		pairs = lambda ids: sum(block_pairs(block) for job_id in ids if job_id in tiles for tile_id in parse_tiles(tiles[job_id]) if tile_id < len(plan) for block in plan[tile_id])
+		done_ids = [job_id for job_id, job in jobs.items() if job['status'] == 'completed' and not failed(job)]
+		total, complete = pairs(jobs), pairs(done_ids)
+		lines.append('%s of %s pairs done (%.1f%%)' % (complete, total, 100.0 * complete / max(total, 1)))
+		if elapsed > 0:
+			lines.append('%.1f pairs/s over the whole cluster' % (complete / elapsed))
+
+	for job_id in sorted(jobs, key=lambda job_id: tuple(map(int, job_id.split('.')))):
+		job = jobs[job_id]
+		name = '%s (tiles %s)' % (job_id, tiles[job_id]) if job_id in tiles else job_id
+		if job['status'] == 'held':
+			lines.append('held: %s: %s' % (name, job['hold_reason']))
+		elif failed(job):
+			lines.append('failed: %s: %s' % (name, ['exit code %s' % job['exit_code'], 'signal %s' % job['signal']][job['signal'] is not None]))
+		elif job['evictions'] > 1:
+			lines.append('evicted %s times: %s' % (job['evictions'], name))
+	return lines
+
+
+def watch(condor_output, interval=60, tiles=None, plan_file=None, output=sys.stderr):
+	'''
+	Reports progress every interval seconds until all jobs have finished
+	'''
+	while True:
+		state = update_monitor(condor_output)
+		output.write('%s\n' % datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+		for line in monitor_report(state, tiles or job_tiles(condor_output, state), plan_file):
+			output.write('%s\n' % line)
+		output.flush()
+		if state['jobs'] and finished(state):
+			return state
+		time.sleep(interval)
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='reports the state of the jobs of a dataset from their HTCondor user logs')
+	parser.add_argument('condor_output', help='folder with the epistasis_<cluster>.log files, e.g. condor_out/PREFIX', action='store')
+	parser.add_argument('--plan', dest='plan', help='plan file, to report progress in pairs',
+						default=None, action='store')
+	parser.add_argument('-w', '--watch', dest='watch', help='report every this many seconds until all jobs finished',
+						default=None, type=float, action='store')
+
+	args = parser.parse_args()
+
+	if args.watch:
+		watch(args.condor_output, args.watch, plan_file=args.plan, output=sys.stdout)
+		sys.exit(0)
+	state = update_monitor(args.condor_output)
+	for line in monitor_report(state, job_tiles(args.condor_output, state), args.plan):
+		print(line)
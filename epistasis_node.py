@@ -11,12 +11,24 @@ import logging
 import textwrap
 from time import time
 import numpy as np
+import pandas as pd
 from fastlmm.association import epistasis
 from fastlmm.association import single_snp
 from fastlmm.util.runner import LocalInParts
 import pysnptools.util
-from pysnptools.util.pheno import loadOnePhen
+from pysnptools.util.pheno import loadOnePhen, loadPhen
 from pysnptools.snpreader import Bed
+from epistasis_kinship import KINSHIP_FILE, PHENO_KEY_FILE, load_inputs, load_kinship, compute_kinship, pheno_keys, write_pheno_key
+from epistasis_engine import epistasis_numpy_multi, epistasis_permutations, permutation_indices, permuted_phenotypes
+from epistasis_planner import PLAN_FILE, read_plan, parse_tiles, format_tiles, block_pairs
+from epistasis_results import GWAS_COLUMNS, BINARY_SUFFIX, write_results
+from epistasis_summary import summarize_pvalues, write_summary, summary_file
+from epistasis_shards import open_bed, tile_groups
+from epistasis_pairs import block_keep, excluded_pairs, drop_excluded
+from epistasis_windows import WINDOWS_FILE, WindowKinship
+from epistasis_meta import META_FILE, load_meta, check_meta
+from epistasis_timing import PhaseTimer, timing_file, write_timing
+from epistasis_permutations import permutation_file, write_minima
 
 root = os.path.split(os.path.realpath(sys.argv[0]))[0]
 
@@ -25,8 +37,152 @@ species_chroms = {'human':24, 'mouse':21}
 species_chroms = {'human':23, 'mouse':20}
 
 
+def phenotype_models(dataset, output_dir, pheno, pheno_data, kinship, G0_args, all_phenotypes=False):
+	'''
+	Result set names, fastlmm phenotypes, phenotype matrix Y and the null
+	model shared by the blocks of a job: the dataset's phenotype, or with
+	all_phenotypes every column of the pheno file with its own delta (and
+	pheno.key.txt in output_dir). Y is None if only fastlmm tests the pairs.
+	A model is a dict of the kinship decomposition, the log delta of every
+	phenotype and their fastlmm arguments
+	'''
+	if all_phenotypes:
+		if 'log_deltas' not in kinship:
+			raise Exception('%s%s has no null model per phenotype, rebuild it with epistasis_kinship.py --all-phenotypes' % (dataset, KINSHIP_FILE))
+		Y = pheno_data['vals']
+		phenos = [{'vals': Y[:, j], 'iid': pheno_data['iid']} for j in range(Y.shape[1])]
+		names = ['%s.%s' % (dataset, key) for key in pheno_keys(pheno_data['header'])]
+		write_pheno_key(os.path.join(output_dir, PHENO_KEY_FILE), pheno_data['header'])
+		return names, phenos, Y, {'kinship': kinship, 'log_deltas': kinship['log_deltas'],
+								  'fastlmm_args': [dict(G0_args, log_delta=log_delta) for log_delta in kinship['log_deltas']]}
+	Y, log_deltas = None, None
+	if kinship is not None:
+		Y = pheno_data['vals'][:, None]
+		log_deltas = [kinship['log_delta']]
+	return [dataset], [pheno], Y, {'kinship': kinship, 'log_deltas': log_deltas, 'fastlmm_args': [G0_args]}
+
+
+def block_model(base_model, windows, reader, block, G0_args, n_full_snps):
+	'''
+	Null model a block (start0, end0, start1, end1) is tested against:
+	base_model, or with windows (a WindowKinship) K0 without the windows
+	around the block's SNPs
+	'''
+	if windows is None:
+		return base_model
+	start0, end0, start1, end1 = block
+	snps = np.r_[start0:end0, start1:end1]
+	model = windows.model(reader.pos[snps, 0], reader.pos[snps, 2])
+	if model is None:
+		return base_model
+	kinship, log_deltas, cache_file = model
+	# fastlmm scales delta by the SNP count of G0, not of the reduced K0
+	scale = np.log(kinship['sid_count'] / float(n_full_snps))
+	return {'kinship': kinship, 'log_deltas': log_deltas,
+			'fastlmm_args': [dict(G0_args, cache_file=cache_file, log_delta=log_delta + scale) for log_delta in log_deltas]}
+
+
+def run_epistasis(inputs, model, sid_list_0, sid_list_1, keep=None, engine='fastlmm', dtype='float64'):
+	'''
+	Epistasis of sid_list_0 x sid_list_1 under model, one dataframe (or
+	None) per phenotype. inputs holds the job's readers (reader, G0), covar
+	file and, for the numpy engine, its test_snps, Y and covar_data; keep is
+	None or the pairs of the block left after exclusion
+	'''
+	if engine == 'numpy':
+		frames = epistasis_numpy_multi(inputs['test_snps'], inputs['Y'], inputs['covar_data'], model['kinship'], model['log_deltas'], sid_list_0, sid_list_1, dtype)
+		if keep is not None:
+			frames = [drop_excluded(df, keep, sid_list_0, sid_list_1) for df in frames]
+		return frames
+	if keep is None or keep.all():
+		return [epistasis(inputs['reader'], phen, G0=inputs['G0'], covar=inputs['covar'], sid_list_0=sid_list_0, sid_list_1=sid_list_1, **args)
+				for phen, args in zip(inputs['phenos'], model['fastlmm_args'])]
+	# fastlmm tests whole lists against each other: one call per SNP0 with its remaining partners
+	diagonal = sid_list_0[0] == sid_list_1[0]
+	frames = []
+	for phen, args in zip(inputs['phenos'], model['fastlmm_args']):
+		rows = []
+		for i, snp0 in enumerate(sid_list_0):
+			partners = [sid_list_1[j] for j in np.flatnonzero(keep[i]) if not diagonal or j > i]
+			if partners:
+				rows.append(epistasis(inputs['reader'], phen, G0=inputs['G0'], covar=inputs['covar'], sid_list_0=[snp0], sid_list_1=partners, **args))
+		frames.append(pd.concat(rows) if rows else None)
+	return frames
+
+
+def run_screened(inputs, model, sid_list_0, sid_list_1, screen, keep=None, dtype='float64'):
+	'''
+	Screened run: vectorized test of every pair with the null model's delta,
+	then the full fastlmm test only for pairs with a screening P <= screen.
+	Returns the dataframes and the number of full tests per phenotype
+	'''
+	frames, full_tests = [], []
+	for j, df in enumerate(epistasis_numpy_multi(inputs['test_snps'], inputs['Y'], inputs['covar_data'], model['kinship'], model['log_deltas'], sid_list_0, sid_list_1, dtype)):
+		if keep is not None:
+			df = drop_excluded(df, keep, sid_list_0, sid_list_1)
+		candidates = df[df['PValue'] <= screen]
+		exact = [epistasis(inputs['reader'], inputs['phenos'][j], G0=inputs['G0'], covar=inputs['covar'], sid_list_0=[snp0], sid_list_1=list(pairs['SNP1']), **model['fastlmm_args'][j])
+				 for snp0, pairs in candidates.groupby('SNP0')]
+		full_tests.append(len(candidates))
+		frames.append(pd.concat([df[df['PValue'] > screen]] + exact))
+	return frames, full_tests
+
+
+def test_block(inputs, model, block, keep=None, engine='fastlmm', screen=None, dtype='float64'):
+	'''
+	Dataframes (or None) per phenotype of the pairs of a block and the
+	number of pairs of each that got the full test in a screened run
+	'''
+	start0, end0, start1, end1 = block
+	sid = inputs['reader'].sid
+	if screen is not None:
+		return run_screened(inputs, model, sid[start0:end0], sid[start1:end1], screen, keep, dtype)
+	frames = run_epistasis(inputs, model, sid[start0:end0], sid[start1:end1], keep, engine, dtype)
+	return frames, [0] * len(frames)
+
+
+def block_minima(inputs, model, permuted, block, keep=None, dtype='float64'):
+	'''
+	Smallest P over the pairs of a block for every permuted phenotype, per
+	phenotype
+	'''
+	start0, end0, start1, end1 = block
+	sid = inputs['reader'].sid
+	return [epistasis_permutations(inputs['test_snps'], permuted[j], inputs['covar_data'], model['kinship'], model['log_deltas'][j],
+								   sid[start0:end0], sid[start1:end1], keep, dtype) for j in range(len(permuted))]
+
+
+def write_tile(output_dir, name, tile_id, frames, reader, threshold=1.0, output_format='text', full_tests=None, excluded=0):
+	'''
+	Writes the results of one tile and phenotype, sorted by P, as text or
+	binary: only pairs with P <= threshold, and the summary of all pairs.
+	full_tests is None unless the run was screened
+	'''
+	df = pd.concat(frames) if frames else pd.DataFrame(columns=['SNP0', 'Chr0', 'ChrPos0', 'SNP1', 'Chr1', 'ChrPos1', 'PValue'])
+
+	# format outputs
+	final = df.loc[:, ['SNP0', 'Chr0', 'ChrPos0', 'SNP1', 'Chr1', 'ChrPos1', 'PValue']]
+	final.columns = GWAS_COLUMNS
+	# sorted by P so that merge_epistasis_output.py can stream-merge tiles
+	final = final.sort_values(by='P')
+
+	# the summary covers every pair, only pairs up to the threshold are shipped
+	summary = summarize_pvalues(final['P'], threshold, full_tests, excluded)
+	final = final[final['P'] <= threshold]
+
+	# output to csv, or as snp indices + p-values in the binary format
+	if output_format == 'binary':
+		write_results('%s/%s_%s%s' % (output_dir, name, tile_id, BINARY_SUFFIX),
+					  reader.sid_to_index(final['SNP1']), reader.sid_to_index(final['SNP2']), final['P'])
+	else:
+		final.to_csv('%s/%s_%s.gwas' % (output_dir, name, tile_id), sep='\t', index=False)
+	# written last: a tile with a summary has complete results
+	write_summary(summary_file(output_dir, name, tile_id), summary)
+	return len(df)
+
+
 # run fastlmmc
-def run_fastlmmc(dataset, output_dir, process_id, group_size, covFile=None, species='mouse', maxthreads=1, featsel=False, exclude=False, condition=None):
+def run_fastlmmc(dataset, output_dir, tile_ids, plan_file, covFile=None, species='mouse', maxthreads=1, featsel=False, exclude=False, condition=None, engine='fastlmm', output_format='text', threshold=1.0, screen=None, all_phenotypes=False, exclude_distance=None, exclude_r2=None, permutations=0, seed=0, dtype='float64'):
 
 	# commands from fastlmmc:
 	# maxthreads
@@ -40,9 +196,76 @@ def run_fastlmmc(dataset, output_dir, process_id, group_size, covFile=None, spec
 
 
 	bfile = dataset
-	filtered_snp_reader = Bed('%s.FILTERED' % bfile)
-	full_snp_reader = Bed('%s.FULL' % bfile)
-	pheno = '%s.pheno.txt' % dataset
+
+	# phase times of this job, written to <dataset>_<tiles>.timing.json at the end
+	timer = PhaseTimer()
+	timer.job_startup()
+
+	with timer.phase('open'):
+		# a job of a sharded dataset only gets the genotype shards of its groups
+		# (named after the plan's group size) next to the whole .bim/.fam files
+		tiles, plan_info = read_plan(plan_file)
+		group_size = plan_info['group_size']
+		filtered_snp_reader = open_bed('%s.FILTERED' % bfile, group_size)
+		full_snp_reader = open_bed('%s.FULL' % bfile, group_size)
+
+		# the server's metadata of the beds the tiles were planned on
+		if os.path.exists(dataset + META_FILE):
+			problems = check_meta(load_meta(dataset + META_FILE), dataset, filtered_snp_reader, full_snp_reader, plan_info)
+			if problems:
+				raise Exception('the inputs do not match the dataset metadata: %s' % '; '.join(problems))
+
+		# parse phenotype and covariates once for all tiles of this job
+		pheno = loadOnePhen('%s.pheno.txt' % dataset, vectorize=True, missing=np.nan)
+		covar = None
+		if covFile:
+			covar = loadPhen(covFile, missing=np.nan)
+
+	with timer.phase('kinship'):
+		# reuse the server's G0 eigendecomposition and null model if it was shipped
+		G0_args = {}
+		kinship_file = '%s%s' % (dataset, KINSHIP_FILE)
+		if os.path.exists(kinship_file):
+			G0_args = {'cache_file': kinship_file, 'log_delta': load_kinship(kinship_file)['log_delta']}
+		elif not os.path.exists('%s.FULL.bed' % bfile):
+			# with the cache, G0 only contributes its individuals and SNP count
+			raise Exception('%s.FULL.bed is needed to build the kinship matrix without %s' % (dataset, kinship_file))
+
+		# the numpy engine rotates whole blocks itself and needs the decomposition in memory
+		# it is also the fast first stage of a screened run and tests the permutations
+		test_snps, pheno_data, covar_data, kinship = None, None, None, None
+		if engine == 'numpy' or screen is not None or all_phenotypes or exclude or permutations:
+			test_snps, pheno_data, covar_data, G0 = load_inputs(dataset, covFile, all_phenotypes, group_size)
+			# blocks are rotated in dtype, U is converted once for all of them
+			if os.path.exists(kinship_file):
+				kinship = load_kinship(kinship_file, dtype)
+			else:
+				kinship = compute_kinship(pheno_data, covar_data, G0, dtype=dtype)
+				kinship['U'] = kinship['U'].astype(dtype, copy=False)
+
+	# one result set per phenotype: <dataset>.<phenotype index>_<tile> with all_phenotypes
+	names, phenos, Y, base_model = phenotype_models(dataset, output_dir, pheno, pheno_data, kinship, G0_args, all_phenotypes)
+	inputs = {'reader': filtered_snp_reader, 'G0': full_snp_reader, 'covar': covar, 'phenos': phenos,
+			  'test_snps': test_snps, 'Y': Y, 'covar_data': covar_data}
+
+	# permutation mode: the same permuted phenotypes in every job (same seed and
+	# individuals), tested against the null model's decomposition and delta
+	if permutations:
+		if exclude:
+			raise Exception('--permutations needs one K0 for all blocks and does not work with --excludeByPosition')
+		with timer.phase('kinship'):
+			indices = permutation_indices(len(Y), permutations, seed)
+			permuted = [permuted_phenotypes(Y[:, j], covar_data, kinship['U'], kinship['S'], np.exp(log_delta) * kinship['sid_count'], indices)
+						for j, log_delta in enumerate(base_model['log_deltas'])]
+
+	# leave-region-out: K0 minus the windows around each block's SNPs, from
+	# the per-window contributions precomputed by the server
+	windows = None
+	if exclude:
+		windows_file = dataset + WINDOWS_FILE
+		if not os.path.exists(windows_file) or not os.path.exists(kinship_file):
+			raise Exception('--excludeByPosition needs %s and %s, see epistasis_windows.py' % (kinship_file, windows_file))
+		windows = WindowKinship(windows_file, kinship, Y, covar_data)
 
 	v = globals()
 	chroms = map(str, range(1, species_chroms[species] + 1))
@@ -50,113 +273,88 @@ def run_fastlmmc(dataset, output_dir, process_id, group_size, covFile=None, spec
 
 	n = len(filtered_snp_reader.sid)
 
-	# case checking
-	if(group_size > n):
-		print("trying to group more than the number of existing snps:\nprogram ended!")
+	# check this job's blocks against the plan written by the server
+	if plan_info['n_snps'] != n:
+		print("plan was made for %s snps but %s.FILTERED has %s:\nprogram ended!" % (plan_info['n_snps'], dataset, n))
 		exit(1)
-	if(group_size == 0):
-		print("grouping size is 0:\nprogram ended!")
+	if min(tile_ids) >= len(tiles):
+		print("job number exceeds the number of tiles in the plan:\nprogram ended!")
 		exit(1)
-	groupNum = (n//group_size)
-	if (n % group_size !=0):
-		groupNum += 1
-	#print(groupNum)
-	if(groupNum < 2):
-		print("group number should be at least two, please decrease the size of snps in each group")
-		exit(1)
-	th = groupNum - 1
-	rest = process_id + 1
-	base = 0
-	hetero_num = groupNum*(groupNum - 1)//2
-	maxjobnum = hetero_num
-	homo_num = (groupNum //2) if (groupNum % 2 == 0) else (groupNum//2 + 1)
-	maxjobnum += homo_num
-	if(process_id >= maxjobnum):
-		print("job number exceeds the total number of jobs that epstasis could do")
-		exit(1)
-
-	list_1_idx_start = 0
-	list_1_idx_end = 0
-	list_2_idx_start = 0
-	list_2_idx_end = 0
-	single_homo = False;
-
-	if(process_id < hetero_num):
-		while(rest > th):
-			rest -= th
-			th -= 1
-			base += 1
-
-		list_1_idx_start = group_size*base
-		list_1_idx_end = list_1_idx_start + group_size
-
-		list_2_idx_start = group_size*(base + rest)
-		if((base + rest) == (groupNum -1)):
-			 list_2_idx_end = n - 1;
-		else:
-			list_2_idx_end = list_2_idx_start + group_size
-		#print('(' + str(base) + ',' + str(base + rest) + ')')
-
-	# homogenous computing: same group
-	else:
-		offset = process_id - hetero_num
-
-		offset *= 2
-		list_1_idx_start = group_size * offset
-
-		if(offset > groupNum):
-			# last homo with only one group
-			list_1_idx_end = n - 1;
-			single_homo = True
-
-		else:
-			list_1_idx_end = list_1_idx_start + group_size
-			list_2_idx_start = list_1_idx_end
-			list_2_idx_end = min(list_2_idx_start + group_size, n)
-
-		#print('(' + str(offset) + ',' + str(offset) + ')' + '(' + str(offset + 1) + ',' +\
-		#str(offset + 1) + ')')
-
-
-	# epistasis on all snps
-	df = None
-	if covFile:
-		if (process_id < hetero_num):
-			df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, covar=covFile, sid_list_0=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end], sid_list_1=filtered_snp_reader.sid[list_2_idx_start:list_2_idx_end])
-		else:
-			if(single_homo):
-				df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, covar=covFile, sid_list_0=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end], sid_list_1=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end])
+	if max(tile_ids) >= len(tiles):
+		# the last packed job usually runs past the end of the plan
+		print("skipping tiles %s-%s, the plan only has %s tiles" % (len(tiles), max(tile_ids), len(tiles)))
+		tile_ids = [tile_id for tile_id in tile_ids if tile_id < len(tiles)]
+
+	# readers, phenotypes and null models above are shared by every tile of the job
+	for tile_id in tile_ids:
+
+		# a block with the same range twice is a diagonal block: pairs within one group
+		results = [[] for name in names]
+		screened = [0] * len(names)
+		minima = [np.ones(permutations) for name in names]
+		excluded = 0
+		tile_start = timer.wall('epistasis')
+		# with -e, a block that would leave no SNP in K0 is tested in parts
+		blocks = tiles[tile_id]
+		if exclude:
+			blocks = [part for block in blocks for part in windows.parts(filtered_snp_reader.pos[:, 0], filtered_snp_reader.pos[:, 2], block)]
+		for block in blocks:
+			start0, end0, start1, end1 = block
+			if exclude:
+				with timer.phase('kinship'):
+					model = block_model(base_model, windows, filtered_snp_reader, block, G0_args, full_snp_reader.sid_count)
 			else:
-				df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, covar=covFile, sid_list_0=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end], sid_list_1=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end])
-				df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, covar=covFile, sid_list_0=filtered_snp_reader.sid[list_2_idx_start:list_2_idx_end], sid_list_1=filtered_snp_reader.sid[list_2_idx_start:list_2_idx_end])
-	else:
-		if (process_id < hetero_num):
-			df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, sid_list_0=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end], sid_list_1=filtered_snp_reader.sid[list_2_idx_start:list_2_idx_end])
-		else:
-			if(single_homo):
-				df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, sid_list_0=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end], sid_list_1=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end])
-			else:
-				df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, sid_list_0=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end], sid_list_1=filtered_snp_reader.sid[list_1_idx_start:list_1_idx_end])
-				df = epistasis(filtered_snp_reader, pheno, G0=full_snp_reader, sid_list_0=filtered_snp_reader.sid[list_2_idx_start:list_2_idx_end], sid_list_1=filtered_snp_reader.sid[list_2_idx_start:list_2_idx_end])
-
-	# format outputs
-	final = df.loc[:, ['SNP0', 'Chr0', 'ChrPos0', 'SNP1', 'Chr1', 'ChrPos1', 'PValue']]
-	final.columns = ['SNP1', 'CHR1', 'BP1', 'SNP2', 'CHR2', 'BP2', 'P']
-	# final = final[final['P'] <= 0.00001]
-
-	# output to csv
-	v.update(locals())
-	final.to_csv('%(output_dir)s/%(dataset)s_%(process_id)s.gwas' % v, sep='\t', index=False)
-
-
+				model = base_model
+
+			with timer.phase('epistasis'):
+				# pairs close together on one chromosome or in LD are not tested
+				keep = None
+				if exclude_distance is not None or exclude_r2 is not None:
+					keep = block_keep(filtered_snp_reader, start0, end0, start1, end1, exclude_distance, exclude_r2)
+					block_excluded = excluded_pairs(keep, start0 == start1)
+					excluded += block_excluded
+					if block_excluded == block_pairs(block):
+						continue
+				# only the smallest P of every permutation is kept
+				if permutations:
+					minima = [np.minimum(m, block_min) for m, block_min in zip(minima, block_minima(inputs, model, permuted, block, keep, dtype))]
+					continue
+				frames, full_tests = test_block(inputs, model, block, keep, engine, screen, dtype)
+				for j, df in enumerate(frames):
+					screened[j] += full_tests[j]
+					if df is not None:
+						results[j].append(df)
+		tile_epistasis = timer.wall('epistasis') - tile_start
+		if excluded:
+			print('tile %s: %s pairs excluded by distance or LD' % (tile_id, excluded))
+
+		tile_start = timer.wall('write')
+		with timer.phase('write'):
+			for j, name in enumerate(names):
+				if permutations:
+					write_minima(permutation_file(output_dir, name, tile_id), minima[j])
+					continue
+				pairs = write_tile(output_dir, name, tile_id, results[j], filtered_snp_reader, threshold, output_format,
+								   [None, screened[j]][screen is not None], excluded)
+				if screen is not None:
+					print('%s tile %s: %s pairs screened, %s passed P <= %g and got the full test' % (name, tile_id, pairs, screened[j], screen))
+		timer.add_tile(tile_id, blocks=len(tiles[tile_id]), groups=len(tile_groups([tiles[tile_id]], group_size)), phenotypes=len(names),
+					   pairs=sum(block_pairs(block) for block in tiles[tile_id]) - excluded, excluded=excluded,
+					   epistasis=tile_epistasis, write=timer.wall('write') - tile_start)
+
+	if exclude:
+		windows.close()
+
+	write_timing(timing_file(output_dir, dataset, format_tiles(tile_ids)),
+				 timer.record(dataset=dataset, tiles=format_tiles(tile_ids), engine=engine, screen=screen, exclude=exclude, group_size=group_size,
+							  n_snps=n, n_indivs=filtered_snp_reader.iid_count, phenotypes=len(names), permutations=permutations, dtype=dtype))
 
 if __name__ == '__main__':
 	from argparse import ArgumentParser
 	parser = ArgumentParser()
 	#parser.set_usage('''%prog [options] dataset''')
 	parser.add_argument('dataset', help='dataset to run', action='store')
-	parser.add_argument('group_size', type=int, help='number of snps in a group', action = 'store')
-	parser.add_argument('process_id', help= 'phenotype index', action='store')
+	parser.add_argument('process_id', help= 'tile index in the plan, or a list/range of them (e.g. 0-9 or 1+4+7)', action='store')
 	
 	parser.add_argument('-s', '--species', dest='species', help='mouse or human',
 						default=None, action='store')
@@ -164,7 +362,7 @@ if __name__ == '__main__':
 						default=None, action='store')
 	parser.add_argument('-f', '--feature-selection', dest='featsel', help='perform feature selection',
 						default=False, action='store_true')
-	parser.add_argument('-e', '--excludeByPosition', dest='exclude', help='exclude SNPs within 2Mb of tested SNP from kinship matrix construction',
+	parser.add_argument('-e', '--excludeByPosition', dest='exclude', help='leave the chromosomes of the tested SNPs (or the windows within 2Mb of them) out of the kinship matrix (needs dataset%s)' % WINDOWS_FILE,
 						default=False, action='store_true')
 	parser.add_argument('--maxthreads', dest='maxthreads', help='max # of threads to use',
 						default=1, choices=range(1,17), type=int, action='store')
@@ -172,6 +370,30 @@ if __name__ == '__main__':
 						default=None, action='store', nargs=1)
 	parser.add_argument('--debug', dest='debug', help='log debugging output',
 						default=False, action='store_true')
+	parser.add_argument('--plan', dest='plan', help='tile plan written by the server (default: dataset%s)' % PLAN_FILE,
+						default=None, action='store')
+	parser.add_argument('--tiles-per-job', dest='tiles_per_job', help='process_id is a packed job running this many consecutive tiles',
+						default=1, type=int, action='store')
+	parser.add_argument('--output-format', dest='output_format', help='text (.gwas) or binary (%s: snp indices and p-values)' % BINARY_SUFFIX,
+						default='text', choices=['text', 'binary'], action='store')
+	parser.add_argument('--engine', dest='engine', help='fastlmm (pair by pair) or numpy (vectorized block pairs)',
+						default='fastlmm', choices=['fastlmm', 'numpy'], action='store')
+	parser.add_argument('--screen', dest='screen', help='screen all pairs with the numpy engine and run fastlmm only on pairs with a screening P at or below this',
+						default=None, type=float, action='store')
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='test every phenotype column, output per phenotype index of pheno.key.txt',
+						default=False, action='store_true')
+	parser.add_argument('-p', '--threshold', dest='threshold', help='only write pairs with P at or below this (the summary still covers all pairs)',
+						default=1.0, type=float, action='store')
+	parser.add_argument('--exclude-distance', dest='exclude_distance', help='skip pairs on the same chromosome at most this many bp apart',
+						default=None, type=float, action='store')
+	parser.add_argument('--permutations', dest='permutations', help='instead of the results, write the smallest P over each tile for this many permuted phenotypes (numpy engine)',
+						default=0, type=int, action='store')
+	parser.add_argument('--seed', dest='seed', help='seed of the permutations, the same for all jobs of a scan',
+						default=0, type=int, action='store')
+	parser.add_argument('--exclude-r2', dest='exclude_r2', help='skip pairs whose genotypes have an r^2 above this',
+						default=None, type=float, action='store')
+	parser.add_argument('--dtype', dest='dtype', help='precision of the genotype blocks and rotations of the numpy engine, screening and permutations (likelihoods and P are float64 either way)',
+						default='float64', choices=['float64', 'float32'], action='store')
 
 	args = parser.parse_args()
 
@@ -183,13 +405,23 @@ if __name__ == '__main__':
 	condition = args.condition
 	debug = args.debug
 	dataset = args.dataset
-	group_size = args.group_size
+	plan_file = args.plan or dataset + PLAN_FILE
+	engine = args.engine
+	output_format = args.output_format
+	threshold = args.threshold
+	screen = args.screen
+	all_phenotypes = args.all_phenotypes
+	exclude_distance = args.exclude_distance
+	exclude_r2 = args.exclude_r2
+	permutations = args.permutations
+	seed = args.seed
+	dtype = args.dtype
 
 	output_dir = root
-	process_id = int( args.process_id )
+	tile_ids = parse_tiles(args.process_id, args.tiles_per_job)
 
 	if debug:
 		print('args:')
 		pprint(args)
 
-	run_fastlmmc(dataset, output_dir, process_id, group_size, covFile, species, maxthreads, featsel=featsel, exclude=exclude, condition=condition)
+	run_fastlmmc(dataset, output_dir, tile_ids, plan_file, covFile, species, maxthreads, featsel=featsel, exclude=exclude, condition=condition, engine=engine, output_format=output_format, threshold=threshold, screen=screen, all_phenotypes=all_phenotypes, exclude_distance=exclude_distance, exclude_r2=exclude_r2, permutations=permutations, seed=seed, dtype=dtype)
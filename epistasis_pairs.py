@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+Pairs that are not worth testing
+
+Two SNPs on the same chromosome within exclude_distance bp of each other, or
+with a genotype r^2 above exclude_r2, are in LD and not interesting for
+epistasis. Jobs skip those pairs (and count them in the tile summary as
+excluded), and tiles whose pairs are all excluded by distance, which is
+known from the .bim alone, are not run at all.
+"""
+import numpy as np
+import pandas as pd
+
+# same chromosome codes as pysnptools' Bed
+CHROM_CODES = {'X': 23, 'Y': 24, 'XY': 25, 'MT': 26}
+
+
+def load_positions(prefix):
+	'''
+	Chromosome and bp position of every SNP of prefix.bim as float arrays,
+	with 0 (unknown) as nan like pysnptools' pos
+	'''
+	bim = pd.read_csv(prefix + '.bim', sep=r'\s+', header=None, usecols=[0, 3], dtype=str)
+	chrom = bim[0].map(lambda c: CHROM_CODES.get(c, c)).values.astype(np.float64)
+	bp = bim[3].values.astype(np.float64)
+	chrom[chrom == 0] = np.nan
+	bp[bp == 0] = np.nan
+	return chrom, bp
+
+
+def distance_mask(chrom0, bp0, chrom1, bp1, distance):
+	'''
+	True for the pairs on the same chromosome at most distance bp apart
+	'''
+	same = np.equal.outer(chrom0, chrom1)
+	with np.errstate(invalid='ignore'):
+		return same & (np.abs(np.subtract.outer(bp0, bp1)) <= distance)
+
+
+def r2_mask(A, B, r2):
+	'''
+	True for the pairs of standardized genotype columns with r^2 > r2
+	'''
+	r = A.T.dot(B) / A.shape[0]
+	return r * r > r2
+
+
+def block_keep(snps, start0, end0, start1, end1, distance=None, r2=None):
+	'''
+	Boolean matrix of the pairs of a block that are tested, rows start0:end0
+	and columns start1:end1 of snps. Symmetric for a diagonal block, where
+	only i < j counts
+	'''
+	pos = snps.pos
+	keep = np.ones((end0 - start0, end1 - start1), dtype=bool)
+	if distance is not None:
+		keep &= ~distance_mask(pos[start0:end0, 0], pos[start0:end0, 2], pos[start1:end1, 0], pos[start1:end1, 2], distance)
+	if r2 is not None:
+		A = snps[:, start0:end0].read().standardize().val
+		B = A if start0 == start1 else snps[:, start1:end1].read().standardize().val
+		keep &= ~r2_mask(A, B, r2)
+	return keep
+
+
+def excluded_pairs(keep, diagonal):
+	if diagonal:
+		return int((~keep)[np.triu_indices(len(keep), 1)].sum())
+	return int((~keep).sum())
+
+
+def drop_excluded(df, keep, sid_list_0, sid_list_1):
+	'''
+	Rows of an epistasis dataframe whose pair is kept
+	'''
+	i0 = pd.Index(sid_list_0).get_indexer(df['SNP0'])
+	i1 = pd.Index(sid_list_1).get_indexer(df['SNP1'])
+	return df[keep[i0, i1]]
+
+
+def block_excluded(chrom, bp, block, distance):
+	'''
+	True if every pair of the block is excluded by distance: all of its
+	SNPs are on one chromosome and no two of them are further apart
+	'''
+	start0, end0, start1, end1 = block
+	snps = np.r_[start0:end0, start1:end1]
+	if np.isnan(chrom[snps]).any() or len(np.unique(chrom[snps])) != 1:
+		return False
+	if start0 == start1:
+		return bp[start0:end0].max() - bp[start0:end0].min() <= distance
+	return max(bp[start1:end1].max() - bp[start0:end0].min(), bp[start0:end0].max() - bp[start1:end1].min()) <= distance
+
+
+def excluded_tiles(tiles, chrom, bp, distance):
+	'''
+	Ids of the tiles that have no pair left to test
+	'''
+	return [tile_id for tile_id, tile in enumerate(tiles) if all(block_excluded(chrom, bp, block, distance) for block in tile)]
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	from epistasis_planner import read_plan, block_pairs
+	parser = ArgumentParser(description='lists the tiles of a plan whose pairs are all excluded by distance')
+	parser.add_argument('prefix', help='bed prefix the plan was made for, e.g. data/PREFIX.FILTERED', action='store')
+	parser.add_argument('plan', help='plan file', action='store')
+	parser.add_argument('--exclude-distance', dest='exclude_distance', help='pairs on one chromosome at most this many bp apart are excluded',
+						required=True, type=float, action='store')
+
+	args = parser.parse_args()
+
+	tiles, info = read_plan(args.plan)
+	chrom, bp = load_positions(args.prefix)
+	excluded = excluded_tiles(tiles, chrom, bp, args.exclude_distance)
+	pairs = sum(block_pairs(block) for tile_id in excluded for block in tiles[tile_id])
+	print('%s of %s tiles (%s pairs) are excluded' % (len(excluded), len(tiles), pairs))
+	for tile_id in excluded:
+		print(tile_id)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+Genome-wide significance thresholds from permuted phenotypes
+
+With --permutations P, a job tests P permuted copies of the phenotype
+(epistasis_engine.permuted_phenotypes, the same permutations in every job)
+against its tiles and writes the smallest p-value of each permutation over
+the tile's pairs to <name>_<tile>.perm.npy. The smallest p-value of a
+permutation over the whole scan is the minimum over all tiles;
+permutation_thresholds() takes the alpha quantile of these P genome-wide
+minima as the family-wise threshold at level alpha: a pair of the real scan
+with P below it is significant genome-wide.
+"""
+import sys
+import os
+import re
+import numpy as np
+
+PERMUTATION_SUFFIX = '.perm.npy'
+ALPHAS = [0.05, 0.01]
+
+
+def permutation_file(output_dir, name, tile_id):
+	return os.path.join(output_dir, '%s_%s%s' % (name, tile_id, PERMUTATION_SUFFIX))
+
+
+def write_minima(filename, minima):
+	'''
+	Written under a temporary name and renamed, so a tile's file is complete if it exists
+	'''
+	f = open(filename + '.tmp', 'wb')
+	np.save(f, np.asarray(minima, dtype=np.float64))
+	f.close()
+	os.rename(filename + '.tmp', filename)
+
+
+def read_minima(output_dir, name):
+	'''
+	{tile: minima} of every <name>_<tile>.perm.npy in output_dir
+	'''
+	pattern = re.compile(r'^%s_(\d+)%s$' % (re.escape(name), re.escape(PERMUTATION_SUFFIX)))
+	minima = {}
+	for filename in os.listdir(output_dir):
+		match = pattern.match(filename)
+		if match:
+			minima[int(match.group(1))] = np.load(os.path.join(output_dir, filename))
+	return minima
+
+
+def genome_wide_minima(minima, n_tiles=None, skip=()):
+	'''
+	Smallest p-value of every permutation over all tiles. With n_tiles,
+	every tile of the plan but those in skip must have its minima, and
+	minima of other tiles (left over from another plan) are an error
+	'''
+	if not minima:
+		raise Exception('no permutation minima found')
+	if n_tiles is not None:
+		missing = sorted(set(range(n_tiles)).difference(minima, skip))
+		if missing:
+			raise Exception('%s tiles have no permutation minima yet: %s' % (len(missing), ', '.join(map(str, missing[:20])) + ['', ', ...'][len(missing) > 20]))
+		foreign = sorted(tile_id for tile_id in minima if tile_id >= n_tiles or tile_id in skip)
+		if foreign:
+			raise Exception('minima of %s tiles that are not run by the plan: %s' % (len(foreign), ', '.join(map(str, foreign[:20])) + ['', ', ...'][len(foreign) > 20]))
+	counts = set(len(values) for values in minima.values())
+	if len(counts) > 1:
+		raise Exception('tiles were run with different numbers of permutations: %s' % ', '.join(map(str, sorted(counts))))
+	return np.min(np.array(list(minima.values())), axis=0)
+
+
+def permutation_thresholds(genome_minima, alphas=ALPHAS):
+	'''
+	[(alpha, threshold P)]: the alpha quantile of the genome-wide minima
+	'''
+	return [(alpha, float(np.percentile(genome_minima, 100 * alpha))) for alpha in alphas]
+
+
+def thresholds_report(name, genome_minima, alphas=ALPHAS, n_tiles=None):
+	lines = ['%s: %s permutations over %s tiles' % (name, len(genome_minima), ['all', n_tiles][n_tiles is not None])]
+	for alpha, threshold in permutation_thresholds(genome_minima, alphas):
+		lines.append('alpha %g: P < %.3g (-log10 P > %.2f)' % (alpha, threshold, -np.log10(threshold)))
+	if len(genome_minima) < 20 / min(alphas):
+		lines.append('note: with %s permutations the threshold at alpha %g rests on fewer than 20 permutations' % (len(genome_minima), min(alphas)))
+	return lines
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='genome-wide thresholds from the permutation minima of all tiles')
+	parser.add_argument('name', help='result name (the dataset, or <dataset>.<phenotype index> with --all-phenotypes)', action='store')
+	parser.add_argument('-i', '--inputdir', dest='inputdir', help='folder with the <name>_<tile>%s files' % PERMUTATION_SUFFIX,
+						default='.', action='store')
+	parser.add_argument('--plan', dest='plan', help='plan file, to check that every tile has its minima',
+						default=None, action='store')
+	parser.add_argument('-a', '--alpha', dest='alphas', help='family-wise error rates',
+						default=ALPHAS, nargs='+', type=float, action='store')
+	parser.add_argument('-o', '--output', dest='output', help='also save the genome-wide minima (.npy)',
+						default=None, action='store')
+
+	args = parser.parse_args()
+
+	n_tiles = None
+	if args.plan:
+		from epistasis_planner import read_plan
+		n_tiles = read_plan(args.plan)[1]['n_tiles']
+	try:
+		genome_minima = genome_wide_minima(read_minima(args.inputdir, args.name), n_tiles)
+	except Exception as e:
+		sys.exit('%s: %s' % (args.name, e))
+	for line in thresholds_report(args.name, genome_minima, args.alphas, n_tiles):
+		print(line)
+	if args.output:
+		np.save(args.output, genome_minima)
@@ -16,6 +16,7 @@ from datetime import datetime
 import time
 import re
 
+from epistasis_tped import tped_index
 
 
 debug = False
@@ -49,13 +50,9 @@ def timestamp():
 # write out snp combos into a file
 def make_snp_combos(dataLoc, tfile_prefix):
 
-  # extract snps from the tped file
-  	# runs command in shell to extract second column (rsIDs) from tped
-	# saves rsIDs to snps.txt
-  subprocess.call("awk {'print $2'} %(dataLoc)s/%(tfile_prefix)s.tped > %(dataLoc)s/snps.txt" % locals(), shell=True)
-  snps = [x.strip() for x in open('%(dataLoc)s/snps.txt' % locals()).readlines()]
-  if snps[0] == '':
-	snps.pop(0)
+  # snp ids from the tped's offset index (built on first use, shipped with
+  # the data so that jobs can seek to their snp ranges)
+  snps = list(tped_index('%(dataLoc)s/%(tfile_prefix)s.tped' % locals())['snp'])
 
   # set up the looping params for generating the range of snps
   first = range(1, len(snps), 7500)
@@ -67,13 +64,14 @@ def make_snp_combos(dataLoc, tfile_prefix):
   x = ['%s,%s' % (first[i], last[i]-1) for i in range(len(first))]
   # x = ['%s-%s' % (snps[ first[i]], snps[last[i]-1]) for i in range(len(first))]
 
-  # pairwise combos of snp ranges
+  # pairwise combos of snp ranges, each unordered combo once (the wrapper
+  # tests all pairs in the union of both ranges, so (j,i) would repeat (i,j))
   all_combos = open('%(dataLoc)s/snp_combos_%(tfile_prefix)s.txt' % locals(), 'w')
-  for i in x:
-	for j in x:
-	  if i != j:
-		s = '%(i)s;%(j)s' % locals()
-		all_combos.write('%s\n' % s)
+  for a in range(len(x)):
+	for b in range(a + 1, len(x)):
+	  i, j = x[a], x[b]
+	  s = '%(i)s;%(j)s' % locals()
+	  all_combos.write('%s\n' % s)
 
   all_combos.close()
 
@@ -119,7 +117,8 @@ def process(params, covar=False, memory=1024, tasks=None, species='mouse', maxth
 	''').replace('\t*', '')
 
 
-	# set memory and max threads
+	# set memory and max threads; --memory overrides the default
+	local_memory = memory
 	if memory is None:
 		local_memory = 8000
 
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+"""
+Plans how the SNP pairs of a dataset are split into cluster jobs
+
+SNPs are cut into equally sized groups. Each job ("tile") is a list of
+blocks of SNP index ranges; a block is either two different groups (all
+pairs between them) or a single group (all pairs within it). Group pairs
+are whole tiles, and the smaller blocks (diagonal groups and blocks with
+the short last group) are packed together so that every tile has about
+the same number of pairs.
+
+Plan file format (tab separated, end indices exclusive):
+	# n_snps <n> group_size <g> n_tiles <t>
+	tile	start0	end0	start1	end1	pairs
+"""
+import sys
+import os
+from math import ceil, sqrt
+import numpy as np
+
+# filename formats
+PLAN_FILE = '.plan.txt'
+
+# rough cost of testing one pair: (fixed seconds, seconds per individual^2)
+# the n^2 term is the rotation of the product column into the K0 eigenbasis
+pair_cost = {'fastlmm': (2e-4, 2e-9),
+			 'numpy': (0.0, 4e-10)}
+
+
+def estimate_pair_seconds(n_indivs, engine='fastlmm', screen=None):
+	'''
+	With screening every pair gets the numpy test and, under the null, a
+	fraction screen of them also the fastlmm test
+	'''
+	if screen is not None:
+		return estimate_pair_seconds(n_indivs, 'numpy') + screen * estimate_pair_seconds(n_indivs, 'fastlmm')
+	fixed, per_indiv = pair_cost[engine]
+	return fixed + per_indiv * n_indivs * n_indivs
+
+
+def choose_group_size(n_snps, n_indivs, target_seconds, engine='fastlmm', screen=None):
+	'''
+	Largest group size g whose g x g block fits in the target job duration
+	'''
+	target_pairs = target_seconds / estimate_pair_seconds(n_indivs, engine, screen)
+	group_size = int(sqrt(target_pairs))
+	return max(1, min(group_size, n_snps))
+
+
+def block_pairs(block):
+	start0, end0, start1, end1 = block
+	if start0 == start1:
+		n = end0 - start0
+		return n * (n - 1) // 2
+	return (end0 - start0) * (end1 - start1)
+
+
+def make_plan(n_snps, group_size):
+	'''
+	Returns a list of tiles, each a list of (start0, end0, start1, end1) blocks
+	'''
+	bounds = list(range(0, n_snps, group_size)) + [n_snps]
+	groups = list(zip(bounds[:-1], bounds[1:]))
+	capacity = group_size * group_size
+
+	tiles = []
+	small = []
+	for i, (start0, end0) in enumerate(groups):
+		for start1, end1 in groups[i:]:
+			block = (start0, end0, start1, end1)
+			pairs = block_pairs(block)
+			if pairs == 0:
+				continue
+			if pairs == capacity:
+				tiles.append([block])
+			else:
+				small.append(block)
+
+	# pack the remaining blocks, largest first, into tiles of up to one full block
+	small.sort(key=block_pairs, reverse=True)
+	tile = []
+	tile_pairs = 0
+	for block in small:
+		pairs = block_pairs(block)
+		if tile and tile_pairs + pairs > capacity:
+			tiles.append(tile)
+			tile = []
+			tile_pairs = 0
+		tile.append(block)
+		tile_pairs += pairs
+	if tile:
+		tiles.append(tile)
+
+	return tiles
+
+
+def verify_plan(tiles, n_snps):
+	'''
+	Checks that every unordered pair of SNPs is tested exactly once.
+	Blocks are mapped onto the segments between all block boundaries and
+	coverage is counted per segment pair, so the check is quadratic in the
+	number of groups rather than in the number of SNPs
+	'''
+	blocks = [block for tile in tiles for block in tile]
+	bounds = sorted(set([0, n_snps] + [x for block in blocks for x in block]))
+	if bounds[0] != 0 or bounds[-1] != n_snps:
+		raise Exception('plan covers SNP indices outside of [0, %s)' % n_snps)
+	segment = dict((x, i) for i, x in enumerate(bounds))
+
+	n_segments = len(bounds) - 1
+	coverage = np.zeros((n_segments, n_segments), dtype=np.int32)
+	for start0, end0, start1, end1 in blocks:
+		if start0 > start1:
+			start0, end0, start1, end1 = start1, end1, start0, end0
+		a0, b0, a1, b1 = segment[start0], segment[end0], segment[start1], segment[end1]
+		if (start0, end0) == (start1, end1):
+			coverage[a0:b0, a0:b0] += np.triu(np.ones((b0 - a0, b0 - a0), dtype=np.int32))
+		elif end0 <= start1:
+			coverage[a0:b0, a1:b1] += 1
+		else:
+			raise Exception('block %s overlaps itself without being a diagonal block' % ((start0, end0, start1, end1),))
+
+	# single-SNP segments have no pairs within them
+	sizes = np.diff(bounds)
+	expected = np.triu(np.ones((n_segments, n_segments), dtype=np.int32))
+	expected[np.diag_indices(n_segments)] = sizes > 1
+	coverage[np.diag_indices(n_segments)] *= sizes > 1
+
+	if not np.array_equal(coverage, expected):
+		missing = np.transpose(np.nonzero(coverage < expected))
+		repeated = np.transpose(np.nonzero(coverage > expected))
+		raise Exception('plan does not cover every pair exactly once (%s segment pairs missing, %s repeated)' % (len(missing), len(repeated)))
+
+	total = sum(block_pairs(block) for block in blocks)
+	if total != n_snps * (n_snps - 1) // 2:
+		raise Exception('plan has %s pairs, expected %s' % (total, n_snps * (n_snps - 1) // 2))
+
+
+def write_plan(filename, tiles, n_snps, group_size):
+	f = open(filename, 'w')
+	f.write('# n_snps %s group_size %s n_tiles %s\n' % (n_snps, group_size, len(tiles)))
+	f.write('tile\tstart0\tend0\tstart1\tend1\tpairs\n')
+	for tile_id, tile in enumerate(tiles):
+		for block in tile:
+			f.write('%s\t%s\t%s\t%s\t%s\t%s\n' % ((tile_id,) + tuple(block) + (block_pairs(block),)))
+	f.close()
+
+
+def read_plan(filename):
+	'''
+	Returns (tiles, info) where info holds n_snps, group_size and n_tiles
+	'''
+	f = open(filename)
+	header = f.readline().strip('#').split()
+	info = dict((key, int(value)) for key, value in zip(header[::2], header[1::2]))
+	f.readline()
+
+	tiles = [[] for i in range(info['n_tiles'])]
+	for line in f:
+		line = line.split()
+		if line:
+			tiles[int(line[0])].append(tuple(map(int, line[1:5])))
+	f.close()
+	return tiles, info
+
+
+def parse_tiles(spec, tiles_per_job=1):
+	'''
+	Tile ids for a job: either a list/range such as "3", "0-9" or "1+4+7-9"
+	("1,4,7-9" is read too), or, with tiles_per_job > 1, the process number
+	of a packed job
+	'''
+	if tiles_per_job > 1:
+		process_id = int(spec)
+		return list(range(process_id * tiles_per_job, (process_id + 1) * tiles_per_job))
+
+	tile_ids = []
+	for part in spec.replace(',', '+').split('+'):
+		if '-' in part:
+			first, last = map(int, part.split('-'))
+			tile_ids.extend(range(first, last + 1))
+		else:
+			tile_ids.append(int(part))
+	return tile_ids
+
+
+def format_tiles(tile_ids):
+	'''
+	Inverse of parse_tiles: compact spec such as "1+4+7-9" for a list of tile
+	ids. The spec has no commas, which HTCondor's "queue ... from" would
+	split it on
+	'''
+	parts = []
+	tile_ids = sorted(tile_ids)
+	i = 0
+	while i < len(tile_ids):
+		j = i
+		while j + 1 < len(tile_ids) and tile_ids[j + 1] == tile_ids[j] + 1:
+			j += 1
+		if j > i:
+			parts.append('%s-%s' % (tile_ids[i], tile_ids[j]))
+		else:
+			parts.append('%s' % tile_ids[i])
+		i = j + 1
+	return '+'.join(parts)
+
+
+def count_lines(filename):
+	with open(filename) as f:
+		return sum(1 for line in f if line.strip())
+
+
+def plan_dataset(dataloc, dataset, target_seconds, engine='fastlmm', group_size=None, screen=None):
+	'''
+	Plans the *.FILTERED dataset in dataloc, verifies the plan and writes it
+	to dataloc/dataset.plan.txt. The counts come from the dataset metadata.
+	Returns (plan file, tiles, group size)
+	'''
+	from epistasis_meta import read_meta
+	meta = read_meta(dataloc, dataset)
+	n_snps, n_indivs = meta['n_snps'], meta['n_indivs']
+	if group_size is None:
+		group_size = choose_group_size(n_snps, n_indivs, target_seconds, engine, screen)
+
+	tiles = make_plan(n_snps, group_size)
+	verify_plan(tiles, n_snps)
+
+	plan_file = os.path.join(dataloc, dataset + PLAN_FILE)
+	write_plan(plan_file, tiles, n_snps, group_size)
+	return plan_file, tiles, group_size
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='writes (or verifies) the tile plan for a dataset')
+	parser.add_argument('dataset', help='dataset prefix', action='store')
+	parser.add_argument('-d', '--datadir', dest='datadir', help='folder with the *.FILTERED files',
+						default='.', action='store')
+	parser.add_argument('-t', '--target-minutes', dest='target_minutes', help='target duration of a single job',
+						default=60, type=float, action='store')
+	parser.add_argument('-g', '--group-size', dest='group_size', help='use this group size instead of estimating one',
+						default=None, type=int, action='store')
+	parser.add_argument('--engine', dest='engine', help='engine used by the jobs (changes the cost model)',
+						default='fastlmm', choices=sorted(pair_cost), action='store')
+	parser.add_argument('--screen', dest='screen', help='jobs screen pairs at this P before the full test (changes the cost model)',
+						default=None, type=float, action='store')
+	parser.add_argument('--verify', dest='verify', help='only verify an existing plan file',
+						default=False, action='store_true')
+
+	args = parser.parse_args()
+
+	if args.verify:
+		tiles, info = read_plan(os.path.join(args.datadir, args.dataset + PLAN_FILE))
+		verify_plan(tiles, info['n_snps'])
+		print('plan is complete: %s tiles' % len(tiles))
+		sys.exit(0)
+
+	plan_file, tiles, group_size = plan_dataset(args.datadir, args.dataset, args.target_minutes * 60, args.engine, args.group_size, args.screen)
+	pairs = [sum(block_pairs(block) for block in tile) for tile in tiles]
+	print('wrote %s: group size %s, %s tiles, %s-%s pairs per tile' % (plan_file, group_size, len(tiles), min(pairs), max(pairs)))
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+Memory and disk a job needs, from the dataset dimensions and the tile plan
+
+The node's memory is dominated by
+	the interpreter with numpy, scipy, pandas and fastlmm
+	the G0 eigenvectors U (N x rank): once where the numpy engine, the
+	    phenotypes' null models or the windows need them, about twice for
+	    fastlmm, which loads its cache file on every call
+	the product columns the numpy engine rotates at once (at most
+	    epistasis_engine.max_product_columns of them): the raw products,
+	    their projection, the whitened and the residualized copy, each
+	    N (or rank + N if K0 is low rank) rows long
+	the results of a tile (per-pair arrays and the result dataframes,
+	    which are concatenated and sorted before they are written)
+	for --excludeByPosition, K0, one window and the eigendecomposition
+	    of every distinct set of excluded windows in the job, of which
+	    the node keeps epistasis_windows.MAX_MODELS at a time
+	for --permutations, the permuted phenotypes (and their whitened
+	    copies) and a batch of epistasis_engine.max_permutation_values
+	    statistics
+With --dtype float32, the U and product columns of the numpy engine take
+half the bytes; fastlmm's copies of U and the per-pair terms don't change.
+Each term was fitted to the peak RSS of epistasis_benchmark.py runs (numpy
+engine, 1000 and 2000 individuals, group sizes 100 and 400), which the sum
+matches or exceeds by up to about 20%; the request adds a safety margin.
+
+The counts come from the dataset metadata (epistasis_meta). Disk is the
+unpacked software, the input files the job gets (G0, the windows index,
+.bim/.fam, plan, metadata, staged pheno/covar files, its shards and the K0
+windows its tiles exclude, measured on the server), the window cache files of
+--excludeByPosition (one per model kept) and the results of all tiles of
+the job.
+"""
+import sys
+import os
+
+from epistasis_planner import PLAN_FILE, read_plan, parse_tiles, format_tiles, block_pairs
+from epistasis_meta import META_FILE, read_meta
+from epistasis_engine import max_product_columns, max_permutation_values
+from epistasis_shards import tile_groups, shard_files
+from epistasis_kinship import FULL_DATASET, FILTERED_DATASET, KINSHIP_FILE
+from epistasis_windows import WINDOWS_FILE
+
+MB = 1024.0 * 1024
+# bytes of a value of the numpy engine's rotations
+VALUE_BYTES = {'float64': 8, 'float32': 4}
+
+# interpreter and imports, measured at about 175 MB
+BASE_MB = 200
+# copies of U held by an engine
+U_COPIES = {'fastlmm': 2, 'numpy': 1}
+# live copies of a chunk of rotated product columns
+ROTATION_COPIES = 4
+# results of one pair for one phenotype while a tile is tested and written
+PAIR_BYTES = 1500
+# K0, a window and the eigh workspace of --excludeByPosition, in N x N
+EXCLUDE_COPIES = 3
+# permuted phenotypes and their projected, whitened and residualized copies
+PERMUTATION_COPIES = 4
+# arrays of a batch of permutations x product columns (right-hand sides and their
+# projections for both models, sums, statistic), about 100 MB over the base in a
+# benchmark-sized tile with 2000 permutations
+PERMUTATION_BATCH_COPIES = 16
+
+# unpacked python environment and scripts of epistasis.tar.gz
+SOFTWARE_DISK_MB = 2000
+# a line of a .gwas file; a binary record is epistasis_results.RESULT_DTYPE
+TEXT_BYTES_PER_PAIR = 80
+BINARY_BYTES_PER_PAIR = 12
+
+MARGIN = 1.25
+# requests are rounded up to this many MB
+ROUND_MB = 256
+
+
+def round_up(mb):
+	return int(-(-mb // ROUND_MB) * ROUND_MB)
+
+
+def tile_shape(tile):
+	'''
+	Pairs of a tile and its largest block (rows, columns)
+	'''
+	pairs = sum(block_pairs(block) for block in tile)
+	rows, columns = max(((end0 - start0, end1 - start1) for start0, end0, start1, end1 in tile), key=lambda shape: shape[0] * shape[1])
+	return pairs, (rows, columns)
+
+
+def estimate_memory(n_indivs, n_full_snps, tile_pairs, block, engine='fastlmm', screen=None, n_phenotypes=1, exclude_models=0, permutations=0, dtype='float64'):
+	'''
+	Peak memory in MB of one tile, term by term, as a list of (term, MB).
+	block is the (rows, columns) of the tile's largest block and
+	exclude_models the number of leave-region-out models its job holds.
+	With permutations, the numpy engine tests them and no pair results are
+	kept. dtype is the precision of the numpy engine's rotations
+	'''
+	if permutations:
+		engine, screen = 'numpy', None
+	rank = min(n_indivs, n_full_snps)
+	value_bytes = VALUE_BYTES[dtype]
+	u_mb = float(n_indivs) * rank / MB
+	# the node loads the decomposition itself (in dtype) for anything but plain fastlmm
+	if engine == 'numpy':
+		u_mb *= U_COPIES['numpy'] * value_bytes
+	elif screen is not None or n_phenotypes > 1 or exclude_models:
+		u_mb *= U_COPIES['fastlmm'] * VALUE_BYTES['float64'] + U_COPIES['numpy'] * value_bytes
+	else:
+		u_mb *= U_COPIES['fastlmm'] * VALUE_BYTES['float64']
+	terms = [('interpreter and imports', BASE_MB), ('G0 eigenvectors', u_mb)]
+
+	if engine == 'numpy' or screen is not None:
+		rows, columns = block
+		chunk = min(rows, max(1, max_product_columns // max(columns, 1))) * columns
+		whitened = [n_indivs, rank + n_indivs][rank < n_indivs]
+		terms.append(('product columns', float(value_bytes) * chunk * (n_indivs + ROTATION_COPIES * whitened) / MB))
+
+	if permutations:
+		rows, columns = block
+		batch_values = min(max_permutation_values, permutations * min(rows, max(1, max_product_columns // max(columns, 1))) * columns)
+		terms.append(('permutations', 8.0 * (PERMUTATION_COPIES * n_indivs * permutations * n_phenotypes + PERMUTATION_BATCH_COPIES * batch_values) / MB))
+	else:
+		terms.append(('results', float(PAIR_BYTES) * tile_pairs * n_phenotypes / MB))
+	if exclude_models:
+		terms.append(('leave-region-out models', 8.0 * n_indivs * n_indivs * (EXCLUDE_COPIES + exclude_models) / MB))
+	return terms
+
+
+def estimate_disk(input_mb, job_pairs, n_indivs, n_phenotypes=1, output_format='text', threshold=1.0, exclude_models=0, permutations=0, n_tiles=1):
+	'''
+	Disk in MB of one job, term by term, as a list of (term, MB). With a
+	threshold, the share of pairs written is the threshold (all pairs are
+	null but a few); with permutations, a job only writes the minima
+	'''
+	pair_bytes = [TEXT_BYTES_PER_PAIR, BINARY_BYTES_PER_PAIR][output_format == 'binary']
+	results_mb = float(pair_bytes) * job_pairs * n_phenotypes * min(threshold, 1.0) / MB
+	if permutations:
+		results_mb = 8.0 * permutations * n_phenotypes * n_tiles / MB
+	terms = [('software', SOFTWARE_DISK_MB),
+			 ('inputs', input_mb),
+			 ('results', results_mb)]
+	if exclude_models:
+		terms.append(('window cache files', 8.0 * n_indivs * n_indivs * exclude_models / MB))
+	return terms
+
+
+def file_mb(filenames):
+	return sum(os.path.getsize(filename) for filename in filenames if filename and os.path.exists(filename)) / MB
+
+
+def count_phenotypes(dataloc, dataset):
+	f = open(os.path.join(dataloc, '%s.pheno.txt' % dataset))
+	headers = f.readline().strip().split('\t')[2:]
+	f.close()
+	return len(headers)
+
+
+def estimate_resources(dataloc, dataset, plan_file=None, jobs=None, tiles_per_job=1, engine='fastlmm', screen=None, all_phenotypes=False, exclude=False,
+					   output_format='text', threshold=1.0, permutations=0, dtype='float64', covar_file=None, margin=MARGIN):
+	'''
+	Memory and disk (MB, rounded up) to request for every job of the plan,
+	sized for the largest job. jobs are tile specs (all tiles, tiles_per_job
+	at a time, by default), covar_file the covariate file shipped with them. Returns a dict with memory_mb, disk_mb and the
+	terms of both estimates for the largest job
+	'''
+	if plan_file is None:
+		plan_file = os.path.join(dataloc, dataset + PLAN_FILE)
+	tiles, info = read_plan(plan_file)
+	if jobs is None:
+		jobs = [format_tiles(range(i, min(i + tiles_per_job, len(tiles)))) for i in range(0, len(tiles), tiles_per_job)]
+
+	prefix = os.path.join(dataloc, dataset)
+	meta = read_meta(dataloc, dataset)
+	n_indivs, n_full_snps = meta['n_indivs'], meta['n_full_snps']
+	n_phenotypes = [1, count_phenotypes(dataloc, dataset)][all_phenotypes]
+	shared_files = [prefix + FILTERED_DATASET + '.bim', prefix + FILTERED_DATASET + '.fam', prefix + FULL_DATASET + '.bim', prefix + FULL_DATASET + '.fam',
+					prefix + KINSHIP_FILE, [None, prefix + WINDOWS_FILE][exclude], plan_file, prefix + META_FILE, prefix + '.pheno.txt', covar_file]
+	shared_mb = file_mb(shared_files)
+	if exclude:
+		from epistasis_pairs import load_positions
+		from epistasis_windows import read_windows, window_sets, window_file, MAX_MODELS
+		chrom, bp = load_positions(prefix + FILTERED_DATASET)
+		windows = read_windows(prefix + WINDOWS_FILE)
+
+	memory, disk = None, None
+	for job in jobs:
+		tile_ids = [tile_id for tile_id in parse_tiles(job) if tile_id < len(tiles)]
+		if not tile_ids:
+			continue
+		job_tiles = [tiles[tile_id] for tile_id in tile_ids]
+		groups = tile_groups(job_tiles, info['group_size'])
+		shards_mb = file_mb(shard_files(prefix + FILTERED_DATASET, groups))
+		# the window sets of all the job's blocks, as the node's model cache sees them
+		exclude_models = 0
+		if exclude:
+			sets = window_sets(windows, job_tiles, chrom, bp)
+			exclude_models = min(len(sets), MAX_MODELS)
+			shards_mb += file_mb([window_file(prefix, w) for w in sorted(set(w for excluded in sets for w in excluded))])
+		shapes = [tile_shape(tile) for tile in job_tiles]
+		for pairs, block in shapes:
+			terms = estimate_memory(n_indivs, n_full_snps, pairs, block, engine, screen, n_phenotypes, exclude_models, permutations, dtype)
+			if memory is None or sum(mb for term, mb in terms) > sum(mb for term, mb in memory):
+				memory = terms
+		terms = estimate_disk(shared_mb + shards_mb, sum(pairs for pairs, block in shapes), n_indivs, n_phenotypes, output_format, threshold,
+							  exclude_models, permutations, len(tile_ids))
+		if disk is None or sum(mb for term, mb in terms) > sum(mb for term, mb in disk):
+			disk = terms
+
+	if memory is None:
+		raise Exception('no tiles to estimate resources for in %s' % plan_file)
+	return {'memory_mb': round_up(margin * sum(mb for term, mb in memory)),
+			'disk_mb': round_up(margin * sum(mb for term, mb in disk)),
+			'memory': memory,
+			'disk': disk,
+			'n_indivs': n_indivs,
+			'n_full_snps': n_full_snps,
+			'n_phenotypes': n_phenotypes}
+
+
+def resources_report(resources):
+	'''
+	Lines of a report of an estimate_resources() result
+	'''
+	lines = ['%s individuals, %s G0 SNPs, %s phenotypes' % (resources['n_indivs'], resources['n_full_snps'], resources['n_phenotypes'])]
+	for name in ['memory', 'disk']:
+		lines.append('%s: request %s MB' % (name, resources['%s_mb' % name]))
+		for term, mb in resources[name]:
+			lines.append('  %-26s %10.0f MB' % (term, mb))
+	return lines
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='estimates the memory and disk a job of the tile plan needs')
+	parser.add_argument('dataset', help='dataset prefix (expects .FULL/.FILTERED files and the plan in the data folder)', action='store')
+	parser.add_argument('-d', '--datadir', dest='datadir', help='folder with the dataset, its plan, G0 and shards',
+						default='.', action='store')
+	parser.add_argument('--tiles-per-job', dest='tiles_per_job', help='tiles run by each job',
+						default=1, type=int, action='store')
+	parser.add_argument('--engine', dest='engine', help='engine used by the jobs',
+						default='fastlmm', choices=sorted(U_COPIES), action='store')
+	parser.add_argument('--screen', dest='screen', help='screening P of the jobs',
+						default=None, type=float, action='store')
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='jobs test every phenotype',
+						default=False, action='store_true')
+	parser.add_argument('-e', '--excludeByPosition', dest='exclude', help='jobs use leave-region-out kinship',
+						default=False, action='store_true')
+	parser.add_argument('--output-format', dest='output_format', help='format of the results',
+						default='text', choices=['text', 'binary'], action='store')
+	parser.add_argument('-p', '--threshold', dest='threshold', help='jobs only write pairs with P at or below this',
+						default=1.0, type=float, action='store')
+	parser.add_argument('--permutations', dest='permutations', help='permuted phenotypes tested by the jobs',
+						default=0, type=int, action='store')
+	parser.add_argument('--dtype', dest='dtype', help='precision of the numpy engine in the jobs',
+						default='float64', choices=sorted(VALUE_BYTES), action='store')
+	parser.add_argument('-c', '--covariate_file', dest='covFile', help='covariate file shipped with the jobs (relative to datadir)',
+						default=None, action='store')
+	parser.add_argument('--margin', dest='margin', help='safety factor applied to the estimates',
+						default=MARGIN, type=float, action='store')
+
+	args = parser.parse_args()
+
+	resources = estimate_resources(args.datadir, args.dataset, tiles_per_job=args.tiles_per_job, engine=args.engine, screen=args.screen,
+								   all_phenotypes=args.all_phenotypes, exclude=args.exclude, output_format=args.output_format,
+								   threshold=args.threshold, permutations=args.permutations, dtype=args.dtype, covar_file=args.covFile and os.path.join(args.datadir, args.covFile), margin=args.margin)
+	for line in resources_report(resources):
+		print(line)
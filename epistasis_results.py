@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+Compact binary per-tile result format and its reader
+
+A binary result (<dataset>_<tile>.epi.npy) is a .npy file holding one record
+per SNP pair: the int32 indices of both SNPs in <dataset>.FILTERED.bim order
+and -log10(P) as float32 (float32 P itself would underflow to 0 for the
+strongest hits). Records are sorted by P like the text .gwas output. The
+files can be memory-mapped, and expand() turns records back into the
+SNP1/CHR1/BP1/SNP2/CHR2/BP2/P columns of the text output.
+"""
+import sys
+import numpy as np
+import pandas as pd
+
+GWAS_COLUMNS = ['SNP1', 'CHR1', 'BP1', 'SNP2', 'CHR2', 'BP2', 'P']
+GWAS_HEADER = '\t'.join(GWAS_COLUMNS)
+
+BINARY_SUFFIX = '.epi.npy'
+RESULT_DTYPE = np.dtype([('snp0', '<i4'), ('snp1', '<i4'), ('neglog10p', '<f4')])
+
+
+def write_results(filename, snp0, snp1, pvalues):
+	records = np.empty(len(pvalues), dtype=RESULT_DTYPE)
+	records['snp0'] = snp0
+	records['snp1'] = snp1
+	with np.errstate(divide='ignore'):
+		records['neglog10p'] = -np.log10(np.asarray(pvalues, dtype=np.float64))
+	np.save(filename, records)
+
+
+def read_results(filename, mmap=True):
+	records = np.load(filename, mmap_mode=['r', None][not mmap])
+	if records.dtype != RESULT_DTYPE or records.ndim != 1:
+		raise ValueError('%s is not an epistasis result file' % filename)
+	return records
+
+
+def pvalues(records):
+	return np.power(10.0, -records['neglog10p'].astype(np.float64))
+
+
+def load_bim(filename):
+	'''
+	SNP ids, chromosomes and positions of a .bim file, in file order
+	'''
+	bim = pd.read_csv(filename, sep=r'\s+', header=None, usecols=[0, 1, 3], names=['chr', 'sid', 'bp'],
+					  dtype={'chr': str, 'sid': str, 'bp': np.float64})
+	chrom = pd.to_numeric(bim['chr'], errors='coerce').values.astype(np.float64)
+	return {'sid': bim['sid'].values, 'chr': chrom, 'bp': bim['bp'].values}
+
+
+def expand(records, bim):
+	'''
+	Dataframe with the text output's columns for records (or a slice of them)
+	'''
+	i0 = np.asarray(records['snp0'])
+	i1 = np.asarray(records['snp1'])
+	frame = pd.DataFrame({'SNP1': bim['sid'][i0], 'CHR1': bim['chr'][i0], 'BP1': bim['bp'][i0],
+						  'SNP2': bim['sid'][i1], 'CHR2': bim['chr'][i1], 'BP2': bim['bp'][i1],
+						  'P': pvalues(records)})
+	return frame[GWAS_COLUMNS]
+
+
+def format_rows(records, bim):
+	'''
+	Lines formatted exactly like the text .gwas rows
+	'''
+	p = pvalues(records)
+	lines = []
+	for k, (i0, i1) in enumerate(zip(records['snp0'], records['snp1'])):
+		lines.append('%s\t%r\t%r\t%s\t%r\t%r\t%r\n' % (bim['sid'][i0], float(bim['chr'][i0]), float(bim['bp'][i0]),
+														 bim['sid'][i1], float(bim['chr'][i1]), float(bim['bp'][i1]), float(p[k])))
+	return lines
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='converts a binary per-tile result to the text .gwas layout')
+	parser.add_argument('results', help='<dataset>_<tile>%s file' % BINARY_SUFFIX, action='store')
+	parser.add_argument('bim', help='<dataset>.FILTERED.bim the SNP indices refer to', action='store')
+	parser.add_argument('-o', '--output', dest='output', help='output file (default: stdout)',
+						default=None, action='store')
+
+	args = parser.parse_args()
+
+	frame = expand(read_results(args.results), load_bim(args.bim))
+	frame.to_csv(args.output or sys.stdout, sep='\t', index=False)
@@ -11,6 +11,7 @@ import re
 import subprocess
 from math import log10, ceil
 import textwrap
+import shlex
 import operator
 from datetime import datetime
 import time
@@ -33,6 +34,9 @@ epistasis_script = os.path.join(prog_path, 'epistasis_node.py')
 # filename formats
 FULL_DATASET = '.FULL'
 FILTERED_DATASET = '.FILTERED'
+KINSHIP_FILE = '.G0.npz'
+WINDOWS_FILE = '.windows.npz'
+META_FILE = '.meta.json'
 
 class Tee(object):
 	def __init__(self, filename):
@@ -48,7 +52,7 @@ class Tee(object):
 def timestamp():
 	return datetime.strftime(datetime.now(), '%Y-%m-%d_%H-%I-%S')
 
-def process(params, covar=False, memory=1024, tasks=None, species='mouse', maxthreads=1, featsel=False, exclude=False, condition=None):
+def process(params, covar=False, memory=None, tasks=None, species='mouse', maxthreads=1, featsel=False, exclude=False, condition=None, engine='fastlmm', tiles_per_job=1, output_format='text', threshold=1.0, screen=None, all_phenotypes=False, exclude_distance=None, exclude_r2=None, skip=(), retries=3, submit=True, permutations=0, seed=0, dtype='float64'):
 
 	os.chdir(root)
 
@@ -60,55 +64,66 @@ def process(params, covar=False, memory=1024, tasks=None, species='mouse', maxth
 	log = %(condor_output)s/epistasis_$(Cluster).log
 	error = %(condor_output)s/epistasis_$(Cluster)_$(Process).err
 
-	InitialDir = %(root)s/results/%(dataset)s
+	InitialDir = %(job_output)s
 	executable = %(root)s/epistasis_%(dataset)s.sh
-	arguments = $(Process)
+	arguments = $(tiles)
+	# the monitor reads the tiles from the submit event, also when DAGMan submits
+	submit_event_notes = tiles $(tiles)
 	output = %(condor_output)s/epistasis_$(Cluster)_$(Process).out
 
 	should_transfer_files = YES
 	when_to_transfer_output = ON_EXIT
-	transfer_input_files = http://proxy.chtc.wisc.edu/SQUID/cgottsacker/epistasis.tar.gz, %(root)s/epistasis_node.py
+	transfer_input_files = http://proxy.chtc.wisc.edu/SQUID/cgottsacker/epistasis.tar.gz, %(root)s/epistasis_node.py, %(root)s/epistasis_kinship.py, %(root)s/epistasis_engine.py, %(root)s/epistasis_planner.py, %(root)s/epistasis_results.py, %(root)s/epistasis_summary.py, %(root)s/epistasis_shards.py, %(root)s/epistasis_tped.py, %(root)s/epistasis_pairs.py, %(root)s/epistasis_windows.py, %(root)s/epistasis_timing.py, %(root)s/epistasis_meta.py, %(root)s/epistasis_permutations.py, %(filtered)s.bim, %(filtered)s.fam, %(full)s.bim, %(full)s.fam, %(kinship_file)s,%(windows_file)s, %(plan_file)s, %(meta_file)s, %(pheno_file)s,%(covar_file)s, $(shards)
 
 	request_cpus = 1
 	request_memory = %(use_memory)sMB
-	request_disk = 4GB
+	request_disk = %(use_disk)sMB
+
+	# failed jobs (nonzero exit) are rerun by HTCondor
+	max_retries = %(retries)s
 
 	# requirements = (Target.PoolName =!= "CHTC")
 	# +wantGlidein = true
 	# +wantFlocking = true
 
-	queue %(num_jobs)s
+	queue tiles, shards from %(job_list_file)s
 	''').replace('\t*', '')
 
 
 	exec_template = textwrap.dedent(
 	'''#!/bin/bash
 
-	# untar your files sent along by SQUID
-	tar -xzvf epistasis.tar.gz
+	# start and end of untarring, for the node's timing record
+	export EPISTASIS_JOB_START=$(date +%%s.%%N)
+
+	# untar your files sent along by SQUID, but keep the staged pheno/covar files and the genotype
+	# shards sent with the job: a full dataset bed left in the tarball would fill the job's disk
+	tar -xzvf epistasis.tar.gz --exclude='*.pheno.txt' --exclude='*.covar.txt' --exclude='*.bed' --exclude='*.bim' --exclude='*.fam'
 
 	# untar your Python installation
 	tar -xzvf python.tar.gz
 
+	export EPISTASIS_UNTAR_END=$(date +%%s.%%N)
+
 	# make sure the script will use your Python installation
 	export PATH=$(pwd)/python/bin:$PATH
 
 	# run your script
-	python epistasis_node.py %(dataset)s %(num_snps_per_group)s $1 %(covFile)s %(debug)s %(species)s %(maxthreads)s %(feature_selection)s %(exclude)s %(condition)s >& epistasis_node.py.output.$1
+	python epistasis_node.py %(dataset)s $1 %(covFile)s %(debug)s %(species)s %(maxthreads)s %(feature_selection)s %(exclude)s %(condition)s %(engine)s %(output_format)s %(threshold)s %(screen)s %(all_phenotypes)s %(exclude_distance)s %(exclude_r2)s %(permutations)s %(dtype)s >& epistasis_node.py.output.$1
+
+	status=$?
 
-	# if script failed, make empty file named with job's process number
-	if [ ! $? == 0 ]; then
-		> $1
+	# if script failed, make empty marker file named with the job's tiles
+	if [ ! $status == 0 ]; then
+		> %(dataset)s_$1.failed
 	fi
 
-	rm -r -f *.bed *.bim *.fam *.py *.pyc *.tar.gz *.txt python		# TODO restore
+	rm -r -f *.bed *.bim *.fam *.py *.pyc *.tar.gz *.pheno.txt *.covar.txt *.plan.txt *.npz *.npy python		# TODO restore
 	# rm -r -f *.bed *.bim *.fam *.py *.pyc *.tar.gz *.txt _condor_stderr _condor_stdout python tmp *.py.output.
-	''').replace('\t*', '')
 
+	exit $status
+	''').replace('\t*', '')
 
-	# set memory and max threads
-	if memory is None:
-		local_memory = 8000
 
 	# generate output files
 	condor_output = os.path.join(condor_output_root, dataset)
@@ -140,11 +155,58 @@ def process(params, covar=False, memory=1024, tasks=None, species='mouse', maxth
 				   'species': '-s %s' % species,
 				   'maxthreads':'--maxthreads %s' % maxthreads,
 				   'feature_selection':['', '--feature-selection'][featsel],
-				   'exclude':['', '--exclude'][exclude],
+				   'exclude':['', '--excludeByPosition'][exclude],
 				   'condition': ['', '--condition %s' % condition][condition is not None],
-				   'use_memory': local_memory,
-				   'num_snps_per_group': num_snps_per_group,
-				   'num_jobs': num_jobs(num_snps_per_group)})
+				   'engine': '--engine %s' % engine,
+				   'output_format': '--output-format %s' % output_format,
+				   'threshold': '--threshold %r' % threshold,
+				   'screen': ['', '--screen %r' % screen][screen is not None],
+				   'all_phenotypes': ['', '--all-phenotypes'][all_phenotypes],
+				   'exclude_distance': ['', '--exclude-distance %r' % exclude_distance][exclude_distance is not None],
+				   'exclude_r2': ['', '--exclude-r2 %r' % exclude_r2][exclude_r2 is not None],
+				   'permutations': ['', '--permutations %s --seed %s' % (permutations, seed)][permutations > 0],
+				   'dtype': ['', '--dtype %s' % dtype][dtype != 'float64'],
+				   'retries': retries,
+				   'kinship_file': os.path.join(dataLoc, dataset + KINSHIP_FILE),
+				   'windows_file': ['', os.path.join(dataLoc, dataset + WINDOWS_FILE)][exclude],
+				   'meta_file': os.path.join(dataLoc, dataset + META_FILE),
+				   'pheno_file': os.path.join(dataLoc, '%s.pheno.txt' % dataset),
+				   'covar_file': ['', os.path.join(dataLoc, '%s' % params['covar'])][bool(covar and params['covar'])],
+				   'filtered': os.path.join(dataLoc, dataset + FILTERED_DATASET),
+				   'full': os.path.join(dataLoc, dataset + FULL_DATASET),
+				   'job_list_file': os.path.join(root, 'epistasis_%s.jobs.txt' % dataset)})
+
+	# one line per job with the tiles it runs and the genotype shards (and
+	# K0 windows) they need
+	from epistasis_planner import read_plan, parse_tiles
+	from epistasis_shards import tile_groups, shard_files
+	tiles, plan_info = read_plan(params['plan_file'])
+	if exclude:
+		from epistasis_pairs import load_positions
+		from epistasis_windows import tile_windows, window_file
+		chrom, bp = load_positions(params['filtered'])
+	jobs = job_list(params['plan_file'], tiles_per_job, tasks, skip)
+	if not jobs:
+		log.send_output('No tiles left to run')
+		return
+	job_list_file = open(params['job_list_file'], 'w')
+	for job in jobs:
+		job_tiles = [tiles[tile_id] for tile_id in parse_tiles(job) if tile_id < len(tiles)]
+		files = shard_files(params['filtered'], tile_groups(job_tiles, plan_info['group_size']))
+		if exclude:
+			files += [window_file(os.path.join(dataLoc, dataset), w) for w in tile_windows(params['windows_file'], job_tiles, chrom, bp)]
+		job_list_file.write('%s %s\n' % (job, ','.join(files)))
+	job_list_file.close()
+	log.send_output('Submitting %s jobs for %s tiles' % (len(jobs), [len(tasks or []), 'all'][tasks is None]))
+
+	# memory and disk for the largest job, unless --memory was given
+	from epistasis_resources import estimate_resources
+	resources = estimate_resources(dataLoc, dataset, params['plan_file'], jobs, engine=engine, screen=screen, all_phenotypes=all_phenotypes,
+								   exclude=exclude, output_format=output_format, threshold=threshold, permutations=permutations, dtype=dtype,
+								   covar_file=params['covar_file'] or None)
+	params['use_memory'] = [memory, resources['memory_mb']][memory is None]
+	params['use_disk'] = resources['disk_mb']
+	log.send_output('Requesting %(use_memory)s MB of memory and %(use_disk)s MB of disk per job' % params)
 
 	maxthreads_option = ['', '-pe shared %s' % maxthreads][maxthreads > 1]
 
@@ -158,27 +220,157 @@ def process(params, covar=False, memory=1024, tasks=None, species='mouse', maxth
 
 	subprocess.call('chmod +x epistasis_%(dataset)s.sh' % params, shell = True)
 
+	# the prep node of a DAG only writes the files, DAGMan submits them
+	if not submit:
+		log.send_output('Wrote epistasis_%(dataset)s.sub, not submitted' % params)
+		return
+
 	# submit jobs to condor
-	condor_cluster = subprocess.Popen(['condor_submit', 'epistasis_%(dataset)s.sub' % params], stdout=subprocess.PIPE).communicate()[0]
+	condor_cluster = subprocess.Popen(['condor_submit', 'epistasis_%(dataset)s.sub' % params], stdout=subprocess.PIPE).communicate()[0].decode()
 	condor_cluster = re.search('\d{4,}', condor_cluster).group()
 	print("Submitting Jobs to Cluster %s" % condor_cluster)
 	log.send_output("%s was sent to cluster %s at %s" % (params['dataset'], condor_cluster, timestamp()))
 
+	# the monitor maps the cluster's process numbers back to tiles with this copy
+	import shutil
+	shutil.copyfile(params['job_list_file'], os.path.join(condor_output, 'epistasis_%s.jobs.txt' % condor_cluster))
+
+
+def prepare_beds(dataloc, dataset, species='mouse'):
+	'''
+	Converts dataloc/dataset.tped/.tfam to the *.FULL and *.FILTERED beds
+	(MAF >= 0.05, missing rate <= 0.1) if they are missing or older than
+	the tped. Both sets hold the same SNPs: FULL builds K0, FILTERED is tested.
+	Also makes sure the tped has an up to date offset index
+	'''
+	import shutil
+	from epistasis_tped import convert, tped_index
+
+	tped = os.path.join(dataloc, dataset + '.tped')
+	full = os.path.join(dataloc, dataset + FULL_DATASET)
+	filtered = os.path.join(dataloc, dataset + FILTERED_DATASET)
+	if not os.path.exists(tped):
+		return
+	log.send_output('%s has %s SNPs' % (tped, len(tped_index(tped)['snp'])))
+	if os.path.exists(filtered + '.bed') and os.path.getmtime(filtered + '.bed') >= os.path.getmtime(tped):
+		return
+
+	log.send_output('Converting %s to %s and %s' % (tped, full, filtered))
+	n_read, n_written = convert(tped, os.path.join(dataloc, dataset + '.tfam'), full, species=species)
+	for suffix in ['.bed', '.bim', '.fam']:
+		shutil.copyfile(full + suffix, filtered + suffix)
+	log.send_output('%s of %s SNPs passed the filters' % (n_written, n_read))
+
+
+def prepare_shards(dataloc, dataset, plan_file):
+	'''
+	Splits *.FILTERED into one bed per SNP group of the plan, so that each
+	job only receives the groups of its tiles. Shards that are up to date
+	with the bed and the plan's group size are reused
+	'''
+	from epistasis_planner import read_plan
+	from epistasis_shards import shards_current, write_shards
+
+	tiles, info = read_plan(plan_file)
+	filtered = os.path.join(dataloc, dataset + FILTERED_DATASET)
+	if shards_current(filtered, info['n_snps'], info['group_size']):
+		log.send_output('Reusing the per-group shards of %s' % filtered)
+		return
+	n_shards = write_shards(filtered, info['group_size'])
+	log.send_output('Split %s into %s shards of %s SNPs' % (filtered, n_shards, info['group_size']))
+
+
+def prepare_kinship(dataloc, dataset, covar=None, all_phenotypes=False):
+	'''
+	Builds K0 from *.FULL, its eigendecomposition and the null model once per
+	dataset and writes them to dataloc/dataset.G0.npz, which is shipped to
+	every job instead of having each job rebuild the kinship matrix.
+	The file is reused as long as it was fitted on the same *.FULL files,
+	pheno and covar files and options (epistasis_kinship.model_inputs)
+	'''
+	from epistasis_kinship import precompute_kinship, model_inputs, inputs_current
+
+	kinship_file = os.path.join(dataloc, dataset + KINSHIP_FILE)
+	if covar:
+		covar = os.path.join(dataloc, covar)
+	if inputs_current(kinship_file, model_inputs(os.path.join(dataloc, dataset), covar, all_phenotypes)):
+		log.send_output('Reusing G0 decomposition in %s' % kinship_file)
+		return kinship_file
+
+	log.send_output('Precomputing G0 decomposition for %s' % dataset)
+	precompute_kinship(os.path.join(dataloc, dataset), covar, kinship_file, all_phenotypes=all_phenotypes)
+	return kinship_file
+
+
+def prepare_windows(dataloc, dataset, covar=None, window=None, all_phenotypes=False):
+	'''
+	Writes the K0 contribution of every chromosome (or window of window bp)
+	to dataloc/dataset.window<w>.npy and their index to
+	dataloc/dataset.windows.npz for --excludeByPosition, unless they were
+	written for the same *.FULL files, individuals and windows
+	(epistasis_windows.windows_inputs)
+	'''
+	from epistasis_windows import precompute_windows, windows_inputs, windows_current
 
-def num_jobs(num_snps_per_group):
-	# num_snps = 1600		# TODO remove
+	windows_file = os.path.join(dataloc, dataset + WINDOWS_FILE)
+	if covar:
+		covar = os.path.join(dataloc, covar)
+	if windows_current(windows_file, windows_inputs(os.path.join(dataloc, dataset), covar, window, all_phenotypes)):
+		log.send_output('Reusing K0 windows in %s' % windows_file)
+		return windows_file
 
-	num_snps = 0
-	with open(os.path.join(dataloc, dataset+FILTERED_DATASET+'.bim')) as file:
-		for line in file.readlines():
-			line = line.split()
-			if len(line) > 1 and 'rs' in line[1]:
-				num_snps += 1
+	log.send_output('Precomputing K0 contributions per %s for %s' % (['chromosome', '%s bp window' % window][bool(window)], dataset))
+	precompute_windows(os.path.join(dataloc, dataset), covar, windows_file, window, all_phenotypes)
+	return windows_file
 
-	num_groups = ceil(num_snps/num_snps_per_group)
-	num_comparisons = num_groups * (num_groups + 1) / 2
 
-	return int(num_comparisons)
+def job_list(plan_file, tiles_per_job=1, tasks=None, skip=()):
+	'''
+	Tile specs (e.g. "0-9") of the jobs needed to run the plan written by
+	epistasis_planner with tiles_per_job tiles each; tasks restricts the
+	jobs to those tile ids, tiles in skip (e.g. excluded ones) are left out
+	'''
+	from epistasis_planner import read_plan, format_tiles
+
+	tiles, info = read_plan(plan_file)
+	if tasks is None:
+		tasks = range(len(tiles))
+	tasks = sorted(set(tasks).difference(skip))
+	return [format_tiles(tasks[i:i + tiles_per_job]) for i in range(0, len(tasks), tiles_per_job)]
+
+
+def result_names(dataloc, dataset, job_output, all_phenotypes=False):
+	'''
+	Names of the result sets: the dataset, or for all_phenotypes
+	<dataset>.<phenotype index> after the pheno.key.txt written to job_output
+	'''
+	if not os.path.exists(job_output):
+		os.makedirs(job_output)
+	if not all_phenotypes:
+		return [dataset]
+	from epistasis_kinship import PHENO_KEY_FILE, pheno_keys, write_pheno_key
+	f = open(os.path.join(dataloc, '%s.pheno.txt' % dataset))
+	headers = f.readline().strip().split('\t')[2:]
+	f.close()
+	write_pheno_key(os.path.join(job_output, PHENO_KEY_FILE), headers)
+	return ['%s.%s' % (dataset, key) for key in pheno_keys(headers)]
+
+
+def server_arguments(argv):
+	'''
+	Command line of the DAG's prep node: this run's arguments without the
+	DAG, submit and watch options, each quoted for the prep script's shell
+	'''
+	arguments = []
+	skip_value = False
+	for arg in argv:
+		if skip_value:
+			skip_value = False
+		elif arg == '--watch':
+			skip_value = True
+		elif arg not in ('--dag', '--no-submit') and not arg.startswith('--watch='):
+			arguments.append(shlex.quote(arg))
+	return arguments
 
 
 def check_prefixes(dataloc, dataset):
@@ -216,21 +408,67 @@ if __name__ == '__main__':
 						default=False, action='store_true')
 	parser.add_argument('-s', '--species', dest='species', help='mouse or human',
 						default='mouse', action='store', choices=['human', 'mouse', 'dog', 'horse', 'cow', 'sheep'])
-	parser.add_argument('-m', '--memory', dest='memory', help='amount of RAM (in megabytes) requested per job',
+	parser.add_argument('-m', '--memory', dest='memory', help='amount of RAM (in megabytes) requested per job, instead of the estimate from the dataset and tile size',
 						default=None, action='store', type=int)
 	parser.add_argument('--maxthreads', dest='maxthreads', help='maximum # of threads to use',
 						default=1, action='store', choices=range(1, 17), type=int)
 	parser.add_argument('-f', '--feature-selection', dest='featsel', help='perform feature selection',
 						default=False, action='store_true')
-	parser.add_argument('-e', '--excludeByPosition', dest='exclude', help='exclude SNPs within 2Mb of tested SNP from kinship matrix construction',
+	parser.add_argument('-e', '--excludeByPosition', dest='exclude', help='leave the chromosomes of the tested SNPs out of the kinship matrix (with --exclude-window, only the windows within 2Mb of them)',
 						default=False, action='store_true')
+	parser.add_argument('--exclude-window', dest='exclude_window', help='with -e, precompute K0 per window of this many bp instead of per chromosome',
+						default=None, action='store', type=int)
 	parser.add_argument('-n', '--numeric_phenotype_id', dest='numeric', help='convert phenotype names to numbers (for safety)',
 						nargs='?', default=0, const=1, type=int, action='store', choices=[0, 1, 2])
 	parser.add_argument('-q', '--quiet', dest='debug', help="suppress debugging output",
 						default=True, action='store_false')
-	parser.add_argument('--tasks', dest='tasks', metavar='TASK', nargs='+', help='run only specified sub-tasks (specify only one dataset when using this option)', type=int)
+	parser.add_argument('--tasks', dest='tasks', metavar='TASK', nargs='+', help='run only specified tiles (specify only one dataset when using this option)', type=int)
+	parser.add_argument('-r', '--resume', dest='resume', help='check existing results against the manifest and resubmit only missing, failed or corrupt tiles',
+						default=False, action='store_true')
+	parser.add_argument('--status', dest='status', help='update the result manifest and report tile status, does not submit',
+						default=False, action='store_true')
+	parser.add_argument('--timing', dest='timing', help='report percentiles of the job phase times and the throughput from the timing records in the output folder, does not submit',
+						default=False, action='store_true')
+	parser.add_argument('--thresholds', dest='thresholds', help='genome-wide thresholds from the permutation minima in the output folder (see --permutations), does not submit',
+						default=False, action='store_true')
+	parser.add_argument('--monitor', dest='monitor', help='report job states and progress from the HTCondor user logs in condor_out/dataset (no condor_q), does not submit; with --watch until all jobs have finished',
+						default=False, action='store_true')
+	parser.add_argument('--watch', dest='watch', metavar='SECONDS', help='after submitting, report job states from the user logs every SECONDS until all jobs have finished',
+						default=None, action='store', type=float)
+	parser.add_argument('--dag', dest='dag', help='write and submit a DAGMan workflow instead: a prep node (pheno/covar staging, beds, plan, G0, shards), the compute jobs and a merge node run once all tiles have results',
+						default=False, action='store_true')
+	parser.add_argument('--no-submit', dest='no_submit', help='write the submit files (or with --dag the DAG files) without submitting them',
+						default=False, action='store_true')
+	parser.add_argument('--retries', dest='retries', help='times HTCondor reruns a failed job',
+						default=3, action='store', type=int)
 	parser.add_argument('--condition', dest='condition', help='condition on SNP {snp_id}',
 						action='store', nargs=1)
+	parser.add_argument('-t', '--target-minutes', dest='target_minutes', help='target duration of a single job, used to size the SNP groups',
+						default=60, action='store', type=float)
+	parser.add_argument('-g', '--group-size', dest='group_size', help='number of SNPs per group (overrides --target-minutes)',
+						default=None, action='store', type=int)
+	parser.add_argument('-k', '--tiles-per-job', dest='tiles_per_job', help='run this many tiles in each job to amortize job startup',
+						default=1, action='store', type=int)
+	parser.add_argument('--engine', dest='engine', help='fastlmm (pair by pair) or numpy (vectorized block pairs)',
+						default='fastlmm', choices=['fastlmm', 'numpy'], action='store')
+	parser.add_argument('--output-format', dest='output_format', help='per-tile results as text .gwas or compact binary .epi.npy',
+						default='text', choices=['text', 'binary'], action='store')
+	parser.add_argument('-p', '--threshold', dest='threshold', help='jobs only return pairs with P at or below this; --status reports lambda from the per-tile summaries',
+						default=1.0, action='store', type=float)
+	parser.add_argument('--screen', dest='screen', help='screen all pairs with the numpy engine, run fastlmm only on pairs with a screening P at or below this',
+						default=None, action='store', type=float)
+	parser.add_argument('--exclude-distance', dest='exclude_distance', help='skip pairs on the same chromosome at most this many bp apart; tiles with no other pairs are not submitted',
+						default=None, action='store', type=float)
+	parser.add_argument('--permutations', dest='permutations', help='jobs test this many permuted phenotypes (the same in every job) and only return the smallest P of each per tile, for --thresholds',
+						default=0, type=int, action='store')
+	parser.add_argument('--seed', dest='seed', help='seed of the permutations',
+						default=0, type=int, action='store')
+	parser.add_argument('--dtype', dest='dtype', help='precision of the genotype blocks and rotations of the numpy engine, screening and permutations in the jobs; float32 halves their memory (P are computed in float64 either way)',
+						default='float64', choices=['float64', 'float32'], action='store')
+	parser.add_argument('--exclude-r2', dest='exclude_r2', help='skip pairs whose genotypes have an r^2 above this (computed in the jobs)',
+						default=None, action='store', type=float)
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='test every phenotype in one pass; results are named <dataset>.<index>_<tile> after pheno.key.txt',
+						default=False, action='store_true')
 
 	args = parser.parse_args()
 
@@ -246,27 +484,192 @@ if __name__ == '__main__':
 	maxthreads = args.maxthreads
 	featsel = args.featsel
 	exclude = args.exclude
+	exclude_window = args.exclude_window
 	debug = args.debug
 	tasks = args.tasks
 	condition = args.condition
+	engine = args.engine
+	output_format = args.output_format
+	threshold = args.threshold
+	screen = args.screen
+	all_phenotypes = args.all_phenotypes
+	exclude_distance = args.exclude_distance
+	exclude_r2 = args.exclude_r2
+	target_minutes = args.target_minutes
+	group_size = args.group_size
+	tiles_per_job = args.tiles_per_job
+	resume = args.resume
+	status = args.status
+	timing = args.timing
+	thresholds = args.thresholds
+	permutations = args.permutations
+	dtype = args.dtype
+	seed = args.seed
+	monitor = args.monitor
+	watch = args.watch
+	dag = args.dag
+	no_submit = args.no_submit
+	retries = args.retries
 
 	if debug:
 		log = Tee('epistasis_pipeline-%s.log' % timestamp())
 	else:
 		log = Tee('/dev/null')
 
-	if tasks and len(datasets) > 1:
+	if tasks and len(args.dataset) > 1:
 		log.send_output('More than one dataset specified along with --tasks option; quitting')
 		log.close()
 		sys.exit(0)
 
+	# where the time of the finished jobs went, from their <dataset>_<tiles>.timing.json
+	if timing:
+		from epistasis_timing import read_timings, timing_report
+		job_output = os.path.join(job_output_root, dataset)
+		records = []
+		if os.path.exists(job_output):
+			records = read_timings(job_output, dataset)
+		if not records:
+			log.send_output('No timing records in %s' % job_output)
+		else:
+			for line in timing_report(records):
+				log.send_output(line)
+		log.close()
+		sys.exit(0)
+
+	# job states from the user logs of all clusters of this dataset
+	condor_output = os.path.join(condor_output_root, dataset)
+	if monitor:
+		import epistasis_monitor
+		from epistasis_planner import PLAN_FILE
+		plan_file = os.path.join(dataLoc, dataset + PLAN_FILE)
+		if not os.path.exists(condor_output):
+			log.send_output('No user logs in %s' % condor_output)
+		elif watch:
+			epistasis_monitor.watch(condor_output, watch, plan_file=plan_file)
+		else:
+			state = epistasis_monitor.update_monitor(condor_output)
+			for line in epistasis_monitor.monitor_report(state, epistasis_monitor.job_tiles(condor_output, state), plan_file):
+				log.send_output(line)
+		log.close()
+		sys.exit(0)
+
+	# the whole run as a DAG: prep, compute and merge are done by DAGMan
+	if dag:
+		from epistasis_dag import write_dag, validate_dag
+		from epistasis_planner import PLAN_FILE
+		if not os.path.exists(condor_output):
+			os.makedirs(condor_output)
+		job_output = os.path.join(job_output_root, dataset)
+		dag_file = write_dag({'root': root,
+							  'cwd': os.getcwd(),
+							  'python': sys.executable,
+							  'arguments': ' '.join(server_arguments(sys.argv[1:])),
+							  'dataset': dataset,
+							  'dataLoc': os.path.abspath(dataLoc),
+							  'condor_output': condor_output,
+							  'job_output': os.path.abspath(job_output),
+							  'plan_file': os.path.join(os.path.abspath(dataLoc), dataset + PLAN_FILE),
+							  'names': ' '.join(result_names(dataLoc, dataset, job_output, all_phenotypes)),
+							  'bim': ['', '-b %s' % os.path.join(os.path.abspath(dataLoc), dataset + FILTERED_DATASET + '.bim')][output_format == 'binary'],
+							  'exclude_distance': ['', '--exclude-distance %r' % exclude_distance][exclude_distance is not None],
+							  'timestamp': datetime.ctime(datetime.now())})
+		problems = validate_dag(dag_file, generated=[os.path.join(root, 'epistasis_%s.sub' % dataset)])
+		for problem in problems:
+			log.send_output('DAG problem: %s' % problem)
+		if problems or no_submit:
+			log.send_output('Wrote %s, not submitted' % dag_file)
+			log.close()
+			sys.exit(int(bool(problems)))
+		output = subprocess.Popen(['condor_submit_dag', dag_file], stdout=subprocess.PIPE).communicate()[0].decode()
+		log.send_output('%s was sent as DAG %s at %s' % (dataset, dag_file, timestamp()))
+		log.send_output(output.strip())
+		log.close()
+		sys.exit(0)
+
 	log.send_output('Searching for raw data in %s' % dataLoc)
 
 	# initiate params
-	num_snps_per_group = 97
-	params = {	'covar':covFile }
+	params = {	'covar':None }
+	if os.path.exists(os.path.join(dataLoc, '%s.covar.txt' % dataset)):
+		params['covar'] = '%s.covar.txt' % dataset
+
+	# plink beds from the tped, unless they are already there
+	prepare_beds(dataLoc, dataset, species)
+
+	# counts, chromosomes and checksums of the beds, scanned once per set of beds;
+	# the planner and the resource estimate read them and jobs check against them
+	from epistasis_meta import read_meta
+	meta = read_meta(dataLoc, dataset)
+	log.send_output('%s: %s individuals, %s SNPs (%s for K0) on %s chromosomes' % (dataset, meta['n_indivs'], meta['n_snps'], meta['n_full_snps'],
+																				 len(set(chrom for chrom, first, count in meta['chromosomes']))))
+
+	# split the SNP pairs into tiles of about equal cost (a resumed run keeps its plan)
+	from epistasis_planner import PLAN_FILE, plan_dataset
+	params['plan_file'] = os.path.join(dataLoc, dataset + PLAN_FILE)
+	if not ((resume or status or thresholds) and os.path.exists(params['plan_file'])):
+		params['plan_file'], tiles, group_size = plan_dataset(dataLoc, dataset, target_minutes * 60, engine, group_size, screen)
+		log.send_output('Planned %s tiles with %s SNPs per group' % (len(tiles), group_size))
+
+	# tiles whose pairs are all within exclude_distance on one chromosome are never run
+	skip = set()
+	if exclude_distance is not None:
+		from epistasis_planner import read_plan
+		from epistasis_pairs import load_positions, excluded_tiles
+		chrom, bp = load_positions(os.path.join(dataLoc, dataset + FILTERED_DATASET))
+		skip = set(excluded_tiles(read_plan(params['plan_file'])[0], chrom, bp, exclude_distance))
+		log.send_output('Skipping %s tiles without pairs more than %s bp apart' % (len(skip), exclude_distance))
+
+	job_output = os.path.join(job_output_root, dataset)
+	names = result_names(dataLoc, dataset, job_output, all_phenotypes)
+
+	# family-wise thresholds from the smallest P per permutation of every tile
+	if thresholds:
+		from epistasis_planner import read_plan
+		from epistasis_permutations import read_minima, genome_wide_minima, thresholds_report
+		n_tiles = read_plan(params['plan_file'])[1]['n_tiles']
+		for name in names:
+			try:
+				genome_minima = genome_wide_minima(read_minima(job_output, name), n_tiles, skip)
+			except Exception as e:
+				log.send_output('%s: %s' % (name, e))
+				continue
+			for line in thresholds_report(name, genome_minima, n_tiles=n_tiles):
+				log.send_output(line)
+		log.close()
+		sys.exit(0)
+
+	# check finished tiles against the manifest in results/<dataset>/
+	if resume or status:
+		from epistasis_manifest import update_manifest, pending_tiles, summarize
+		manifest = update_manifest(job_output, dataset, params['plan_file'], names, skip)
+		log.send_output('%s: %s' % (dataset, summarize(manifest)))
+		from epistasis_summary import summary_files, read_summary, combine, inflation
+		for name in names:
+			files = summary_files(job_output, name)
+			if files:
+				total = combine(read_summary(filename) for filename in files)
+				log.send_output('%s: %s pairs in %s tiles, %s with the full test, %s excluded, %s returned, lambda %.4f' % (name, total['pairs'], total['tiles'], total['full_tests'], total['excluded'], total['written'], inflation(total)))
+		pending = pending_tiles(manifest)
+		if tasks:
+			pending = sorted(set(pending).intersection(tasks))
+		if status or not pending:
+			log.close()
+			sys.exit(0)
+		tasks = pending
+
+	# build the kinship decomposition once for all jobs
+	prepare_kinship(dataLoc, dataset, [None, params['covar']][covFile], all_phenotypes)
+	if exclude:
+		prepare_windows(dataLoc, dataset, [None, params['covar']][covFile], exclude_window, all_phenotypes)
+
+	# jobs get only the genotype shards of their tiles
+	prepare_shards(dataLoc, dataset, params['plan_file'])
 
 	# run on cluster
-	process(params, covFile, memory, tasks, species=species, featsel=featsel, exclude=exclude, condition=condition)
+	process(params, covFile, memory, tasks, species=species, featsel=featsel, exclude=exclude, condition=condition, engine=engine, tiles_per_job=tiles_per_job, output_format=output_format, threshold=threshold, screen=screen, all_phenotypes=all_phenotypes, exclude_distance=exclude_distance, exclude_r2=exclude_r2, skip=skip, retries=retries, submit=not no_submit, permutations=permutations, seed=seed, dtype=dtype)
+
+	if watch and not no_submit:
+		import epistasis_monitor
+		epistasis_monitor.watch(condor_output, watch, plan_file=params['plan_file'])
 
 	log.close()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+Per-group genotype shards of the filtered bed
+
+The server splits <dataset>.FILTERED.bed into one bed per SNP group of the
+plan, <dataset>.FILTERED.shard<group>.bed/.bim/.fam, so that a job only
+receives the groups its tiles touch instead of the whole dataset. A bed is
+SNP-major, so a shard is a byte range of the original file behind the same
+magic number; the .bim is the group's lines and the .fam is copied as is.
+
+Jobs still get <dataset>.FILTERED.bim/.fam, so SNP ids and indices stay
+those of the whole dataset: open_bed() returns a ShardedBed, which reads
+genotypes from the shards, whenever <dataset>.FILTERED.bed itself is absent.
+"""
+import sys
+import os
+import shutil
+from itertools import islice
+import numpy as np
+import pandas as pd
+from pysnptools.snpreader import SnpReader, Bed, plink_chrom_map
+
+from epistasis_tped import BED_MAGIC
+
+SHARD_DATASET = '.shard%s'
+
+
+def shard_prefix(prefix, group):
+	'''
+	Prefix of the shard of one group, prefix being <path>/<dataset>.FILTERED
+	'''
+	return prefix + SHARD_DATASET % group
+
+
+def shard_files(prefix, groups):
+	return ['%s%s' % (shard_prefix(prefix, group), suffix) for group in groups for suffix in ['.bed', '.bim', '.fam']]
+
+
+def tile_groups(tiles, group_size):
+	'''
+	Sorted group indices of all blocks of the given tiles
+	'''
+	groups = set()
+	for tile in tiles:
+		for start0, end0, start1, end1 in tile:
+			groups.update([start0 // group_size, start1 // group_size])
+	return sorted(groups)
+
+
+def bytes_per_snp(prefix):
+	f = open(prefix + '.fam')
+	n_indivs = sum(1 for line in f if line.strip())
+	f.close()
+	return (n_indivs + 3) // 4
+
+
+def shards_current(prefix, n_snps, group_size):
+	'''
+	True if every shard exists, has the right size and is newer than the bed
+	'''
+	width = bytes_per_snp(prefix)
+	mtime = os.path.getmtime(prefix + '.bed')
+	for group, start in enumerate(range(0, n_snps, group_size)):
+		bed = shard_prefix(prefix, group) + '.bed'
+		if not os.path.exists(bed) or os.path.getmtime(bed) < mtime:
+			return False
+		if os.path.getsize(bed) != len(BED_MAGIC) + width * (min(start + group_size, n_snps) - start):
+			return False
+	return True
+
+
+def write_shards(prefix, group_size):
+	'''
+	Splits prefix.bed/.bim into shards of group_size SNPs; returns the number
+	of shards. Each shard is written under a temporary name and renamed, so
+	an interrupted run never leaves a shard that looks complete
+	'''
+	width = bytes_per_snp(prefix)
+	bed = open(prefix + '.bed', 'rb')
+	if bed.read(len(BED_MAGIC)) != BED_MAGIC:
+		raise Exception('%s.bed is not a SNP-major bed file' % prefix)
+	bim = open(prefix + '.bim')
+
+	group = 0
+	while True:
+		data = bed.read(width * group_size)
+		lines = list(islice(bim, group_size))
+		if not lines:
+			break
+		if len(data) != width * len(lines):
+			raise Exception('%s.bed and %s.bim disagree on the number of SNPs' % (prefix, prefix))
+
+		shard = shard_prefix(prefix, group)
+		shutil.copyfile(prefix + '.fam', shard + '.fam')
+		f = open(shard + '.bim.tmp', 'w')
+		f.write(''.join(lines))
+		f.close()
+		f = open(shard + '.bed.tmp', 'wb')
+		f.write(BED_MAGIC)
+		f.write(data)
+		f.close()
+		os.rename(shard + '.bim.tmp', shard + '.bim')
+		os.rename(shard + '.bed.tmp', shard + '.bed')
+		group += 1
+
+	bed.close()
+	bim.close()
+	return group
+
+
+class ShardedBed(SnpReader):
+	'''
+	Reader for prefix (<dataset>.FILTERED) that takes iid, sid and pos from
+	prefix.fam/.bim and reads genotypes from whichever shards hold the
+	requested SNPs. Only the shards that are actually read have to exist,
+	so with none at all it stands in for a bed that is never read, such as
+	G0 when the kinship decomposition is cached
+	'''
+	def __init__(self, prefix, group_size, count_A1=None):
+		super(ShardedBed, self).__init__()
+		self.prefix = prefix
+		self.group_size = group_size
+		self.count_A1 = count_A1
+		self._shards = {}
+
+		fam = pd.read_csv(prefix + '.fam', sep=r'\s+', header=None, usecols=[0, 1], dtype=str)
+		bim = pd.read_csv(prefix + '.bim', sep=r'\s+', header=None, usecols=[0, 1, 2, 3], dtype=str)
+		chrom = bim[0].map(lambda c: plink_chrom_map.get(c, c)).astype(np.float64)
+		self._row = np.array(fam.values, dtype='str')
+		self._col = np.array(bim[1].values, dtype='str')
+		self._col_property = np.column_stack([chrom, bim[2].astype(np.float64), bim[3].astype(np.float64)])
+		# as in Bed, 0 means unknown
+		self._col_property[self._col_property == 0] = np.nan
+
+	def __repr__(self):
+		return "%s('%s',group_size=%s)" % (self.__class__.__name__, self.prefix, self.group_size)
+
+	@property
+	def row(self):
+		return self._row
+
+	@property
+	def col(self):
+		return self._col
+
+	@property
+	def col_property(self):
+		return self._col_property
+
+	def copyinputs(self, copier):
+		copier.input(self.prefix + '.bim')
+		copier.input(self.prefix + '.fam')
+		for group in range((self.sid_count + self.group_size - 1) // self.group_size):
+			for filename in shard_files(self.prefix, [group]):
+				if os.path.exists(filename):
+					copier.input(filename)
+
+	def shard(self, group):
+		if group not in self._shards:
+			self._shards[group] = Bed(shard_prefix(self.prefix, group), count_A1=self.count_A1)
+		return self._shards[group]
+
+	def _read(self, iid_index_or_none, sid_index_or_none, order, dtype, force_python_only, view_ok, num_threads):
+		if sid_index_or_none is None:
+			sid_index_or_none = np.arange(self.sid_count)
+		sid_index = np.asarray(sid_index_or_none)
+		iid_count = [len(iid_index_or_none), self.iid_count][iid_index_or_none is None]
+		val = np.empty((iid_count, len(sid_index)), dtype=dtype, order=['F', 'C'][order == 'C'])
+
+		groups = sid_index // self.group_size
+		for group in np.unique(groups):
+			at = np.flatnonzero(groups == group)
+			val[:, at] = self.shard(group)._read(iid_index_or_none, sid_index[at] - group * self.group_size,
+												 order, dtype, force_python_only, True, num_threads)
+		return val
+
+
+def open_bed(prefix, group_size=None, count_A1=None):
+	'''
+	Bed reader of prefix, or a ShardedBed if a job was only given its shards
+	'''
+	if group_size is None or os.path.exists(prefix + '.bed'):
+		return Bed(prefix, count_A1=count_A1)
+	return ShardedBed(prefix, group_size, count_A1)
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	from epistasis_planner import read_plan
+	parser = ArgumentParser(description='splits <dataset>.FILTERED into one bed per SNP group of the tile plan')
+	parser.add_argument('prefix', help='bed prefix, e.g. data/PREFIX.FILTERED', action='store')
+	parser.add_argument('plan', help='plan file the groups are taken from', action='store')
+
+	args = parser.parse_args()
+
+	tiles, info = read_plan(args.plan)
+	if shards_current(args.prefix, info['n_snps'], info['group_size']):
+		print('%s shards are up to date' % args.prefix)
+		sys.exit(0)
+	print('wrote %s shards of %s SNPs' % (write_shards(args.prefix, info['group_size']), info['group_size']))
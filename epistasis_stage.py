@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+"""
+Cleans and checks the phenotype and covariate files of a dataset
+
+Replaces fixpheno.sh. Each <dataset>.pheno.txt and <dataset>.covar.txt
+(tab separated, FID and IID first, one header line) is read once:
+	header names get '.' for spaces and slashes
+	values that are one of MISSING_TOKENS (NULL, NA, #NUM!, Inf, ...) or
+	    empty become -9, anything else has to be a number
+	rows are looked up by FID/IID in the individuals of <dataset>.tfam (or
+	    .FULL.fam once it has been converted), rows of unknown individuals
+	    are dropped and reported, and the rest is written in .tfam order
+Duplicate individuals or column names and rows with the wrong number of
+fields are errors. The cleaned file is written under a temporary name and
+renamed over the original, so a staging run that fails leaves the original
+as it was. Staging a cleaned file again doesn't change it.
+
+Unlike fixpheno.sh, missing values are matched as whole fields (so a value
+like NA12 isn't mangled), the covariate file gets the same treatment as the
+phenotypes, and FID/IID are left as they are so they still match the .tfam.
+"""
+import sys
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# filename formats
+PHENO_FILE = '.pheno.txt'
+COVAR_FILE = '.covar.txt'
+
+MISSING = '-9'
+MISSING_TOKENS = set(['', 'NULL', 'NA', 'N/A', '#NUM!', '-Inf', 'Inf', '-inf', 'inf', 'NaN', 'nan'])
+
+
+def clean_name(name):
+	return re.sub(r'[ /]', '.', name.strip())
+
+
+def read_individuals(filename):
+	'''
+	{(FID, IID): position} of a .tfam/.fam file
+	'''
+	individuals = {}
+	f = open(filename)
+	for line in f:
+		fields = line.split()
+		if fields:
+			individuals.setdefault(tuple(fields[:2]), len(individuals))
+	f.close()
+	return individuals
+
+
+def individuals_file(dataloc, dataset):
+	'''
+	The .tfam of the dataset, or the .FULL.fam converted from it, None if neither exists
+	'''
+	for suffix in ['.tfam', '.FULL.fam']:
+		filename = os.path.join(dataloc, dataset + suffix)
+		if os.path.exists(filename):
+			return filename
+	return None
+
+
+def stage_file(filename, individuals=None, output=None):
+	'''
+	Cleans filename (see above) and writes it to output, by default over
+	filename. individuals ({(FID, IID): position}) sets which rows are kept
+	and their order. Returns counts of what was done
+	'''
+	if output is None:
+		output = filename
+	f = open(filename)
+	header = f.readline().rstrip('\r\n').split('\t')
+	if len(header) < 3 or header[0].strip() != 'FID' or header[1].strip() != 'IID':
+		f.close()
+		raise Exception('%s: the header should be FID, IID and at least one column name, tab separated' % filename)
+	names = [clean_name(name) for name in header[2:]]
+	if len(set(names)) < len(names):
+		f.close()
+		raise Exception('%s: duplicate column names %s' % (filename, ', '.join(sorted(set(name for name in names if names.count(name) > 1)))))
+
+	rows = []
+	seen = set()
+	extra = []
+	missing = 0
+	for number, line in enumerate(f, 2):
+		line = line.rstrip('\r\n')
+		if not line.strip():
+			continue
+		fields = line.split('\t')
+		if len(fields) != len(header):
+			f.close()
+			raise Exception('%s line %s: %s fields instead of %s' % (filename, number, len(fields), len(header)))
+		key = (fields[0].strip(), fields[1].strip())
+		if key in seen:
+			f.close()
+			raise Exception('%s line %s: %s %s appears twice' % (filename, number, key[0], key[1]))
+		seen.add(key)
+
+		values = []
+		for name, value in zip(names, fields[2:]):
+			value = value.strip()
+			if value in MISSING_TOKENS:
+				value = MISSING
+				missing += 1
+			else:
+				try:
+					float(value)
+				except ValueError:
+					f.close()
+					raise Exception('%s line %s: %r in column %s is not a number' % (filename, number, value, name))
+			values.append(value)
+
+		if individuals is None:
+			rows.append((len(rows), key, values))
+		elif key in individuals:
+			rows.append((individuals[key], key, values))
+		else:
+			extra.append(key)
+	f.close()
+
+	reordered = [row[0] for row in rows] != sorted(row[0] for row in rows)
+	rows.sort()
+
+	out = open(output + '.tmp', 'w')
+	out.write('\t'.join(['FID', 'IID'] + names) + '\n')
+	for position, key, values in rows:
+		out.write('\t'.join(list(key) + values) + '\n')
+	out.close()
+	os.rename(output + '.tmp', output)
+
+	return {'individuals': len(rows),
+			'columns': len(names),
+			'missing': missing,
+			'renamed': sum(1 for name, original in zip(names, header[2:]) if name != original),
+			'extra': extra,
+			'absent': [0, len(individuals or {}) - len(rows)][individuals is not None],
+			'reordered': reordered}
+
+
+def stage_dataset(dataloc, dataset):
+	'''
+	Stages the pheno (required) and covar (if any) files of a dataset in
+	dataloc against its individuals. Returns lines of a report
+	'''
+	pheno_file = os.path.join(dataloc, dataset + PHENO_FILE)
+	if not os.path.exists(pheno_file):
+		raise Exception('%s not found' % pheno_file)
+	fam_file = individuals_file(dataloc, dataset)
+	individuals = None
+	lines = []
+	if fam_file is None:
+		lines.append('%s: no .tfam or .FULL.fam, individuals are not checked' % dataset)
+	else:
+		individuals = read_individuals(fam_file)
+
+	for filename in [pheno_file, os.path.join(dataloc, dataset + COVAR_FILE)]:
+		if not os.path.exists(filename):
+			continue
+		counts = stage_file(filename, individuals)
+		lines.append('Staged %s: %s individuals, %s columns, %s missing values' % (os.path.basename(filename), counts['individuals'], counts['columns'], counts['missing']))
+		if counts['renamed']:
+			lines.append('  %s column names changed' % counts['renamed'])
+		if counts['reordered']:
+			lines.append('  rows were put in the order of %s' % os.path.basename(fam_file))
+		if counts['absent']:
+			lines.append('  %s individuals of %s have no row' % (counts['absent'], os.path.basename(fam_file)))
+		if counts['extra']:
+			lines.append('  dropped %s rows not in %s: %s' % (len(counts['extra']), os.path.basename(fam_file), ', '.join('%s %s' % key for key in counts['extra'][:10]) + ['', ', ...'][len(counts['extra']) > 10]))
+	return lines
+
+
+def stage_datasets(dataloc, datasets, workers=None):
+	'''
+	Stages several datasets, in parallel with workers > 1. Returns the
+	datasets that failed, after reporting on stderr
+	'''
+	if workers is None or workers <= 1 or len(datasets) == 1:
+		results = []
+		for dataset in datasets:
+			try:
+				results.append((dataset, stage_dataset(dataloc, dataset), None))
+			except Exception as e:
+				results.append((dataset, [], e))
+	else:
+		pool = ProcessPoolExecutor(max_workers=workers)
+		futures = dict((pool.submit(stage_dataset, dataloc, dataset), dataset) for dataset in datasets)
+		results = []
+		for future in as_completed(futures):
+			try:
+				results.append((futures[future], future.result(), None))
+			except Exception as e:
+				results.append((futures[future], [], e))
+		pool.shutdown()
+
+	failed = []
+	for dataset, lines, error in sorted(results, key=lambda result: datasets.index(result[0])):
+		for line in lines:
+			sys.stderr.write('%s\n' % line)
+		if error is not None:
+			sys.stderr.write('%s failed: %s\n' % (dataset, error))
+			failed.append(dataset)
+	return failed
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='cleans and checks the pheno/covar files of datasets (replaces fixpheno.sh)')
+	parser.add_argument('datasets', metavar='dataset', nargs='+', help='dataset prefixes', action='store')
+	parser.add_argument('-d', '--datadir', dest='datadir', help='folder with the pheno, covar and tfam files',
+						default='.', action='store')
+	parser.add_argument('-j', '--workers', dest='workers', help='datasets staged in parallel',
+						default=1, type=int, action='store')
+
+	args = parser.parse_args()
+
+	if stage_datasets(args.datadir, args.datasets, args.workers):
+		sys.exit(1)
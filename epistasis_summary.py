@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""
+Fixed-size per-tile summaries of the p-value distribution
+
+Every tile writes <dataset>_<tile>.summary.txt next to its results, even
+when the node only keeps pairs below a p-value threshold. It holds the
+number of pairs tested and kept, the number of pairs that got the full
+fastlmm test (fewer than all in a screened run), the number of pairs of the
+tile that were not tested because of their distance or LD, the tile's
+smallest P and median chi-square, a histogram of -log10 P in BIN_WIDTH
+wide bins and one of the chi-square in CHI2_BIN_WIDTH wide bins (the last
+bin of each also counts everything beyond it). Histograms of all tiles add
+up to the genome-wide distribution: the QQ plot is reconstructed from the
+-log10 P one, the median chi-square and the genomic inflation factor
+lambda from the chi-square one, without the p-values themselves.
+
+Medians of tiles can't be combined, and a median read off the coarse
+-log10 P bins is far off when many pairs have P = 1 (the top of the first
+bin). The chi-square bins are fine enough to place the median within
+CHI2_BIN_WIDTH, i.e. lambda within 0.005, of the median of all pairs as
+long as lambda is below about 8.8.
+
+Summary file format (tab separated):
+	pairs	<n>
+	written	<n>
+	full_tests	<n>
+	excluded	<n>
+	threshold	<p>
+	min_p	<p>
+	median_chi2	<x>
+	bin_width	<w>
+	histogram	<count>	<count>	...
+	chi2_bin_width	<w>
+	chi2_histogram	<count>	<count>	...
+"""
+import sys
+import os
+import re
+import numpy as np
+from scipy.stats import chi2
+
+SUMMARY_SUFFIX = '.summary.txt'
+
+# -log10 P from 0 to 20, anything smaller than 1e-20 goes into the last bin
+BIN_WIDTH = 0.05
+N_BINS = 400
+
+# chi-square from 0 to 4 for the median, anything larger goes into the last bin
+CHI2_BIN_WIDTH = 0.002
+N_CHI2_BINS = 2000
+
+# median of a 1 df chi-square, lambda = observed median / this
+NULL_MEDIAN_CHI2 = chi2.isf(0.5, 1)
+
+
+def summarize_pvalues(pvalues, threshold=1.0, full_tests=None, excluded=0):
+	'''
+	Summary dict for the p-values of one tile; written is the number of
+	pairs with P <= threshold, full_tests defaults to all pairs, excluded
+	is the number of the tile's pairs that were skipped
+	'''
+	pvalues = np.asarray(pvalues, dtype=np.float64)
+	with np.errstate(divide='ignore'):
+		neglog10p = -np.log10(pvalues)
+	bins = np.minimum((neglog10p / BIN_WIDTH).astype(np.int64), N_BINS - 1)
+	chi2_values = chi2.isf(pvalues, 1)
+	chi2_bins = np.minimum((chi2_values / CHI2_BIN_WIDTH).astype(np.int64), N_CHI2_BINS - 1)
+	summary = {'pairs': len(pvalues),
+			   'written': int((pvalues <= threshold).sum()),
+			   'full_tests': [full_tests, len(pvalues)][full_tests is None],
+			   'excluded': excluded,
+			   'threshold': threshold,
+			   'min_p': float(pvalues.min()) if len(pvalues) else 1.0,
+			   'median_chi2': float(np.median(chi2_values)) if len(pvalues) else 0.0,
+			   'bin_width': BIN_WIDTH,
+			   'histogram': np.bincount(bins, minlength=N_BINS),
+			   'chi2_bin_width': CHI2_BIN_WIDTH,
+			   'chi2_histogram': np.bincount(chi2_bins, minlength=N_CHI2_BINS)}
+	return summary
+
+
+def write_summary(filename, summary):
+	f = open(filename, 'w')
+	for key in ['pairs', 'written', 'full_tests', 'excluded', 'threshold', 'min_p', 'median_chi2', 'bin_width']:
+		f.write('%s\t%r\n' % (key, summary[key]))
+	f.write('histogram\t%s\n' % '\t'.join(map(str, summary['histogram'])))
+	f.write('chi2_bin_width\t%r\n' % summary['chi2_bin_width'])
+	f.write('chi2_histogram\t%s\n' % '\t'.join(map(str, summary['chi2_histogram'])))
+	f.close()
+
+
+def read_summary(filename):
+	summary = {}
+	f = open(filename)
+	for line in f:
+		line = line.rstrip('\n').split('\t')
+		if len(line) < 2:
+			continue
+		if line[0] in ('histogram', 'chi2_histogram'):
+			summary[line[0]] = np.array(line[1:], dtype=np.int64)
+		elif line[0] in ('pairs', 'written', 'full_tests', 'excluded'):
+			summary[line[0]] = int(line[1])
+		else:
+			summary[line[0]] = float(line[1])
+	f.close()
+	if len(summary.get('histogram', [])) != N_BINS or summary['histogram'].sum() != summary['pairs']:
+		raise ValueError('%s is not a complete summary file' % filename)
+	if 'chi2_histogram' in summary and (len(summary['chi2_histogram']) != N_CHI2_BINS or summary['chi2_histogram'].sum() != summary['pairs']):
+		raise ValueError('%s is not a complete summary file' % filename)
+	return summary
+
+
+def summary_file(output_dir, dataset, tile_id):
+	return os.path.join(output_dir, '%s_%s%s' % (dataset, tile_id, SUMMARY_SUFFIX))
+
+
+def summary_files(output_dir, dataset):
+	pattern = re.compile(r'^%s_(\d+)%s$' % (re.escape(dataset), re.escape(SUMMARY_SUFFIX)))
+	matches = [pattern.match(name) for name in os.listdir(output_dir)]
+	matches = sorted((int(m.group(1)), m.group(0)) for m in matches if m)
+	return [os.path.join(output_dir, name) for tile_id, name in matches]
+
+
+def combine(summaries):
+	'''
+	Genome-wide summary of many tiles; median_chi2 is the median of the
+	summed chi-square histograms, nan if a tile's summary has none (written
+	before they were added)
+	'''
+	total = {'pairs': 0, 'written': 0, 'full_tests': 0, 'excluded': 0, 'tiles': 0, 'min_p': 1.0, 'histogram': np.zeros(N_BINS, dtype=np.int64),
+			 'chi2_histogram': np.zeros(N_CHI2_BINS, dtype=np.int64)}
+	complete = True
+	for summary in summaries:
+		total['tiles'] += 1
+		total['pairs'] += summary['pairs']
+		total['written'] += summary['written']
+		total['full_tests'] += summary.get('full_tests', summary['pairs'])
+		total['excluded'] += summary.get('excluded', 0)
+		total['min_p'] = min(total['min_p'], summary['min_p'])
+		total['histogram'] += summary['histogram']
+		if 'chi2_histogram' in summary:
+			total['chi2_histogram'] += summary['chi2_histogram']
+		else:
+			complete = False
+	total['median_chi2'] = [np.nan, histogram_median(total['chi2_histogram'], CHI2_BIN_WIDTH)][complete]
+	return total
+
+
+def histogram_median(histogram, width):
+	'''
+	Median of the values counted in histogram (bins of width from 0),
+	interpolated linearly within its bin
+	'''
+	cumulative = np.cumsum(histogram)
+	if cumulative[-1] == 0:
+		return 0.0
+	rank = cumulative[-1] / 2.0
+	i = int(np.searchsorted(cumulative, rank))
+	before = cumulative[i - 1] if i else 0
+	return width * (i + (rank - before) / float(histogram[i]))
+
+
+def inflation(total):
+	'''
+	Genomic inflation factor lambda of a combined summary
+	'''
+	return total['median_chi2'] / NULL_MEDIAN_CHI2
+
+
+def qq_table(histogram):
+	'''
+	Rows (expected -log10 P, observed -log10 P, pairs) at the lower edge of
+	every non-empty bin: the pairs at least as significant as that edge and
+	the -log10 P the same number of pairs would reach under the null
+	'''
+	n = histogram.sum()
+	at_least = np.cumsum(histogram[::-1])[::-1]
+	rows = []
+	for i in np.flatnonzero(histogram):
+		rows.append((-np.log10(at_least[i] / float(n)), i * BIN_WIDTH, int(at_least[i])))
+	return rows
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='combines the per-tile p-value summaries of a dataset into lambda and a QQ table')
+	parser.add_argument('dataset', help='dataset prefix of the summary files', action='store')
+	parser.add_argument('-i', '--inputdir', dest='inputdir', help='folder with the <dataset>_<tile>%s files' % SUMMARY_SUFFIX,
+						default='.', action='store')
+	parser.add_argument('-q', '--qq', dest='qq', help='write the QQ table (expected, observed -log10 P, pairs) to this file',
+						default=None, action='store')
+
+	args = parser.parse_args()
+
+	files = summary_files(args.inputdir, args.dataset)
+	if not files:
+		sys.exit('no %s_<tile>%s files found in %s' % (args.dataset, SUMMARY_SUFFIX, args.inputdir))
+	total = combine(read_summary(filename) for filename in files)
+
+	print('tiles:\t%s' % total['tiles'])
+	print('pairs tested:\t%s' % total['pairs'])
+	print('pairs with full test:\t%s' % total['full_tests'])
+	print('pairs excluded:\t%s' % total['excluded'])
+	print('pairs written:\t%s' % total['written'])
+	print('smallest P:\t%s' % total['min_p'])
+	print('median chi2:\t%.4f' % total['median_chi2'])
+	print('lambda:\t%.4f' % inflation(total))
+
+	if args.qq:
+		f = open(args.qq, 'w')
+		f.write('expected\tobserved\tpairs\n')
+		for row in qq_table(total['histogram']):
+			f.write('%.4f\t%.4f\t%s\n' % row)
+		f.close()
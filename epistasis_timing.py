@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+Where the time of a job goes
+
+run_fastlmmc times its phases (opening the beds, the kinship/null model,
+the epistasis tests and writing the results) with a PhaseTimer and writes
+<dataset>_<tiles>.timing.json next to its results. For each phase it
+records wall and CPU seconds and the peak resident memory. The peak is reset
+at the start of every phase where Linux allows it (/proc/self/clear_refs),
+otherwise it is the peak of the process so far. The job script exports the
+times around untarring, which gives the untar phase and, up to the start of
+run_fastlmmc, the interpreter start and imports. Every tile adds its number
+of blocks, groups and pairs and its own epistasis and write time.
+
+timing_report() aggregates the records of a results folder into percentiles
+per phase and the throughput in pairs per second of epistasis time. A pair
+tested for several phenotypes counts once per phenotype.
+"""
+import sys
+import os
+import re
+import json
+import time
+import socket
+from contextlib import contextmanager
+import numpy as np
+
+TIMING_SUFFIX = '.timing.json'
+
+# exported by the job script, seconds since the epoch
+JOB_START_VAR = 'EPISTASIS_JOB_START'
+UNTAR_END_VAR = 'EPISTASIS_UNTAR_END'
+
+PHASES = ['untar', 'imports', 'open', 'kinship', 'epistasis', 'write']
+PERCENTILES = [50, 90, 99]
+
+
+def cpu_seconds():
+	times = os.times()
+	return times[0] + times[1]
+
+
+def peak_rss_mb():
+	'''
+	Peak resident memory (VmHWM) in MB, from getrusage where /proc is missing
+	'''
+	try:
+		f = open('/proc/self/status')
+		for line in f:
+			if line.startswith('VmHWM:'):
+				f.close()
+				return int(line.split()[1]) / 1024.0
+		f.close()
+	except IOError:
+		pass
+	import resource
+	# kB on Linux, bytes on macOS
+	scale = [1024.0, 1024.0 * 1024][sys.platform == 'darwin']
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def reset_peak_rss():
+	'''
+	Resets VmHWM to the current RSS; False if the kernel doesn't allow it
+	'''
+	try:
+		f = open('/proc/self/clear_refs', 'w')
+		f.write('5')
+		f.close()
+		return True
+	except (IOError, OSError):
+		return False
+
+
+class PhaseTimer(object):
+	'''
+	Accumulates wall time, CPU time and peak RSS per named phase. A phase
+	entered several times (once per tile) adds up, its peak is the largest
+	'''
+	def __init__(self):
+		self.start = time.time()
+		self.phases = {}
+		self.tiles = []
+		self.peak_reset = True
+
+	def add(self, name, wall, cpu=None, rss=None):
+		record = self.phases.setdefault(name, {'wall': 0.0, 'cpu': None, 'peak_rss_mb': None, 'calls': 0})
+		record['wall'] += wall
+		record['calls'] += 1
+		if cpu is not None:
+			record['cpu'] = (record['cpu'] or 0.0) + cpu
+		if rss is not None:
+			record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0.0, rss)
+
+	def wall(self, name):
+		'''
+		Wall seconds of a phase so far
+		'''
+		return self.phases.get(name, {'wall': 0.0})['wall']
+
+	@contextmanager
+	def phase(self, name):
+		self.peak_reset = reset_peak_rss() and self.peak_reset
+		wall, cpu = time.time(), cpu_seconds()
+		try:
+			yield
+		finally:
+			self.add(name, time.time() - wall, cpu_seconds() - cpu, peak_rss_mb())
+
+	def job_startup(self):
+		'''
+		Adds the untar and imports phases from the job script's timestamps.
+		Only a fresh process (a cluster job) has them, the CPU time and peak
+		so far then belong to the imports
+		'''
+		job_start, untar_end = os.environ.get(JOB_START_VAR), os.environ.get(UNTAR_END_VAR)
+		if not job_start or not untar_end:
+			return
+		self.add('untar', float(untar_end) - float(job_start))
+		self.add('imports', self.start - float(untar_end), cpu_seconds(), peak_rss_mb())
+
+	def add_tile(self, tile_id, **stats):
+		stats['tile'] = tile_id
+		self.tiles.append(stats)
+
+	def record(self, **info):
+		record = dict(info)
+		record.update({'host': socket.gethostname(),
+					   'wall': time.time() - self.start,
+					   'cpu': cpu_seconds(),
+					   'peak_rss_mb': max([peak_rss_mb()] + [phase['peak_rss_mb'] for phase in self.phases.values() if phase['peak_rss_mb'] is not None]),
+					   'peak_reset': self.peak_reset,
+					   'phases': self.phases,
+					   'tiles': self.tiles})
+		return record
+
+
+def timing_file(output_dir, dataset, tiles):
+	return os.path.join(output_dir, '%s_%s%s' % (dataset, tiles, TIMING_SUFFIX))
+
+
+def write_timing(filename, record):
+	f = open(filename, 'w')
+	json.dump(record, f, indent=1, sort_keys=True)
+	f.close()
+
+
+def read_timings(output_dir, dataset):
+	'''
+	Timing records of the jobs of dataset in output_dir, skipping unreadable ones
+	'''
+	pattern = re.compile(r'^%s_[\d,-]+%s$' % (re.escape(dataset), re.escape(TIMING_SUFFIX)))
+	records = []
+	for name in sorted(os.listdir(output_dir)):
+		if pattern.match(name):
+			try:
+				f = open(os.path.join(output_dir, name))
+				records.append(json.load(f))
+				f.close()
+			except ValueError:
+				sys.stderr.write('skipping incomplete %s\n' % name)
+	return records
+
+
+def percentiles(values):
+	return [float(np.percentile(values, q)) for q in PERCENTILES] + [float(np.max(values))]
+
+
+def timing_report(records):
+	'''
+	Lines of a report: percentiles and max of every phase's wall time, CPU
+	time and peak RSS over the jobs, and the throughput per job and per tile
+	'''
+	header = '%-10s %-12s' % ('phase', 'measure') + ''.join('%12s' % ('p%s' % q) for q in PERCENTILES) + '%12s' % 'max'
+	lines = ['%s jobs, %s tiles, %s hosts' % (len(records), sum(len(r['tiles']) for r in records), len(set(r['host'] for r in records))), header]
+
+	def row(phase, measure, values, fmt='%12.2f'):
+		values = [value for value in values if value is not None]
+		if values:
+			lines.append('%-10s %-12s' % (phase, measure) + ''.join(fmt % value for value in percentiles(values)))
+
+	names = [name for name in PHASES if any(name in r['phases'] for r in records)]
+	names += sorted(set(name for r in records for name in r['phases']).difference(names))
+	for name in names:
+		phases = [r['phases'][name] for r in records if name in r['phases']]
+		row(name, 'wall s', [phase['wall'] for phase in phases])
+		row(name, 'cpu s', [phase['cpu'] for phase in phases])
+		row(name, 'peak MB', [phase['peak_rss_mb'] for phase in phases], '%12.0f')
+	row('job', 'wall s', [r['wall'] + sum(r['phases'][name]['wall'] for name in ['untar', 'imports'] if name in r['phases']) for r in records])
+	row('job', 'peak MB', [r['peak_rss_mb'] for r in records], '%12.0f')
+
+	tiles = [tile for r in records for tile in r['tiles']]
+	row('tile', 'pairs', [tile['pairs'] * tile['phenotypes'] for tile in tiles], '%12.0f')
+	row('tile', 'pairs/s', [tile['pairs'] * tile['phenotypes'] / tile['epistasis'] for tile in tiles if tile['epistasis'] > 0], '%12.0f')
+	pairs = sum(tile['pairs'] * tile['phenotypes'] for tile in tiles)
+	seconds = sum(tile['epistasis'] for tile in tiles)
+	if seconds > 0:
+		lines.append('overall: %s pairs in %.0f s of epistasis, %.0f pairs/s per job' % (pairs, seconds, pairs / seconds))
+	if not all(r['peak_reset'] for r in records):
+		lines.append('note: some jobs could not reset the peak RSS, their phase peaks include the earlier phases')
+	return lines
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='aggregates the per-job timing records of a dataset')
+	parser.add_argument('dataset', help='dataset prefix of the timing files', action='store')
+	parser.add_argument('-i', '--inputdir', dest='inputdir', help='folder with the <dataset>_<tiles>%s files' % TIMING_SUFFIX,
+						default='.', action='store')
+
+	args = parser.parse_args()
+
+	records = read_timings(args.inputdir, args.dataset)
+	if not records:
+		sys.exit('no %s_<tiles>%s files found in %s' % (args.dataset, TIMING_SUFFIX, args.inputdir))
+	for line in timing_report(records):
+		print(line)
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+"""
+Converts PLINK .tped/.tfam files to .bed/.bim/.fam without plink
+
+Streams the tped in chunks of SNPs, encodes each chunk's genotypes to the
+2-bit .bed codes with numpy and applies the same filters as
+`plink --maf 0.05 --geno 0.1 --make-bed`: SNPs with a missing genotype rate
+above geno or a minor allele frequency below maf are dropped. As in plink,
+A1 is the minor allele (0 for monomorphic SNPs), and a genotype with one
+missing allele counts as missing.
+
+Either the whole file is converted, or only some line ranges of it
+(1-based and inclusive, like the `sed -n 'a,bp'` slices of the wrapper).
+
+A <prefix>.tped.idx sidecar holds the byte offset, chromosome and SNP id
+of every tped line, so that a range is read with one seek and a bounded
+read instead of scanning the file from the top, and the SNP count is known
+without reading the tped. Format (tab separated):
+	# tped_bytes <size> n_snps <n>
+	offset	chr	snp
+"""
+from __future__ import division
+import sys
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# SNPs encoded at a time
+CHUNK_SNPS = 4096
+
+INDEX_SUFFIX = '.idx'
+
+MISSING_ALLELE = '0'
+BED_MAGIC = b'\x6c\x1b\x01'
+
+# 2-bit codes of the SNP-major .bed format
+HOM_A1, MISSING, HET, HOM_A2 = 0, 1, 2, 3
+
+# chromosome codes written by plink --make-bed
+species_chrom_codes = {'human': {'X': '23', 'Y': '24', 'XY': '25', 'MT': '26'},
+					   'mouse': {'X': '20', 'Y': '21'}}
+
+
+def parse_ranges(specs):
+	'''
+	[(first, last)] line ranges from strings such as "1,7500"
+	'''
+	ranges = []
+	for spec in specs:
+		first, last = map(int, spec.split(','))
+		ranges.append((first, last))
+	return ranges
+
+
+def build_index(tped, index_file=None):
+	'''
+	Scans the tped once and writes the offset index next to it.
+	Returns the index as read_index does
+	'''
+	if index_file is None:
+		index_file = tped + INDEX_SUFFIX
+
+	offsets = []
+	chroms = []
+	snps = []
+	offset = 0
+	f = open(tped, 'rb')
+	for line in f:
+		fields = line.split(None, 2)
+		if fields:
+			offsets.append(offset)
+			chroms.append(fields[0].decode())
+			snps.append(fields[1].decode())
+		offset += len(line)
+	f.close()
+
+	out = open(index_file + '.tmp', 'w')
+	out.write('# tped_bytes %s n_snps %s\n' % (offset, len(offsets)))
+	out.write('offset\tchr\tsnp\n')
+	for row in zip(offsets, chroms, snps):
+		out.write('%s\t%s\t%s\n' % row)
+	out.close()
+	os.rename(index_file + '.tmp', index_file)
+	return {'offset': np.append(np.array(offsets, dtype=np.int64), offset), 'chr': np.array(chroms), 'snp': np.array(snps)}
+
+
+def read_index(index_file):
+	'''
+	Returns a dict with 'offset' (n_snps + 1 byte offsets, the last one is
+	the tped size), 'chr' and 'snp'
+	'''
+	f = open(index_file)
+	header = f.readline().strip('#').split()
+	info = dict((key, int(value)) for key, value in zip(header[::2], header[1::2]))
+	table = pd.read_csv(f, sep='\t', dtype={'offset': np.int64, 'chr': str, 'snp': str})
+	f.close()
+	if len(table) != info['n_snps']:
+		raise ValueError('%s is truncated' % index_file)
+	return {'offset': np.append(table['offset'].values, info['tped_bytes']), 'chr': table['chr'].values, 'snp': table['snp'].values}
+
+
+def tped_index(tped, build=True):
+	'''
+	The tped's index, rebuilt if it is missing or was made for a tped of
+	another size. None if there is no usable index and build is False
+	'''
+	index_file = tped + INDEX_SUFFIX
+	if os.path.exists(index_file):
+		try:
+			index = read_index(index_file)
+			if index['offset'][-1] == os.path.getsize(tped):
+				return index
+		except (ValueError, KeyError):
+			pass
+	if build:
+		return build_index(tped, index_file)
+	return None
+
+
+def snp_count(tped):
+	return len(tped_index(tped)['snp'])
+
+
+def tped_lines(tped, ranges=None, index=None):
+	'''
+	Yields the lines of the tped, or only those in the 1-based inclusive
+	line ranges, in the order of the ranges. With an index, each range is
+	read with a seek and bounded reads
+	'''
+	if ranges is None:
+		f = open(tped, 'rb')
+		for line in f:
+			if line.strip():
+				yield line
+		f.close()
+		return
+
+	if index is not None:
+		offsets = index['offset']
+		f = open(tped, 'rb')
+		for first, last in ranges:
+			last = min(last, len(offsets) - 1)
+			for start in range(first - 1, last, CHUNK_SNPS):
+				end = min(start + CHUNK_SNPS, last)
+				f.seek(offsets[start])
+				for line in f.read(offsets[end] - offsets[start]).splitlines(True):
+					if line.strip():
+						yield line
+		f.close()
+		return
+
+	for first, last in ranges:
+		f = open(tped, 'rb')
+		for number, line in enumerate(f, 1):
+			if number > last:
+				break
+			if number >= first:
+				yield line
+		f.close()
+
+
+def chunks(lines, size=CHUNK_SNPS):
+	chunk = []
+	for line in lines:
+		chunk.append(line)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+def split_chunk(lines, n_indivs):
+	'''
+	Returns the 4 map columns of every line and a SNPs x 2*n_indivs array
+	of allele codes (single characters as uint8 when possible, else strings)
+	'''
+	meta = []
+	rest = []
+	for line in lines:
+		fields = line.split(None, 4)
+		if len(fields) < 5:
+			raise Exception('tped line without genotypes: %r' % line[:80])
+		meta.append([field.decode() for field in fields[:4]])
+		rest.append(fields[4].rstrip())
+
+	# fast path: single character alleles separated by single spaces or tabs
+	width = 4 * n_indivs - 1
+	if all(len(r) == width for r in rest):
+		alleles = np.frombuffer(b''.join(rest), dtype=np.uint8).reshape(len(rest), width)
+		if (np.isin(alleles[:, 1::2], (ord(' '), ord('\t')))).all():
+			return meta, alleles[:, ::2]
+
+	alleles = np.array([r.decode().split() for r in rest])
+	if alleles.ndim != 2 or alleles.shape[1] != 2 * n_indivs:
+		raise Exception('tped lines do not have 2 alleles for each of the %s individuals' % n_indivs)
+	return meta, alleles
+
+
+def encode_chunk(alleles, missing_allele):
+	'''
+	2-bit genotype codes (SNPs x individuals), allele names and per-SNP
+	missing rates and minor allele frequencies of a chunk of allele codes
+	'''
+	n_snps = alleles.shape[0]
+	rows = np.arange(n_snps)
+	missing = alleles == missing_allele
+
+	# the first and second allele seen in each row
+	first = alleles[rows, np.argmax(~missing, axis=1)]
+	is_first = (alleles == first[:, None]) & ~missing
+	other = ~missing & ~is_first
+	second = alleles[rows, np.argmax(other, axis=1)]
+	is_second = (alleles == second[:, None]) & other
+	if (other & ~is_second).any():
+		bad = np.flatnonzero((other & ~is_second).any(axis=1))
+		raise Exception('SNPs with more than 2 alleles at chunk rows %s' % bad[:10].tolist())
+
+	# genotypes with any missing allele are missing
+	missing_genotype = missing[:, ::2] | missing[:, 1::2]
+	n_called = (~missing_genotype).sum(axis=1)
+	count_first = (is_first[:, ::2] & ~missing_genotype).sum(axis=1) + (is_first[:, 1::2] & ~missing_genotype).sum(axis=1)
+	count_second = 2 * n_called - count_first
+
+	# A1 is the minor allele; on a tie the allele seen first stays A2
+	first_is_a1 = count_first < count_second
+	dose_first = is_first[:, ::2].astype(np.uint8) + is_first[:, 1::2]
+	dose_a1 = np.where(first_is_a1[:, None], dose_first, 2 - dose_first)
+
+	codes = np.choose(dose_a1, [HOM_A2, HET, HOM_A1]).astype(np.uint8)
+	codes[missing_genotype] = MISSING
+
+	has_second = other.any(axis=1)
+	a1 = np.where(first_is_a1, first, second)
+	a2 = np.where(first_is_a1, second, first)
+	a1 = np.where(has_second, a1, missing_allele)
+
+	with np.errstate(divide='ignore', invalid='ignore'):
+		maf = np.where(n_called > 0, np.minimum(count_first, count_second) / (2.0 * n_called), 0.0)
+	missing_rate = missing_genotype.mean(axis=1)
+	return codes, a1, a2, missing_rate, maf
+
+
+def pack_bed(codes):
+	'''
+	Packs SNPs x individuals 2-bit codes into SNP-major .bed rows, four
+	individuals per byte starting from the low bits
+	'''
+	n_snps, n_indivs = codes.shape
+	padded = np.zeros((n_snps, (n_indivs + 3) // 4 * 4), dtype=np.uint8)
+	padded[:, :n_indivs] = codes
+	# explicit shape: a chunk whose SNPs were all filtered out has no rows
+	padded = padded.reshape(n_snps, (n_indivs + 3) // 4, 4)
+	return (padded[:, :, 0] | (padded[:, :, 1] << 2) | (padded[:, :, 2] << 4) | (padded[:, :, 3] << 6)).astype(np.uint8)
+
+
+def allele_name(allele):
+	if isinstance(allele, (np.integer, int)):
+		return chr(allele)
+	return str(allele)
+
+
+def convert(tped, tfam, output, ranges=None, maf=0.05, geno=0.1, species='mouse', chunk_snps=CHUNK_SNPS):
+	'''
+	Writes output.bed/.bim/.fam from the tped/tfam pair (or the given line
+	ranges of the tped) keeping SNPs with missing rate <= geno and
+	MAF >= maf. Ranges are read through the tped's index if it has an
+	up to date one. Returns (SNPs read, SNPs written)
+	'''
+	index = None
+	if ranges is not None:
+		index = tped_index(tped, build=False)
+
+	shutil.copyfile(tfam, output + '.fam')
+	f = open(tfam)
+	n_indivs = sum(1 for line in f if line.strip())
+	f.close()
+
+	chrom_codes = species_chrom_codes.get(species, {})
+	n_read = 0
+	n_written = 0
+	bed = open(output + '.bed', 'wb')
+	bim = open(output + '.bim', 'w')
+	bed.write(BED_MAGIC)
+	for lines in chunks(tped_lines(tped, ranges, index), chunk_snps):
+		meta, alleles = split_chunk(lines, n_indivs)
+		missing_allele = ord(MISSING_ALLELE) if alleles.dtype == np.uint8 else MISSING_ALLELE
+		codes, a1, a2, missing_rate, freq = encode_chunk(alleles, missing_allele)
+
+		keep = np.flatnonzero((missing_rate <= geno) & (freq >= maf))
+		bed.write(pack_bed(codes[keep]).tobytes())
+		for i in keep:
+			chrom, snp, cm, bp = meta[i]
+			bim.write('%s\t%s\t%s\t%s\t%s\t%s\n' % (chrom_codes.get(chrom.upper(), chrom), snp, cm, bp, allele_name(a1[i]), allele_name(a2[i])))
+		n_read += len(lines)
+		n_written += len(keep)
+	bed.close()
+	bim.close()
+	return n_read, n_written
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='converts a .tped/.tfam pair to .bed/.bim/.fam (same filters as plink --maf/--geno)')
+	parser.add_argument('prefix', help='prefix of the .tped/.tfam files', action='store')
+	parser.add_argument('-o', '--output', dest='output', help='output prefix (default: the input prefix)',
+						default=None, action='store')
+	parser.add_argument('-r', '--range', dest='ranges', metavar='FIRST,LAST', nargs='+', help='only convert these 1-based tped line ranges',
+						default=None, action='store')
+	parser.add_argument('--maf', dest='maf', help='drop SNPs with a minor allele frequency below this',
+						default=0.05, type=float, action='store')
+	parser.add_argument('--geno', dest='geno', help='drop SNPs with a missing genotype rate above this',
+						default=0.1, type=float, action='store')
+	parser.add_argument('-s', '--species', dest='species', help='species for the chromosome codes',
+						default='mouse', action='store')
+	parser.add_argument('--index', dest='index', help='only (re)build the %s index of the tped' % INDEX_SUFFIX,
+						default=False, action='store_true')
+
+	args = parser.parse_args()
+
+	if args.index:
+		index = build_index(args.prefix + '.tped')
+		print('indexed %s SNPs' % len(index['snp']))
+		sys.exit(0)
+
+	ranges = parse_ranges(args.ranges) if args.ranges else None
+	n_read, n_written = convert(args.prefix + '.tped', args.prefix + '.tfam', args.output or args.prefix, ranges, args.maf, args.geno, args.species)
+	print('%s of %s SNPs passed the filters' % (n_written, n_read))
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+"""
+Leave-region-out kinship for --excludeByPosition
+
+K0 = G G' over the standardized .FULL SNPs is a sum of the contributions
+G_w G_w' of disjoint windows (whole chromosomes, or fixed bp windows on
+each chromosome). precompute_windows() writes every contribution once per
+dataset to <dataset>.window<w>.npy and their sum, with the windows' ranges,
+to <dataset>.windows.npz. Each job only gets the windows its tiles exclude
+(tile_windows). A job then tests each block
+against K0 minus the windows within EXCLUDE_BP of any SNP of the block,
+which only takes a subtraction, one eigendecomposition and a refit of the
+null model per distinct set of excluded windows instead of rebuilding K0
+from the genotypes. Excluding around the whole block rather than around
+each pair removes a little more than the 2Mb around the two tested SNPs.
+
+With the default of one window per chromosome this is leave-chromosome-out:
+a block is tested against K0 without the chromosomes of its SNPs. A block
+whose SNPs would exclude every window is split into sub-blocks of SNPs on
+one chromosome each (block_parts), which then exclude at most two
+chromosomes. A job keeps the models of its MAX_MODELS most recently used
+window sets.
+"""
+import os
+import json
+import atexit
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from fastlmm.inference.lmm import LMM
+
+from epistasis_kinship import load_inputs, model_inputs, inputs_current
+from epistasis_planner import block_pairs
+
+# filename formats
+WINDOWS_FILE = '.windows.npz'
+WINDOW_FILE = '.window%s.npy'
+
+# SNPs this close to a tested SNP are left out of K0
+EXCLUDE_BP = 2000000
+
+# leave-region-out models (N x N eigenvectors and a cache file each) a job keeps
+MAX_MODELS = 4
+
+
+def window_index(chrom, bp, window=None):
+	'''
+	(chromosome, window number) of every SNP; window None puts each
+	chromosome in a single window
+	'''
+	if not window:
+		return chrom, np.zeros(len(chrom))
+	return chrom, np.floor(bp / float(window))
+
+
+def window_file(prefix, w):
+	'''
+	File of the K0 contribution of window w, prefix being <path>/<dataset>
+	'''
+	return prefix + WINDOW_FILE % w
+
+
+def window_prefix(windows_file):
+	return windows_file[:-len(WINDOWS_FILE)] if windows_file.endswith(WINDOWS_FILE) else windows_file
+
+
+def excluded_windows(windows, chrom, bp, radius=EXCLUDE_BP):
+	'''
+	Windows (of a windows file's chrom/start/end) within radius of any of
+	the SNPs at chrom/bp
+	'''
+	excluded = []
+	for w in range(len(windows['chrom'])):
+		on_chrom = chrom == windows['chrom'][w]
+		if np.any((bp[on_chrom] + radius >= windows['start'][w]) & (bp[on_chrom] - radius < windows['end'][w])):
+			excluded.append(w)
+	return tuple(excluded)
+
+
+def read_windows(windows_file):
+	'''
+	Chromosome, bp range and SNP count of the windows of a windows file
+	'''
+	data = np.load(windows_file)
+	windows = dict((key, data[key]) for key in ['chrom', 'start', 'end', 'sid_count'])
+	data.close()
+	return windows
+
+
+def chromosome_runs(chrom, start, end):
+	'''
+	(start, end) of the runs of SNPs on one chromosome in start:end
+	'''
+	chrom = np.where(np.isnan(chrom[start:end]), -1, chrom[start:end])
+	bounds = [start] + [start + i for i in np.flatnonzero(chrom[1:] != chrom[:-1]) + 1] + [end]
+	return list(zip(bounds[:-1], bounds[1:]))
+
+
+def block_parts(windows, chrom, bp, block, radius=EXCLUDE_BP):
+	'''
+	The block (start0, end0, start1, end1) itself, or if excluding the
+	windows around all its SNPs would leave no SNP in K0, its sub-blocks
+	of SNPs on one chromosome each. chrom/bp are the positions of all
+	tested SNPs
+	'''
+	start0, end0, start1, end1 = block
+	snps = np.r_[start0:end0, start1:end1]
+	excluded = excluded_windows(windows, chrom[snps], bp[snps], radius)
+	if windows['sid_count'].sum() > windows['sid_count'][list(excluded)].sum():
+		return [block]
+	runs0 = chromosome_runs(chrom, start0, end0)
+	if start0 == start1:
+		parts = [run0 + run1 for i, run0 in enumerate(runs0) for run1 in runs0[i:]]
+	else:
+		parts = [run0 + run1 for run0 in runs0 for run1 in chromosome_runs(chrom, start1, end1)]
+	return [part for part in parts if block_pairs(part)]
+
+
+def window_sets(windows, tiles, chrom, bp, radius=EXCLUDE_BP):
+	'''
+	Distinct non-empty sets of windows excluded by the blocks (or block
+	parts) of the given tiles, in the order they are first needed
+	'''
+	sets = []
+	for tile in tiles:
+		for block in tile:
+			for start0, end0, start1, end1 in block_parts(windows, chrom, bp, block, radius):
+				snps = np.r_[start0:end0, start1:end1]
+				excluded = excluded_windows(windows, chrom[snps], bp[snps], radius)
+				if excluded and excluded not in sets:
+					sets.append(excluded)
+	return sets
+
+
+def tile_windows(windows_file, tiles, chrom, bp, radius=EXCLUDE_BP):
+	'''
+	Sorted windows excluded by any block of the given tiles, chrom/bp being
+	the positions of the tested SNPs
+	'''
+	excluded = set()
+	for windows in window_sets(read_windows(windows_file), tiles, chrom, bp, radius):
+		excluded.update(windows)
+	return sorted(excluded)
+
+
+def windows_current(windows_file, inputs):
+	'''
+	True if windows_file was written for inputs and all its window files exist
+	'''
+	if not inputs_current(windows_file, inputs):
+		return False
+	data = np.load(windows_file)
+	n_windows = len(data['chrom'])
+	data.close()
+	return all(os.path.exists(window_file(window_prefix(windows_file), w)) for w in range(n_windows))
+
+
+def windows_inputs(dataset, covFile=None, window=None, all_phenotypes=False):
+	'''
+	What the windows file depends on: the individuals (through the pheno
+	and covar files and options, as for the G0 file) and the window size
+	'''
+	return dict(model_inputs(dataset, covFile, all_phenotypes), window=window or 0)
+
+
+def precompute_windows(dataset, covFile=None, output_file=None, window=None, all_phenotypes=False):
+	'''
+	Writes the K0 contribution of every window of the .FULL SNPs to its
+	window_file and their sum (K), the windows' chromosome, bp range and SNP
+	count, the individuals, in the order of the G0 decomposition, and the
+	windows_inputs they were computed for to output_file. The window files
+	are written first, so a complete output_file has all of them
+	'''
+	if output_file is None:
+		output_file = dataset + WINDOWS_FILE
+	prefix = window_prefix(output_file)
+
+	inputs = windows_inputs(dataset, covFile, window, all_phenotypes)
+	test_snps, pheno, covar, G0 = load_inputs(dataset, covFile, all_phenotypes)
+	chrom, number = window_index(G0.pos[:, 0], G0.pos[:, 2], window)
+
+	# SNPs on unknown chromosomes form one window that is never excluded
+	keys, inverse = np.unique(np.column_stack([np.where(np.isnan(chrom), -1, chrom), np.where(np.isnan(number), 0, number)]),
+							  axis=0, return_inverse=True)
+	inverse = inverse.ravel()
+
+	K = np.zeros((G0.iid_count, G0.iid_count))
+	counts = []
+	for w in range(len(keys)):
+		idx = np.flatnonzero(inverse == w)
+		G = G0[:, idx].read().standardize().val
+		K_w = G.dot(G.T)
+		np.save(window_file(prefix, w), K_w)
+		K += K_w
+		counts.append(len(idx))
+	if window:
+		starts, ends = keys[:, 1] * window, (keys[:, 1] + 1) * window
+	else:
+		starts, ends = np.full(len(keys), -np.inf), np.full(len(keys), np.inf)
+
+	np.savez(output_file, K=K, chrom=keys[:, 0], start=starts, end=ends, sid_count=np.array(counts), window=window or 0, iid=G0.iid,
+			 inputs=json.dumps(inputs, sort_keys=True))
+	return output_file
+
+
+class WindowKinship(object):
+	'''
+	Factored K0 without the windows around a set of SNPs, with the null
+	model refitted for every phenotype column of Y. Results are cached by
+	the set of excluded windows, so blocks on the same chromosomes share
+	them; only the max_models most recently used are kept. Window
+	contributions are read from their window files when a model needs them.
+	Each model also gets an epistasis cache file in a temporary folder,
+	removed when the model is dropped, by close() or at exit
+	'''
+	def __init__(self, filename, kinship, Y, covar, radius=EXCLUDE_BP, min_log_delta=-5, max_log_delta=10, max_models=MAX_MODELS):
+		self.data = np.load(filename)
+		if not np.array_equal(self.data['iid'], kinship['iid']):
+			raise Exception('individuals in %s do not match the G0 decomposition' % filename)
+		self.prefix = window_prefix(filename)
+		self.iid = kinship['iid']
+		self.Y = Y
+		self.covar = covar
+		self.radius = radius
+		self.min_log_delta = min_log_delta
+		self.max_log_delta = max_log_delta
+		self.chrom = self.data['chrom']
+		self.start = self.data['start']
+		self.end = self.data['end']
+		self.sid_count = self.data['sid_count']
+		self.K = self.data['K']
+		self.max_models = max_models
+		self.models = OrderedDict()
+		self.n_models = 0
+		self.tempdir = None
+		atexit.register(self.close)
+
+	def excluded(self, chrom, bp):
+		'''
+		Windows within radius of any of the SNPs at chrom/bp
+		'''
+		return excluded_windows({'chrom': self.chrom, 'start': self.start, 'end': self.end}, chrom, bp, self.radius)
+
+	def parts(self, chrom, bp, block):
+		'''
+		block_parts of a block, chrom/bp being the positions of all tested SNPs
+		'''
+		return block_parts({'chrom': self.chrom, 'start': self.start, 'end': self.end, 'sid_count': self.sid_count}, chrom, bp, block, self.radius)
+
+	def model(self, chrom, bp):
+		'''
+		(kinship dict, log deltas, cache file) for testing the SNPs at
+		chrom/bp, None if no window is excluded and K0 stays as it is
+		'''
+		windows = self.excluded(chrom, bp)
+		if not windows:
+			return None
+		if windows in self.models:
+			self.models.move_to_end(windows)
+		else:
+			# the least recently used model and its cache file go first
+			while len(self.models) >= self.max_models:
+				os.remove(self.models.popitem(last=False)[1][2])
+			K = self.K.copy()
+			for w in windows:
+				if not os.path.exists(window_file(self.prefix, w)):
+					raise Exception('%s is missing, the job was not given the windows of its tiles' % window_file(self.prefix, w))
+				K -= np.load(window_file(self.prefix, w))
+			sid_count = int(self.sid_count.sum() - self.sid_count[list(windows)].sum())
+			if sid_count == 0:
+				raise Exception('no SNPs of K0 are left after excluding the windows around the block, use smaller groups or windows')
+
+			lmm = LMM()
+			lmm.setK(K)
+			lmm.setX(self.covar)
+			log_deltas = []
+			for j in range(self.Y.shape[1]):
+				lmm.sety(self.Y[:, j])
+				result = lmm.find_log_delta(REML=True, sid_count=sid_count, min_log_delta=self.min_log_delta, max_log_delta=self.max_log_delta)
+				log_deltas.append(float(result['log_delta']))
+
+			if self.tempdir is None:
+				self.tempdir = tempfile.mkdtemp(prefix='windows')
+			cache_file = os.path.join(self.tempdir, '%s.npz' % self.n_models)
+			self.n_models += 1
+			np.savez(cache_file, lmm.U, lmm.S)
+			kinship = {'U': lmm.U, 'S': lmm.S, 'log_delta': log_deltas[0], 'sid_count': sid_count, 'iid': self.iid}
+			self.models[windows] = (kinship, log_deltas, cache_file)
+		return self.models[windows]
+
+	def close(self):
+		if self.tempdir is not None:
+			shutil.rmtree(self.tempdir, ignore_errors=True)
+			self.tempdir = None
+		self.models = OrderedDict()
+		self.data.close()
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='writes the per-window K0 contributions used by --excludeByPosition')
+	parser.add_argument('dataset', help='dataset prefix (expects .FULL and .FILTERED beds)', action='store')
+	parser.add_argument('-c', '--covariate_file', dest='covFile', help='use covariate file',
+						default=None, action='store')
+	parser.add_argument('-o', '--output', dest='output', help='output file (default: dataset%s)' % WINDOWS_FILE,
+						default=None, action='store')
+	parser.add_argument('-w', '--window', dest='window', help='window size in bp (default: one window per chromosome)',
+						default=None, type=int, action='store')
+	parser.add_argument('-a', '--all-phenotypes', dest='all_phenotypes', help='individuals of a multi-phenotype run',
+						default=False, action='store_true')
+
+	args = parser.parse_args()
+
+	print('wrote %s' % precompute_windows(args.dataset, args.covFile, args.output, args.window, args.all_phenotypes))
@@ -17,6 +17,7 @@ from fastlmm.util.runner import LocalInParts
 import pysnptools.util
 from pysnptools.util.pheno import loadOnePhen
 from pysnptools.snpreader import Bed
+from epistasis_tped import convert, parse_ranges
 
 root = os.path.split(os.path.realpath(sys.argv[0]))[0]
 fastlmmc = './fastlmmc'
@@ -27,12 +28,9 @@ species_chroms = {'human':24, 'mouse':21}
 species_chroms = {'human':23, 'mouse':20}
 
 # filter out SNPs with MAF < 5%, missing genotype frequency > 10%; convert to binary format
-subset_tped_file = "sed -n '%(snp_range1)sp' %(dataset)s.tped > sub%(dataset)s.tped"
-subset_tped_file2 = "sed -n '%(snp_range2)sp' %(dataset)s.tped >> sub%(dataset)s.tped"
-subset_tped_file3 = "cp %(dataset)s.tfam sub%(dataset)s.tfam"
-make_bed_cmd = '%(plink_location)s --tfile sub%(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --make-bed --out %(dataset)s %(plink_species)s'
-# make_bed_cmd = '%(plink_location)s --tfile %(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --snps %(snp_range)s --make-bed --out %(dataset)s %(plink_species)s'
-make_bed_all_cmd = '%(plink_location)s --tfile %(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --make-bed --out all_%(dataset)s %(plink_species)s'
+# (epistasis_tped.convert, same filters as the former plink commands below)
+# make_bed_cmd = '%(plink_location)s --tfile sub%(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --make-bed --out %(dataset)s %(plink_species)s'
+# make_bed_all_cmd = '%(plink_location)s --tfile %(dataset)s --allow-no-sex --maf 0.05 --geno 0.1 --make-bed --out all_%(dataset)s %(plink_species)s'
 
 # calculate MAF and missing genotype frequency
 # make_maf_cmd = '%(plink_location)s --bfile %(dataset)s --allow-no-sex --snps %(snp_range)s --out %(dataset)s %(plink_species)s --freq'
@@ -81,15 +79,11 @@ def populate_available(dataset, species, snp_index):
 	tped, tfam, pheno, covar = ['%s%s' % (dataset, suffix) for suffix in ['.tped', '.tfam', '.pheno.txt', '.covar.txt']]
 	plink_species = ['', '--%s' % species][species != 'human']
 
-	# run plink commands
-	plink_location = plink
+	# convert both snp ranges of this job, and all snps for the kinship matrix
 	snp_range = open('snp_combos_%s.txt' % dataset).readlines()[snp_index].strip().split(';')
-	snp_range1 = snp_range[0]
-	snp_range2 = snp_range[1]
-	for cmd_template in (subset_tped_file, subset_tped_file2, subset_tped_file3, make_bed_cmd, make_bed_all_cmd):
-		cmd = cmd_template % locals()
-		print cmd
-		subprocess.check_call(cmd, shell=True, stderr=subprocess.STDOUT)
+	for output, ranges in ((dataset, parse_ranges(snp_range)), ('all_%s' % dataset, None)):
+		n_read, n_written = convert(tped, tfam, output, ranges, species=species)
+		print 'wrote %s.bed: %s of %s SNPs passed the filters' % (output, n_written, n_read)
 
 	chroms = map(str, range(1, species_chroms[species] + 1))
 	n_snps = int( subprocess.Popen(['wc', '-l', '%s.bim' % dataset], stdout=subprocess.PIPE).communicate()[0].split()[0] )
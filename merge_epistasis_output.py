@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""
+Merges the per-tile epistasis results of a dataset
+
+Streams over every <dataset>_<tile>.gwas file (each sorted by P, as written
+by epistasis_node.py) with a k-way merge, so memory only depends on the
+number of files open at once and on --top. Writes all pairs with
+P <= --threshold to one file sorted by P, the --top best pairs overall to
+a second file, and reports totals.
+
+Binary <dataset>_<tile>.epi.npy results are read memory-mapped; only the
+rows that pass the threshold or make the top list are turned into text,
+which needs the dataset's FILTERED .bim (--bim).
+"""
+import sys
+import os
+import re
+import heapq
+import tempfile
+import numpy as np
+
+from epistasis_results import GWAS_HEADER, BINARY_SUFFIX, read_results, format_rows
+
+# rows of a binary result formatted at a time
+FORMAT_CHUNK = 10000
+
+
+class UnsortedInput(Exception):
+	pass
+
+
+class Totals(object):
+	def __init__(self, top=0):
+		self.files = 0
+		self.pairs = 0
+		self.written = 0
+		self.min_p = None
+		self.top = top
+		self.best = []
+
+	def add(self, p, line):
+		self.pairs += 1
+		if self.min_p is None or p < self.min_p:
+			self.min_p = p
+		self.add_best(p, line)
+
+	def add_best(self, p, line):
+		# max-heap (by -p) of the best pairs seen so far
+		if self.top:
+			if len(self.best) < self.top:
+				heapq.heappush(self.best, (-p, line))
+			elif p < -self.best[0][0]:
+				heapq.heapreplace(self.best, (-p, line))
+
+	def add_records(self, records, bim):
+		'''
+		Counts a whole binary result; only its own top rows are formatted
+		'''
+		self.pairs += len(records)
+		if not len(records):
+			return
+		p = 10.0 ** -float(records['neglog10p'].max())
+		if self.min_p is None or p < self.min_p:
+			self.min_p = p
+		if self.top:
+			best = records[np.argsort(-records['neglog10p'], kind='stable')[:self.top]]
+			for line in format_rows(best, bim):
+				self.add_best(p_value(line), line)
+
+	def top_pairs(self):
+		return [line for p, line in sorted(self.best, reverse=True)]
+
+
+def p_value(line):
+	return float(line.rsplit('\t', 1)[1])
+
+
+def read_rows(filename, threshold, totals=None, presort=False):
+	'''
+	Yields (p, line) for rows with p <= threshold in order of p, counting
+	every row into totals. Without presort the file must already be sorted
+	'''
+	f = open(filename)
+	header = f.readline().rstrip('\r\n')
+	if header != GWAS_HEADER:
+		f.close()
+		raise Exception('%s does not look like an epistasis result file' % filename)
+	if totals is not None:
+		totals.files += 1
+
+	if presort:
+		# one tile at a time fits in memory
+		rows = []
+		for line in f:
+			p = p_value(line)
+			if totals is not None:
+				totals.add(p, line)
+			if p <= threshold:
+				rows.append((p, line))
+		f.close()
+		rows.sort()
+		for row in rows:
+			yield row
+		return
+
+	last = -1.0
+	for line in f:
+		p = p_value(line)
+		if p < last:
+			f.close()
+			raise UnsortedInput('%s is not sorted by P (rerun with --presort)' % filename)
+		last = p
+		if totals is not None:
+			totals.add(p, line)
+		if p <= threshold:
+			yield p, line
+	f.close()
+
+
+def read_binary_rows(filename, threshold, bim, totals=None):
+	'''
+	Same as read_rows for a binary result. Rows passing the threshold are
+	selected and sorted on the -log10 P column, so presort is not needed
+	'''
+	records = read_results(filename)
+	if totals is not None:
+		totals.files += 1
+		totals.add_records(records, bim)
+
+	with np.errstate(divide='ignore'):
+		keep = np.flatnonzero(records['neglog10p'] >= -np.log10(threshold))
+	keep = keep[np.argsort(-records['neglog10p'][keep], kind='stable')]
+	for i in range(0, len(keep), FORMAT_CHUNK):
+		for line in format_rows(records[keep[i:i + FORMAT_CHUNK]], bim):
+			yield p_value(line), line
+
+
+def open_rows(filename, threshold, totals=None, presort=False, bim=None):
+	if filename.endswith(BINARY_SUFFIX):
+		if bim is None:
+			raise Exception('%s is a binary result, the dataset .bim file is needed to merge it' % filename)
+		return read_binary_rows(filename, threshold, bim, totals)
+	return read_rows(filename, threshold, totals, presort)
+
+
+def write_merged(output, streams):
+	'''
+	k-way merge of (p, line) streams into output, returns the number of rows
+	'''
+	n = 0
+	out = open(output, 'w')
+	out.write(GWAS_HEADER + '\n')
+	for p, line in heapq.merge(*streams):
+		out.write(line)
+		n += 1
+	out.close()
+	return n
+
+
+def merge_outputs(files, output, threshold=1.0, top=0, max_open=256, tmpdir=None, presort=False, bim=None):
+	'''
+	Merges the result files into output (pairs with P <= threshold, sorted)
+	and returns the Totals, whose top_pairs() holds the best top pairs.
+	Files are merged max_open at a time into temporary runs, which are then
+	merged the same way. bim (from epistasis_results.load_bim) is needed for
+	binary results
+	'''
+	totals = Totals(top)
+	if tmpdir is None:
+		tmpdir = os.path.dirname(os.path.abspath(output))
+
+	runs = []
+	level = [(filename, True) for filename in files]
+	try:
+		while len(level) > max_open:
+			next_level = []
+			for i in range(0, len(level), max_open):
+				batch = level[i:i + max_open]
+				fd, run = tempfile.mkstemp(suffix='.gwas', prefix='merge_', dir=tmpdir)
+				os.close(fd)
+				runs.append(run)
+				write_merged(run, [open_rows(filename, threshold, [None, totals][first], presort and first, bim) for filename, first in batch])
+				next_level.append((run, False))
+			level = next_level
+
+		totals.written = write_merged(output, [open_rows(filename, threshold, [None, totals][first], presort and first, bim) for filename, first in level])
+	finally:
+		for run in runs:
+			os.remove(run)
+
+	return totals
+
+
+def tile_files(output_dir, dataset):
+	pattern = re.compile(r'^%s_(\d+)(\.gwas|%s)$' % (re.escape(dataset), re.escape(BINARY_SUFFIX)))
+	matches = [pattern.match(name) for name in os.listdir(output_dir)]
+	matches = sorted((int(m.group(1)), m.group(0)) for m in matches if m)
+	return [os.path.join(output_dir, name) for tile_id, name in matches]
+
+
+if __name__ == '__main__':
+	from argparse import ArgumentParser
+	parser = ArgumentParser(description='merges the per-tile epistasis results of a dataset')
+	parser.add_argument('dataset', help='dataset prefix of the result files', action='store')
+	parser.add_argument('-i', '--inputdir', dest='inputdir', help='folder with the <dataset>_<tile>.gwas/.epi.npy files',
+						default='.', action='store')
+	parser.add_argument('-o', '--output', dest='output', help='merged output (default: <inputdir>/<dataset>.merged.gwas)',
+						default=None, action='store')
+	parser.add_argument('-p', '--threshold', dest='threshold', help='keep pairs with P at or below this',
+						default=1e-5, type=float, action='store')
+	parser.add_argument('-k', '--top', dest='top', help='also write the K best pairs to <output>.top',
+						default=1000, type=int, action='store')
+	parser.add_argument('--max-open', dest='max_open', help='maximum number of files merged at once',
+						default=256, type=int, action='store')
+	parser.add_argument('--presort', dest='presort', help='sort each input file in memory first (for unsorted results)',
+						default=False, action='store_true')
+	parser.add_argument('-b', '--bim', dest='bim', help='<dataset>.FILTERED.bim, needed for binary results',
+						default=None, action='store')
+
+	args = parser.parse_args()
+
+	output = args.output or os.path.join(args.inputdir, '%s.merged.gwas' % args.dataset)
+	files = tile_files(args.inputdir, args.dataset)
+	if not files:
+		sys.exit('no %s_<tile>.gwas or %s_<tile>%s files found in %s' % (args.dataset, args.dataset, BINARY_SUFFIX, args.inputdir))
+
+	bim = None
+	if args.bim:
+		from epistasis_results import load_bim
+		bim = load_bim(args.bim)
+
+	totals = merge_outputs(files, output, args.threshold, args.top, args.max_open, presort=args.presort, bim=bim)
+
+	if args.top:
+		f = open(output + '.top', 'w')
+		f.write(GWAS_HEADER + '\n')
+		f.write(''.join(totals.top_pairs()))
+		f.close()
+
+	print('files merged:\t%s' % totals.files)
+	print('pairs tested:\t%s' % totals.pairs)
+	print('pairs with P <= %g:\t%s' % (args.threshold, totals.written))
+	print('smallest P:\t%s' % totals.min_p)
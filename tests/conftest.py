@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+# the epistasis_*.py scripts are run from the repository root, not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+	'''
+	Prefix of a tiny synthetic dataset (.FULL/.FILTERED beds, pheno and covar)
+	'''
+	from epistasis_benchmark import generate_dataset
+	return generate_dataset(str(tmp_path_factory.mktemp('data')), 'd', n_indivs=80, n_snps=30, n_chroms=2, n_causal=10, n_covariates=2)
+
+
+def tile_frames(tiles, seed=0):
+	'''
+	Random results of every pair of each tile, SNP i being rs<i> at 1000 * (i + 1) bp
+	'''
+	import numpy as np
+	import pandas as pd
+	from epistasis_results import GWAS_COLUMNS
+
+	rng = np.random.RandomState(seed)
+	frames = []
+	for tile in tiles:
+		rows = []
+		for start0, end0, start1, end1 in tile:
+			for i in range(start0, end0):
+				for j in range(start1, end1):
+					if start0 != start1 or i < j:
+						rows.append(('rs%s' % i, 1.0, 1000.0 * (i + 1), 'rs%s' % j, 1.0, 1000.0 * (j + 1), rng.uniform() ** 3))
+		frames.append(pd.DataFrame(rows, columns=GWAS_COLUMNS))
+	return frames
+
+
+def write_tile_results(output_dir, name, tile_id, frame, output_format='text'):
+	'''
+	A tile's results as the node writes them, sorted by P
+	'''
+	from epistasis_results import BINARY_SUFFIX, write_results, load_bim
+
+	frame = frame.sort_values(by='P')
+	if output_format == 'binary':
+		sid = list(load_bim(os.path.join(output_dir, 'd.FILTERED.bim'))['sid'])
+		write_results(os.path.join(output_dir, '%s_%s%s' % (name, tile_id, BINARY_SUFFIX)),
+					  [sid.index(s) for s in frame['SNP1']], [sid.index(s) for s in frame['SNP2']], frame['P'])
+	else:
+		frame.to_csv(os.path.join(output_dir, '%s_%s.gwas' % (name, tile_id)), sep='\t', index=False)
+
+
+@pytest.fixture
+def write_tile():
+	return write_tile_results
+
+
+@pytest.fixture
+def results(tmp_path):
+	'''
+	Plan and bim of 12 SNPs in groups of 4, and random results of its tiles
+	'''
+	from epistasis_planner import make_plan, write_plan
+
+	tiles = make_plan(12, 4)
+	write_plan(str(tmp_path / 'd.plan.txt'), tiles, 12, 4)
+	bim = open(str(tmp_path / 'd.FILTERED.bim'), 'w')
+	for i in range(12):
+		bim.write('1\trs%s\t0\t%s\tA\tG\n' % (i, 1000 * (i + 1)))
+	bim.close()
+	return tmp_path, tiles, tile_frames(tiles)
@@ -0,0 +1,34 @@
+import os
+import glob
+import shutil
+import subprocess
+import sys
+
+from epistasis_dag import validate_dag
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_dag_is_valid_once_prep_has_run(dataset, tmp_path):
+	# the server writes its files next to itself and reads data/ there
+	root = tmp_path / 'epistasis'
+	os.makedirs(str(root / 'data'))
+	for filename in glob.glob(os.path.join(ROOT, 'epistasis_*.py')) + [os.path.join(ROOT, 'merge_epistasis_output.py')]:
+		shutil.copy(filename, str(root))
+	for filename in glob.glob(dataset + '.*'):
+		shutil.copy(filename, str(root / 'data'))
+
+	# an argument the prep node's shell has to keep in one piece
+	server = [sys.executable, str(root / 'epistasis_server.py'), 'd', '--engine', 'numpy', '-g', '10', '-o', str(tmp_path / 'the results')]
+	subprocess.check_call(server + ['--dag', '--no-submit'], cwd=str(root))
+	dag_file = str(root / 'epistasis_d.dag')
+	compute_sub = str(root / 'epistasis_d.sub')
+	# the compute submit file is written by the prep node
+	assert not os.path.exists(compute_sub)
+	assert [problem for problem in validate_dag(dag_file) if compute_sub in problem]
+	assert validate_dag(dag_file, generated=[compute_sub]) == []
+
+	subprocess.check_call(['bash', str(root / 'epistasis_d.prep.sh')], cwd=str(tmp_path))
+	assert os.path.exists(compute_sub)
+	assert validate_dag(dag_file) == []
+	assert str(tmp_path / 'the results') in open(compute_sub).read()
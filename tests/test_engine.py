@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from epistasis_planner import block_pairs
+
+
+@pytest.mark.parametrize('covariates', [False, True])
+def test_numpy_engine_matches_fastlmm(dataset, covariates, tmp_path, monkeypatch):
+	epistasis = pytest.importorskip('fastlmm.association').epistasis
+	# fastlmm leaves its cache in .working/ of the current folder
+	monkeypatch.chdir(tmp_path)
+	from epistasis_kinship import load_inputs, compute_kinship
+	from epistasis_engine import epistasis_numpy
+
+	covFile = [None, dataset + '.covar.txt'][covariates]
+	test_snps, pheno, covar, G0 = load_inputs(dataset, covFile)
+	kinship = compute_kinship(pheno, covar, G0)
+	sid = test_snps.sid
+	# an off-diagonal and a diagonal block
+	for sid_list_0, sid_list_1 in [(sid[:10], sid[10:20]), (sid[20:], sid[20:])]:
+		ours = epistasis_numpy(test_snps, pheno, covar, kinship, sid_list_0, sid_list_1)
+		theirs = epistasis(test_snps, pheno, G0=G0, covar=covFile, sid_list_0=sid_list_0, sid_list_1=sid_list_1, log_delta=kinship['log_delta'])
+		assert len(ours) == len(theirs) == block_pairs((0, len(sid_list_0), [len(sid_list_0), 0][sid_list_0[0] == sid_list_1[0]], len(sid_list_0) + len(sid_list_1)))
+		both = ours.merge(theirs, on=['SNP0', 'SNP1'])
+		assert len(both) == len(ours)
+		np.testing.assert_allclose(both['PValue_x'], both['PValue_y'], rtol=1e-8)
+
+
+def test_phenotypes_share_one_pass(tmp_path_factory):
+	from epistasis_benchmark import generate_dataset
+	from epistasis_kinship import load_inputs, compute_kinship, pheno_keys
+	from epistasis_engine import epistasis_numpy, epistasis_numpy_multi
+
+	dataset = generate_dataset(str(tmp_path_factory.mktemp('multi')), 'm', n_indivs=60, n_snps=20, n_chroms=2, n_causal=8, n_phenotypes=3)
+	test_snps, pheno, covar, G0 = load_inputs(dataset, all_phenotypes=True)
+	kinship = compute_kinship(pheno, covar, G0)
+	assert list(kinship['phenotypes']) == ['t1', 't2', 't3'] and pheno_keys(kinship['phenotypes']) == ['0', '1', '2']
+	sid = test_snps.sid
+	frames = epistasis_numpy_multi(test_snps, pheno['vals'], covar, kinship, kinship['log_deltas'], sid[:8], sid[8:])
+	assert len(frames) == 3
+	# each column as if it were the only phenotype, with its own null model
+	for j, multi in enumerate(frames):
+		single = {'vals': pheno['vals'][:, j], 'iid': pheno['iid']}
+		single_kinship = compute_kinship(single, covar, G0)
+		assert single_kinship['log_delta'] == pytest.approx(kinship['log_deltas'][j])
+		both = multi.merge(epistasis_numpy(test_snps, single, covar, single_kinship, sid[:8], sid[8:]), on=['SNP0', 'SNP1'])
+		assert len(both) == len(multi) == 96
+		# the residual sums differ in rounding, which shows most at P near 1
+		np.testing.assert_allclose(both['PValue_x'], both['PValue_y'], rtol=1e-6)
+
+
+def test_float32_stays_close_to_float64(dataset, tmp_path):
+	from epistasis_kinship import load_inputs, compute_kinship, precompute_kinship, load_kinship
+	from epistasis_engine import epistasis_numpy_multi
+
+	test_snps, pheno, covar, G0 = load_inputs(dataset, dataset + '.covar.txt')
+	kinship = compute_kinship(pheno, covar, G0)
+	kinship32 = compute_kinship(pheno, covar, G0, dtype=np.float32)
+	assert kinship32['log_delta'] == pytest.approx(kinship['log_delta'], abs=1e-3)
+
+	kinship_file = precompute_kinship(dataset, dataset + '.covar.txt', str(tmp_path / 'd.kinship.npz'))
+	loaded = load_kinship(kinship_file, dtype=np.float32)
+	assert loaded['U'].dtype == np.float32 and loaded['S'].dtype == np.float64
+	np.testing.assert_array_equal(loaded['U'], load_kinship(kinship_file)['U'].astype(np.float32))
+
+	sid = test_snps.sid
+	y = pheno['vals'][:, None]
+	for sid_list_0, sid_list_1 in [(sid[:15], sid[15:]), (sid[:15], sid[:15])]:
+		p64 = epistasis_numpy_multi(test_snps, y, covar, kinship, [kinship['log_delta']], sid_list_0, sid_list_1)[0]
+		p32 = epistasis_numpy_multi(test_snps, y, covar, loaded, [kinship['log_delta']], sid_list_0, sid_list_1, dtype=np.float32)[0]
+		both = p64.merge(p32, on=['SNP0', 'SNP1'])
+		assert len(both) == len(p64) == len(p32)
+		assert np.abs(np.log10(both['PValue_x']) - np.log10(both['PValue_y'])).max() < 1e-3
+		# no pair crosses a reporting threshold
+		for threshold in [1e-3, 1e-2, 0.05]:
+			assert ((both['PValue_x'] <= threshold) == (both['PValue_y'] <= threshold)).all()
@@ -0,0 +1,39 @@
+import os
+
+from epistasis_summary import summarize_pvalues, write_summary, summary_file
+from epistasis_manifest import update_manifest, pending_tiles
+
+
+def test_manifest_tracks_tiles(results, write_tile):
+	tmp_path, tiles, frames = results
+	output_dir = str(tmp_path / 'out')
+	os.mkdir(output_dir)
+	plan_file = str(tmp_path / 'd.plan.txt')
+	# tile 0 complete, tile 1 thresholded with its summary, tile 2 truncated, the rest missing
+	write_tile(output_dir, 'd', 0, frames[0])
+	write_tile(output_dir, 'd', 1, frames[1][frames[1]['P'] <= 0.1])
+	write_summary(summary_file(output_dir, 'd', 1), summarize_pvalues(frames[1]['P'], 0.1))
+	write_tile(output_dir, 'd', 2, frames[2].iloc[:-1])
+
+	manifest = update_manifest(output_dir, 'd', plan_file)
+	assert [manifest[tile_id]['status'] for tile_id in range(3)] == ['done', 'done', 'corrupt']
+	assert pending_tiles(manifest) == list(range(2, len(tiles)))
+
+	# a rewritten tile is checked again, a done one is taken from the manifest
+	write_tile(output_dir, 'd', 2, frames[2])
+	os.remove(os.path.join(output_dir, 'd_0.gwas'))
+	manifest = update_manifest(output_dir, 'd', plan_file, excluded=[3])
+	assert [manifest[tile_id]['status'] for tile_id in range(4)] == ['missing', 'done', 'done', 'excluded']
+	assert pending_tiles(manifest) == [0] + list(range(4, len(tiles)))
+
+
+def test_failure_marker_names_its_tiles(results, write_tile):
+	tmp_path, tiles, frames = results
+	output_dir = str(tmp_path / 'out')
+	os.mkdir(output_dir)
+	# the job of tiles 0-1+3 failed after writing tile 0
+	write_tile(output_dir, 'd', 0, frames[0])
+	open(os.path.join(output_dir, 'd_0-1+3.failed'), 'w').close()
+	manifest = update_manifest(output_dir, 'd', str(tmp_path / 'd.plan.txt'))
+	assert [manifest[tile_id]['status'] for tile_id in range(5)] == ['done', 'failed', 'missing', 'failed', 'missing']
+	assert pending_tiles(manifest) == list(range(1, len(tiles)))
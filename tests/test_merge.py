@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from epistasis_results import GWAS_COLUMNS, load_bim, read_results, pvalues
+from merge_epistasis_output import merge_outputs, tile_files, p_value
+
+
+def test_text_merge(results, write_tile):
+	tmp_path, tiles, frames = results
+	for tile_id, frame in enumerate(frames):
+		write_tile(str(tmp_path), 'd', tile_id, frame)
+	files = tile_files(str(tmp_path), 'd')
+	assert len(files) == len(tiles)
+	# max_open=2 also merges through temporary runs
+	totals = merge_outputs(files, str(tmp_path / 'merged.gwas'), threshold=0.5, top=5, max_open=2)
+
+	expected = pd.concat(frames).sort_values(by='P')
+	assert totals.pairs == 66 and totals.min_p == expected['P'].min()
+	np.testing.assert_allclose([p_value(line) for line in totals.top_pairs()], expected['P'][:5], rtol=1e-12)
+	merged = pd.read_csv(str(tmp_path / 'merged.gwas'), sep='\t')
+	expected = expected[expected['P'] <= 0.5]
+	assert list(merged.columns) == GWAS_COLUMNS
+	assert list(merged['SNP1'] + merged['SNP2']) == list(expected['SNP1'] + expected['SNP2'])
+	np.testing.assert_allclose(merged['P'], expected['P'], rtol=1e-12)
+
+
+def test_binary_results_round_trip(tmp_path):
+	from epistasis_results import write_results
+
+	p = np.array([1e-30, 0.2, 1.0, 3e-6])
+	write_results(str(tmp_path / 'd_0.epi.npy'), [0, 1, 2, 3], [4, 5, 6, 7], p)
+	records = read_results(str(tmp_path / 'd_0.epi.npy'))
+	assert list(records['snp0']) == [0, 1, 2, 3] and list(records['snp1']) == [4, 5, 6, 7]
+	# -log10 P is kept as float32
+	np.testing.assert_allclose(pvalues(records), p, rtol=1e-5)
+
+
+def test_text_and_binary_merge_agree(results, write_tile):
+	tmp_path, tiles, frames = results
+	merged = {}
+	for output_format in ['text', 'binary']:
+		output_dir = tmp_path / output_format
+		output_dir.mkdir()
+		os.symlink(str(tmp_path / 'd.FILTERED.bim'), str(output_dir / 'd.FILTERED.bim'))
+		for tile_id, frame in enumerate(frames):
+			write_tile(str(output_dir), 'd', tile_id, frame, output_format)
+		bim = load_bim(str(output_dir / 'd.FILTERED.bim'))
+		totals = merge_outputs(tile_files(str(output_dir), 'd'), str(output_dir / 'merged.gwas'), threshold=0.5, top=5, max_open=2, bim=bim)
+		assert totals.pairs == 66 and len(totals.top_pairs()) == 5
+		merged[output_format] = pd.read_csv(str(output_dir / 'merged.gwas'), sep='\t')
+
+	text, binary = merged['text'], merged['binary']
+	assert list(binary.columns) == GWAS_COLUMNS and len(text) == len(binary)
+	assert list(text['SNP1'] + text['SNP2']) == list(binary['SNP1'] + binary['SNP2'])
+	np.testing.assert_allclose(binary['P'], text['P'], rtol=1e-5)
+	assert (np.diff(binary['P']) >= 0).all()
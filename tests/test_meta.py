@@ -0,0 +1,32 @@
+import glob
+import os
+import shutil
+
+from epistasis_meta import read_meta, meta_file, check_meta
+
+
+def test_meta_is_computed_once_and_checked(dataset, tmp_path, monkeypatch):
+	from pysnptools.snpreader import Bed
+
+	for filename in glob.glob(dataset + '.F*'):
+		shutil.copy(filename, str(tmp_path))
+	meta = read_meta(str(tmp_path), 'd')
+	assert (meta['n_indivs'], meta['n_snps'], meta['n_full_snps']) == (80, 30, 30)
+	assert meta['chromosomes'] == [['1', 0, 15], ['2', 15, 15]]
+
+	# read again from the file while the beds are unchanged
+	os.utime(meta_file(str(tmp_path), 'd'), (0, 0))
+	assert read_meta(str(tmp_path), 'd') == meta
+	assert os.path.getmtime(meta_file(str(tmp_path), 'd')) == 0
+
+	# a job checks its readers and .bim/.fam against it
+	monkeypatch.chdir(tmp_path)
+	reader = Bed('d.FILTERED', count_A1=False)
+	assert check_meta(meta, 'd', reader, reader, {'n_snps': 30}) == []
+	assert len(check_meta(meta, 'd', reader[:, :20], plan_info={'n_snps': 20})) == 2
+	f = open('d.FILTERED.bim', 'a')
+	f.write('2\trs30\t0\t1\tA\tG\n')
+	f.close()
+	assert check_meta(meta, 'd') == ['d.FILTERED.bim differs from the file the metadata was computed from']
+	# and the server rescans the changed beds
+	assert read_meta(str(tmp_path), 'd')['n_snps'] == 31
@@ -0,0 +1,51 @@
+import os
+
+from epistasis_monitor import update_monitor, read_state, job_tiles, monitor_report, finished
+
+EVENTS = '''000 (123.000.000) 2024-01-31 10:00:00 Job submitted from host: <10.0.0.1:9618>
+    tiles 0-1+3
+...
+000 (123.001.000) 2024-01-31 10:00:01 Job submitted from host: <10.0.0.1:9618>
+    tiles 4
+...
+001 (123.000.000) 2024-01-31 10:01:00 Job executing on host: <10.0.0.2:9618?addrs=10.0.0.2-9618>
+...
+001 (123.001.000) 2024-01-31 10:01:05 Job executing on host: <10.0.0.3:9618>
+...
+004 (123.001.000) 2024-01-31 10:02:00 Job was evicted.
+	(0) Job was not checkpointed.
+...
+012 (123.001.000) 2024-01-31 10:03:00 Job was held.
+	Error from slot1@node3: memory usage exceeded request_memory
+	Code 34 Subcode 0
+...
+005 (123.000.000) 2024-01-31 10:05:00 Job terminated.
+	(1) Normal termination (return value 0)
+...
+'''
+
+
+def test_monitor_follows_the_user_log(tmp_path):
+	log = str(tmp_path / 'epistasis_123.log')
+	# the last event is still being written
+	f = open(log, 'w')
+	f.write(EVENTS + '013 (123.001.000) 2024-01-31 10:10:00 Job was released.\n')
+	f.close()
+	state = update_monitor(str(tmp_path))
+	jobs = state['jobs']
+	assert jobs['123.0']['status'] == 'completed' and jobs['123.0']['exit_code'] == 0 and jobs['123.0']['host'] == '10.0.0.2:9618?addrs=10.0.0.2-9618'
+	assert jobs['123.0']['ended'] - jobs['123.0']['started'] == 240
+	assert jobs['123.1']['status'] == 'held' and jobs['123.1']['evictions'] == 1
+	assert jobs['123.1']['hold_reason'] == 'Error from slot1@node3: memory usage exceeded request_memory Code 34 Subcode 0'
+	assert job_tiles(str(tmp_path), state) == {'123.0': '0-1+3', '123.1': '4'}
+	assert not finished(state)
+	assert any('123.1 (tiles 4)' in line for line in monitor_report(state, job_tiles(str(tmp_path), state)))
+
+	# the next call starts at the unfinished event
+	f = open(log, 'a')
+	f.write('...\n005 (123.001.000) 2024-01-31 10:20:00 Job terminated.\n\t(0) Abnormal termination (signal 9)\n...\n')
+	f.close()
+	state = update_monitor(str(tmp_path))
+	assert state['offsets']['epistasis_123.log'] == os.path.getsize(log)
+	assert state['jobs']['123.1']['status'] == 'completed' and state['jobs']['123.1']['signal'] == 9
+	assert finished(read_state(str(tmp_path)))
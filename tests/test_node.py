@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def job(dataset, tmp_path, monkeypatch):
+	'''
+	Node module, inputs and null model of the generated dataset, as a job sets them up
+	'''
+	epistasis_node = pytest.importorskip('epistasis_node')
+	# fastlmm leaves its cache in .working/ of the current folder
+	monkeypatch.chdir(tmp_path)
+	from epistasis_kinship import load_inputs, compute_kinship
+
+	test_snps, pheno, covar, G0 = load_inputs(dataset)
+	kinship = compute_kinship(pheno, covar, G0)
+	inputs = {'reader': test_snps, 'G0': G0, 'covar': None, 'phenos': [pheno],
+			  'test_snps': test_snps, 'Y': pheno['vals'][:, None], 'covar_data': covar}
+	model = {'kinship': kinship, 'log_deltas': [kinship['log_delta']], 'fastlmm_args': [{'log_delta': kinship['log_delta']}]}
+	return epistasis_node, inputs, model
+
+
+def test_screen_gives_candidates_the_full_test(job):
+	epistasis_node, inputs, model = job
+	block = (0, 10, 10, 25)
+	(full,), counts = epistasis_node.test_block(inputs, model, block, engine='fastlmm')
+	(approximate,), counts = epistasis_node.test_block(inputs, model, block, engine='numpy')
+	(screened,), (full_tests,) = epistasis_node.test_block(inputs, model, block, screen=0.2)
+
+	candidates = approximate[approximate['PValue'] <= 0.2]
+	assert 0 < full_tests == len(candidates) < len(approximate)
+	assert len(screened) == len(full) == 150
+	both = screened.merge(full, on=['SNP0', 'SNP1']).merge(approximate, on=['SNP0', 'SNP1'])
+	tested = both['PValue'] <= 0.2
+	np.testing.assert_allclose(both['PValue_x'][tested], both['PValue_y'][tested], rtol=1e-10)
+	np.testing.assert_array_equal(both['PValue_x'][~tested], both['PValue'][~tested])
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from epistasis_planner import make_plan, block_pairs
+from epistasis_shards import open_bed
+from epistasis_pairs import load_positions, distance_mask, block_keep, excluded_pairs, drop_excluded, block_excluded, excluded_tiles
+
+
+def test_distance_exclusion(dataset):
+	snps = open_bed(dataset + '.FILTERED', count_A1=False)
+	chrom, bp = load_positions(dataset + '.FILTERED')
+	np.testing.assert_array_equal(chrom, snps.pos[:, 0])
+	np.testing.assert_array_equal(bp, snps.pos[:, 2])
+	# SNPs are evenly spaced: the two on each side of a SNP on its chromosome
+	distance = 2.5 * (bp[1] - bp[0])
+	for start0, end0, start1, end1 in [(0, 10, 0, 10), (0, 10, 10, 20), (10, 20, 20, 30)]:
+		keep = block_keep(snps, start0, end0, start1, end1, distance=distance)
+		np.testing.assert_array_equal(keep, ~distance_mask(chrom[start0:end0], bp[start0:end0], chrom[start1:end1], bp[start1:end1], distance))
+		i, j = np.indices(keep.shape)
+		near = (chrom[start0 + i] == chrom[start1 + j]) & (np.abs(start0 + i - start1 - j) <= 2)
+		np.testing.assert_array_equal(keep, ~near)
+		assert excluded_pairs(keep, start0 == start1) == [near.sum(), np.triu(near, 1).sum()][start0 == start1]
+
+	assert [block_excluded(chrom, bp, block, distance) for block in [(0, 3, 0, 3), (0, 3, 3, 6), (12, 15, 15, 18)]] == [True, False, False]
+	# with no limit on the distance, exactly the tiles within one chromosome are skipped
+	tiles = make_plan(30, 5)
+	one_chromosome = [tile_id for tile_id, tile in enumerate(tiles) if len(set(chrom[np.r_[tile[0][0]:tile[0][1], tile[0][2]:tile[0][3]]])) == 1]
+	assert one_chromosome and excluded_tiles(tiles, chrom, bp, 1e12) == one_chromosome
+
+
+def test_r2_exclusion(dataset):
+	snps = open_bed(dataset + '.FILTERED', count_A1=False)
+	A = snps[:, :10].read().standardize().val
+	r2 = (A.T.dot(A) / len(A)) ** 2
+	threshold = np.median(r2[np.triu_indices(10, 1)])
+	keep = block_keep(snps, 0, 10, 0, 10, r2=threshold)
+	np.testing.assert_array_equal(keep, r2 <= threshold)
+
+	sid = snps.sid
+	df = pd.DataFrame([(sid[i], sid[j], 0.5) for i in range(10) for j in range(i + 1, 10)], columns=['SNP0', 'SNP1', 'PValue'])
+	kept = drop_excluded(df, keep, sid[:10], sid[:10])
+	assert len(kept) == block_pairs((0, 10, 0, 10)) - excluded_pairs(keep, True)
+	assert all(keep[list(sid).index(snp0), list(sid).index(snp1)] for snp0, snp1 in zip(kept['SNP0'], kept['SNP1']))
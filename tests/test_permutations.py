@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from epistasis_permutations import permutation_file, write_minima, read_minima, genome_wide_minima, permutation_thresholds
+
+
+def test_block_minima_are_the_smallest_pair_p(dataset):
+	from epistasis_kinship import load_inputs, compute_kinship
+	from epistasis_engine import epistasis_numpy_multi, epistasis_permutations, permutation_indices, permuted_phenotypes
+	from epistasis_pairs import drop_excluded
+
+	test_snps, pheno, covar, G0 = load_inputs(dataset, dataset + '.covar.txt')
+	kinship = compute_kinship(pheno, covar, G0)
+	delta = np.exp(kinship['log_delta']) * kinship['sid_count']
+	y = pheno['vals']
+	# the identity permutation gives back the phenotype
+	identity = permuted_phenotypes(y, covar, kinship['U'], kinship['S'], delta, np.arange(len(y))[None, :])
+	np.testing.assert_allclose(identity[:, 0], y, atol=1e-8)
+
+	permuted = permuted_phenotypes(y, covar, kinship['U'], kinship['S'], delta, permutation_indices(len(y), 6, seed=1))
+	assert permuted.shape == (len(y), 6)
+	sid = test_snps.sid
+	keep = np.random.RandomState(2).uniform(size=(10, 10)) < 0.7
+	for sid_list_0, sid_list_1, block_keep in [(sid[:10], sid[10:20], None), (sid[:10], sid[10:20], keep), (sid[20:], sid[20:], None)]:
+		minima = epistasis_permutations(test_snps, permuted, covar, kinship, kinship['log_delta'], sid_list_0, sid_list_1, block_keep)
+		frames = epistasis_numpy_multi(test_snps, permuted, covar, kinship, [kinship['log_delta']] * 6, sid_list_0, sid_list_1)
+		if block_keep is not None:
+			frames = [drop_excluded(df, block_keep, sid_list_0, sid_list_1) for df in frames]
+		np.testing.assert_allclose(minima, [df['PValue'].min() for df in frames], rtol=1e-6)
+
+
+def test_genome_wide_thresholds(tmp_path):
+	rng = np.random.RandomState(0)
+	tiles = rng.uniform(size=(5, 200))
+	for tile_id in [0, 1, 2, 4]:
+		write_minima(permutation_file(str(tmp_path), 'd', tile_id), tiles[tile_id])
+	minima = read_minima(str(tmp_path), 'd')
+	assert sorted(minima) == [0, 1, 2, 4]
+
+	genome_minima = genome_wide_minima(minima, n_tiles=5, skip=[3])
+	np.testing.assert_array_equal(genome_minima, tiles[[0, 1, 2, 4]].min(0))
+	assert permutation_thresholds(genome_minima, [0.05]) == [(0.05, np.percentile(genome_minima, 5))]
+	# tile 3 is missing, tile 4 is not in a plan of 4 tiles
+	with pytest.raises(Exception):
+		genome_wide_minima(minima, n_tiles=5)
+	with pytest.raises(Exception):
+		genome_wide_minima(minima, n_tiles=4, skip=[3])
+	minima[4] = minima[4][:100]
+	with pytest.raises(Exception):
+		genome_wide_minima(minima)
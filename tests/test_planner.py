@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from epistasis_planner import make_plan, verify_plan, write_plan, block_pairs, parse_tiles, format_tiles
+
+
+@pytest.mark.parametrize('n_snps, group_size', [(1, 1), (2, 1), (10, 3), (97, 97), (100, 7), (250, 40)])
+def test_plan_covers_every_pair_once(n_snps, group_size):
+	tiles = make_plan(n_snps, group_size)
+	verify_plan(tiles, n_snps)
+	covered = np.zeros((n_snps, n_snps), dtype=int)
+	for tile in tiles:
+		assert sum(block_pairs(block) for block in tile) <= group_size * group_size
+		for start0, end0, start1, end1 in tile:
+			for i in range(start0, end0):
+				for j in range(start1, end1):
+					if start0 != start1 or i < j:
+						covered[min(i, j), max(i, j)] += 1
+	assert np.array_equal(covered, np.triu(np.ones((n_snps, n_snps), dtype=int), 1))
+
+
+def test_verify_plan_rejects_bad_plans():
+	tiles = make_plan(20, 5)
+	with pytest.raises(Exception):
+		verify_plan(tiles[1:], 20)
+	with pytest.raises(Exception):
+		verify_plan(tiles + [tiles[0]], 20)
+	with pytest.raises(Exception):
+		verify_plan([[(0, 10, 5, 15)]] + tiles, 20)
+
+
+@pytest.mark.parametrize('tile_ids', [[0], [3, 4, 5], [0, 1, 3], [1, 4, 7, 8, 9], [12, 2, 10, 11]])
+def test_tile_specs_round_trip(tile_ids):
+	spec = format_tiles(tile_ids)
+	# HTCondor splits queue items on commas
+	assert ',' not in spec and ' ' not in spec
+	assert parse_tiles(spec) == sorted(tile_ids)
+
+
+def test_parse_tiles():
+	assert parse_tiles('7') == [7]
+	assert parse_tiles('0-1+3') == parse_tiles('0-1,3') == [0, 1, 3]
+	# a packed job's process number
+	assert parse_tiles('2', tiles_per_job=4) == [8, 9, 10, 11]
+
+
+def test_job_list_packs_tiles(tmp_path):
+	from epistasis_server import job_list
+
+	plan_file = str(tmp_path / 'd.plan.txt')
+	tiles = make_plan(40, 8)
+	write_plan(plan_file, tiles, 40, 8)
+	jobs = job_list(plan_file, tiles_per_job=4)
+	assert len(jobs) == -(-len(tiles) // 4)
+	assert sum((parse_tiles(job) for job in jobs), []) == list(range(len(tiles)))
+
+	jobs = job_list(plan_file, tiles_per_job=3, tasks=[0, 1, 2, 4, 6, 7], skip=[1])
+	assert jobs == ['0+2+4', '6-7']
@@ -0,0 +1,43 @@
+import glob
+import shutil
+
+import pytest
+
+from epistasis_planner import make_plan, write_plan
+from epistasis_resources import estimate_memory, estimate_disk, estimate_resources, EXCLUDE_COPIES, MB
+
+
+def test_float32_halves_the_numpy_rotations():
+	terms = [dict(estimate_memory(2000, 50000, 80000, (400, 400), 'numpy', dtype=dtype)) for dtype in ['float64', 'float32']]
+	for term in ['G0 eigenvectors', 'product columns']:
+		assert terms[1][term] == pytest.approx(terms[0][term] / 2)
+	assert terms[1]['results'] == terms[0]['results']
+
+
+def test_thresholded_and_binary_results_take_less_disk():
+	disk = [dict(estimate_disk(10, 10 ** 6, 1000, output_format=output_format, threshold=threshold))['results'] for output_format, threshold in
+			[('text', 1.0), ('text', 1e-3), ('binary', 1.0)]]
+	assert disk[1] == pytest.approx(disk[0] * 1e-3) and disk[2] < disk[0] / 5
+
+
+def test_leave_region_out_models_of_the_whole_job(dataset, tmp_path):
+	from epistasis_windows import precompute_windows
+
+	for filename in glob.glob(dataset + '.*'):
+		shutil.copy(filename, str(tmp_path))
+	precompute_windows(str(tmp_path / 'd'))
+	n = 80
+	models_mb = lambda models: 8.0 * n * n * (EXCLUDE_COPIES + models) / MB
+	cache_mb = lambda models: 8.0 * n * n * models / MB
+
+	# tiles 0 and 1 only exclude chromosome 1, tile 2 spans both
+	write_plan(str(tmp_path / 'd.plan.txt'), [[(0, 5, 5, 10)], [(0, 5, 10, 15)], [(0, 15, 15, 30)]], 30, 15)
+	for jobs, models in [(['0+1'], 1), (['2'], 1), (['0-2'], 2)]:
+		resources = estimate_resources(str(tmp_path), 'd', jobs=jobs, exclude=True)
+		assert dict(resources['memory'])['leave-region-out models'] == pytest.approx(models_mb(models))
+		assert dict(resources['disk'])['window cache files'] == pytest.approx(cache_mb(models))
+
+	# a block spanning every window is tested in parts: three window sets
+	write_plan(str(tmp_path / 'd.plan.txt'), make_plan(30, 30), 30, 30)
+	resources = estimate_resources(str(tmp_path), 'd', exclude=True)
+	assert dict(resources['memory'])['leave-region-out models'] == pytest.approx(models_mb(3))
@@ -0,0 +1,32 @@
+import os
+import shutil
+
+import numpy as np
+from pysnptools.snpreader import Bed
+
+from epistasis_planner import make_plan
+from epistasis_shards import write_shards, shards_current, shard_files, tile_groups, open_bed, ShardedBed
+
+
+def test_sharded_bed_reads_like_the_bed(dataset, tmp_path):
+	prefix = str(tmp_path / 'd.FILTERED')
+	for suffix in ['.bed', '.bim', '.fam']:
+		shutil.copyfile(dataset + '.FILTERED' + suffix, prefix + suffix)
+	bed = Bed(prefix, count_A1=False)
+	assert write_shards(prefix, 7) == 5
+	assert shards_current(prefix, 30, 7) and not shards_current(prefix, 30, 6)
+
+	# a job only gets the .bim/.fam and the shards of its tiles
+	tile = make_plan(30, 7)[3]
+	groups = tile_groups([tile], 7)
+	expected = bed.read().val
+	os.remove(prefix + '.bed')
+	for filename in shard_files(prefix, set(range(5)).difference(groups)):
+		os.remove(filename)
+	sharded = open_bed(prefix, 7, count_A1=False)
+	assert isinstance(sharded, ShardedBed)
+	assert list(sharded.sid) == list(bed.sid) and list(sharded.iid[:, 1]) == list(bed.iid[:, 1])
+	np.testing.assert_array_equal(sharded.pos, bed.pos)
+	for start0, end0, start1, end1 in tile:
+		sid_index = np.r_[start1:end1, start0:end0]
+		np.testing.assert_array_equal(sharded[::2, sid_index].read().val, expected[::2][:, sid_index])
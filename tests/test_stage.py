@@ -0,0 +1,35 @@
+import pytest
+
+from epistasis_stage import stage_file, stage_dataset, read_individuals
+
+
+def write(path, text):
+	f = open(str(path), 'w')
+	f.write(text)
+	f.close()
+
+
+def test_stage_cleans_and_orders_rows(tmp_path):
+	write(tmp_path / 'd.tfam', 'f1 i1 0 0 0 -9\nf2 i2 0 0 0 -9\nf3 i3 0 0 0 -9\n')
+	write(tmp_path / 'd.pheno.txt', 'FID\tIID\tbody weight\tNA12/x\n'
+									'f3\ti3\t1.5\tNA\n'
+									'f9\ti9\t2\t3\n'
+									'f1\ti1\t#NUM!\t7\n')
+	counts = stage_file(str(tmp_path / 'd.pheno.txt'), read_individuals(str(tmp_path / 'd.tfam')))
+	assert counts['individuals'] == 2 and counts['missing'] == 2 and counts['renamed'] == 2
+	assert counts['extra'] == [('f9', 'i9')] and counts['absent'] == 1 and counts['reordered']
+	staged = open(str(tmp_path / 'd.pheno.txt')).read()
+	assert staged == 'FID\tIID\tbody.weight\tNA12.x\nf1\ti1\t-9\t7\nf3\ti3\t1.5\t-9\n'
+
+	# staging a cleaned file again doesn't change it
+	stage_dataset(str(tmp_path), 'd')
+	assert open(str(tmp_path / 'd.pheno.txt')).read() == staged
+
+
+@pytest.mark.parametrize('text', ['FID\tIID\tt\nf1\ti1\tabc\n', 'FID\tIID\tt\nf1\ti1\t1\nf1\ti1\t2\n', 'FID\tIID\tt\tt\nf1\ti1\t1\t2\n', 'FID\tIID\tt\nf1\ti1\n'])
+def test_stage_rejects_bad_files(tmp_path, text):
+	write(tmp_path / 'd.pheno.txt', text)
+	with pytest.raises(Exception):
+		stage_file(str(tmp_path / 'd.pheno.txt'))
+	# a failed run leaves the original as it was
+	assert open(str(tmp_path / 'd.pheno.txt')).read() == text
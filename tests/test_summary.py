@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from scipy.stats import chi2
+
+from epistasis_summary import summarize_pvalues, write_summary, read_summary, combine, inflation, NULL_MEDIAN_CHI2
+
+
+def test_summary_round_trip(tmp_path):
+	pvalues = np.random.RandomState(0).uniform(size=1000)
+	summary = summarize_pvalues(pvalues, threshold=0.01, excluded=3)
+	write_summary(str(tmp_path / 'd_0.summary.txt'), summary)
+	read = read_summary(str(tmp_path / 'd_0.summary.txt'))
+	assert read['pairs'] == 1000 and read['excluded'] == 3 and read['written'] == (pvalues <= 0.01).sum()
+	assert read['min_p'] == pvalues.min()
+	np.testing.assert_array_equal(read['histogram'], summary['histogram'])
+	np.testing.assert_array_equal(read['chi2_histogram'], summary['chi2_histogram'])
+
+
+def test_combined_median_is_genome_wide():
+	# tiles of very different sizes and inflation: a median of the tile
+	# medians (weighted or not) is far from the median of all pairs
+	rng = np.random.RandomState(1)
+	tiles = [chi2.sf(scale * rng.chisquare(1, size), 1) for size, scale in [(20000, 1.0), (500, 3.0), (5000, 0.5), (50, 10.0)]]
+	total = combine(summarize_pvalues(pvalues) for pvalues in tiles)
+	everything = np.concatenate(tiles)
+	assert total['tiles'] == 4 and total['pairs'] == len(everything) and total['min_p'] == everything.min()
+	expected = np.median(chi2.isf(everything, 1))
+	assert abs(total['median_chi2'] - expected) < 0.002
+	assert inflation(total) == pytest.approx(expected / NULL_MEDIAN_CHI2, abs=0.005)
+
+
+def test_combine_without_chi2_histograms():
+	old = summarize_pvalues(np.random.RandomState(2).uniform(size=100))
+	del old['chi2_histogram']
+	assert np.isnan(combine([old, summarize_pvalues([0.5])])['median_chi2'])
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+from epistasis_tped import convert, pack_bed, HOM_A1, MISSING, HET, HOM_A2
+
+
+def test_pack_bed():
+	codes = np.array([[HOM_A1, MISSING, HET, HOM_A2, HET]], dtype=np.uint8)
+	assert pack_bed(codes).tolist() == [[0b11100100, 0b10]]
+	# a chunk whose SNPs were all filtered out
+	assert pack_bed(codes[:0]).shape == (0, 2)
+
+
+def test_tped_bed_round_trip(tmp_path):
+	from pysnptools.snpreader import Bed
+
+	# minor allele doses of 6 individuals, nan for missing
+	doses = np.array([[0, 1, 2, 1, 0, 0],
+					  [0, 0, 1, 2, 1, 1],
+					  [1, np.nan, 0, 0, 1, 0],
+					  [0, 0, 0, 0, 0, 0],
+					  [1, np.nan, np.nan, 0, 2, 1]])
+	tped = open(str(tmp_path / 'x.tped'), 'w')
+	for j, row in enumerate(doses):
+		# the major allele is A on even lines and T on odd ones
+		major, minor = ['AC', 'TG'][j % 2]
+		alleles = []
+		for dose in row:
+			alleles += [['0', '0'] if np.isnan(dose) else [minor] * int(dose) + [major] * (2 - int(dose))]
+		tped.write('%s snp%s 0 %s %s\n' % (['1', 'X'][j == 4], j, 1000 * (j + 1), ' '.join(sum(alleles, []))))
+	tped.close()
+	tfam = open(str(tmp_path / 'x.tfam'), 'w')
+	for i in range(doses.shape[1]):
+		tfam.write('f%s i%s 0 0 0 -9\n' % (i, i))
+	tfam.close()
+
+	# the monomorphic snp3 and snp4 with a third of its genotypes missing are
+	# dropped, which leaves the last chunk (snp4 alone) empty
+	output = str(tmp_path / 'x')
+	assert convert(str(tmp_path / 'x.tped'), str(tmp_path / 'x.tfam'), output, maf=0.05, geno=0.2, chunk_snps=2) == (5, 3)
+	bed = Bed(output, count_A1=True).read()
+	assert list(bed.sid) == ['snp0', 'snp1', 'snp2']
+	np.testing.assert_array_equal(bed.val.T, doses[:3])
+	bim = pd.read_csv(output + '.bim', sep='\t', header=None)
+	assert list(bim[4]) == ['C', 'G', 'C'] and list(bim[5]) == ['A', 'T', 'A']
+
+	# species chromosome codes
+	convert(str(tmp_path / 'x.tped'), str(tmp_path / 'x.tfam'), output, maf=0.0, geno=1.0, species='mouse')
+	assert list(pd.read_csv(output + '.bim', sep='\t', header=None)[0]) == [1, 1, 1, 1, 20]
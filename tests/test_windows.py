@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pytest
+
+from epistasis_windows import precompute_windows, read_windows, window_sets, tile_windows, WindowKinship
+
+
+@pytest.fixture
+def windows_file(dataset, tmp_path):
+	'''
+	Per-chromosome K0 contributions of the generated dataset (chromosome 1
+	is window 0, chromosome 2 window 1)
+	'''
+	return precompute_windows(dataset, output_file=str(tmp_path / 'd.windows.npz'))
+
+
+def test_blocks_spanning_every_window_are_split(dataset, windows_file):
+	from epistasis_pairs import load_positions
+
+	chrom, bp = load_positions(dataset + '.FILTERED')
+	windows = read_windows(windows_file)
+	assert list(windows['chrom']) == [1, 2] and list(windows['sid_count']) == [15, 15]
+	tiles = [[(0, 30, 0, 30)], [(0, 10, 20, 30)], [(0, 5, 5, 10)]]
+	assert window_sets(windows, tiles, chrom, bp) == [(0,), (0, 1), (1,)]
+	assert window_sets(windows, tiles[2:], chrom, bp) == [(0,)]
+	assert tile_windows(windows_file, tiles[1:], chrom, bp) == [0, 1]
+
+
+def test_leave_chromosome_out_models(dataset, windows_file):
+	from epistasis_kinship import load_inputs, compute_kinship
+
+	test_snps, pheno, covar, G0 = load_inputs(dataset)
+	kinship = compute_kinship(pheno, covar, G0)
+	chrom, bp = G0.pos[:, 0], G0.pos[:, 2]
+	windows = WindowKinship(windows_file, kinship, pheno['vals'][:, None], covar, max_models=1)
+	assert windows.parts(chrom, bp, (0, 30, 0, 30)) == [(0, 15, 0, 15), (0, 15, 15, 30), (15, 30, 15, 30)]
+	assert windows.parts(chrom, bp, (0, 10, 10, 15)) == [(0, 10, 10, 15)]
+
+	# SNPs of chromosome 1 are tested against the K0 of chromosome 2
+	model = windows.model(chrom[:3], bp[:3])
+	on2 = compute_kinship(pheno, covar, G0[:, chrom == 2])
+	model_kinship, log_deltas, cache_file = model
+	assert model_kinship['sid_count'] == 15
+	np.testing.assert_allclose((model_kinship['U'] * model_kinship['S']).dot(model_kinship['U'].T), (on2['U'] * on2['S']).dot(on2['U'].T), atol=1e-8)
+	assert log_deltas[0] == pytest.approx(on2['log_delta'], abs=1e-4)
+	assert windows.model(chrom[5:8], bp[5:8]) is model
+
+	# max_models=1: the next window set replaces the model and its cache file
+	other = windows.model(chrom[20:22], bp[20:22])
+	assert other[0]['sid_count'] == 15 and list(windows.models) == [(1,)]
+	assert not os.path.exists(cache_file) and os.path.exists(other[2])
+	windows.close()
+	assert not os.path.exists(other[2])